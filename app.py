@@ -1,17 +1,41 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import re
+import os
+import uuid
+import hashlib
 
 # Importando módulos do Backend
-from src.parser import initial_preprocess
-from src.config import APP_NAME, APP_VERSION
-# Importamos a função de ajuste OLS
-from src.external_model import fit_regression_from_formula
-# Importamos a geração de PDF
-from src.report_export import gerar_pdf_relatorio
+# Importação de vários arquivos/abas em paralelo (com reconciliação de colunas)
+from src.importer import import_sources, normalize_header
+from src.config import (APP_NAME, APP_VERSION, DEFAULT_EQUATION_LIBRARY, PROFILE_JSON_LOG, JOB_INLINE_WAIT_S, JOB_POLL_INTERVAL_S, STREAM_CHUNK_ROWS,
+                        SERVER_DATA_ROOT, DATASET_STORE_ADMIN, VOLUME_TABLE_DAP_STEP, VOLUME_TABLE_HT_STEP, PROGRESSIVE_MIN_ROWS,
+                        CLEANING_T_THRESHOLD, CLEANING_MAX_ROUNDS, CLEANING_MAX_FRACTION, WLS_K_GRID,
+                        AGGREGATION_PLOT_AREA_M2, AGGREGATION_ALPHA, AGGREGATION_MAX_ERROR_PCT)
+# Importamos a função de ajuste OLS (memorizada: reruns repetidos não refazem o ajuste)
+from src.cache import FIT_CACHE, RENDER_CACHE, normalize_filters, evaluate_manual_cached
+# Datasets deduplicados e compartilhados entre sessões
+from src.datastore import DATASET_STORE
 # Importamos os gráficos interativos
-from src.plots import gerar_graficos_interativos
+from src.plots import gerar_spec_graficos, gerar_grafico_sensibilidade, gerar_spec_influencia
+# Diagnósticos de influência (alavancagem, resíduo studentizado, Cook, DFFITS)
+from src.influence import INFLUENCE_LABELS, top_influential
+# Instrumentação por etapa (painel Performance)
+from src.profiling import start_trace, finish_trace, attach_trace, span
+# Busca automática de equações (matriz de Gram + atualizações de Cholesky)
+from src.model_search import TRANSFORMS, search_models
+# Modo Manual (equação compilada + varredura de coeficientes)
+from src.manual_model import build_coefficient_grid, sweep_manual_coefficients
+# Jobs em segundo plano (pool compartilhado, progresso e cancelamento)
+from src.jobs import JOB_MANAGER, job_fit, job_fit_progressive, job_clean, job_fit_multi, job_fit_wls, job_identity_test, job_fit_streaming, job_batch_screen, job_aggregate, job_report, job_export
+from src.result_export import EXPORT_FORMATS
+from src.volume_table import volume_table_cached
+from src.progressive import coefficient_deltas
+from src.residual_cleaning import cleaning_table
+from src.weighted_model import WLS_CRITERIA
+from src.model_identity import identity_verdict
+from src.aggregation import ALL_SPECIES, SPEC_ROLES, aggregation_cached, guess_inventory_columns
+from src.streaming_model import source_columns, resolve_server_path
 
 # ==============================================================================
 # 1. CONFIGURAÇÃO DA PÁGINA
@@ -62,8 +86,8 @@ st.markdown("""
 # 2. INICIALIZAÇÃO DO ESTADO
 # ==============================================================================
 def init_session_state():
-    if 'df_raw' not in st.session_state: st.session_state['df_raw'] = None
-    if 'df_filtered' not in st.session_state: st.session_state['df_filtered'] = None
+    # Os DataFrames ficam no armazenamento compartilhado; a sessão guarda só a chave
+    if 'dataset_key' not in st.session_state: st.session_state['dataset_key'] = None
     if 'file_name' not in st.session_state: st.session_state['file_name'] = ""
     if 'saved_models' not in st.session_state: st.session_state['saved_models'] = []
     if 'last_results' not in st.session_state: st.session_state['last_results'] = None
@@ -78,21 +102,159 @@ def init_session_state():
     
     # NOVA BIBLIOTECA DE EQUAÇÕES
     if 'equation_library' not in st.session_state:
-        st.session_state['equation_library'] = {
-            "Linear Simples": "Y = b0 + b1*DAP",
-            "Linear Múltiplo": "Y = b0 + b1*DAP + b2*HT",
-            "Schumacher-Hall (Log)": "ln(Y) = b0 + b1*ln(DAP) + b2*ln(HT)",
-            "Spurr (Potência)": "Y = b0 + b1 * (DAP**2 * HT)",
-            "Hipsométrica (Log-Lin)": "ln(HT) = b0 + b1 * (1/DAP)",
-            "Polinomial Quadrática": "Y = b0 + b1*DAP + b2*(DAP**2)"
-        }
+        st.session_state['equation_library'] = dict(DEFAULT_EQUATION_LIBRARY)
     if 'selected_eq_name' not in st.session_state: st.session_state['selected_eq_name'] = ""
 
+    # Dono dos jobs em segundo plano desta sessão
+    if 'session_id' not in st.session_state: st.session_state['session_id'] = uuid.uuid4().hex
+    # Libera as referências da sessão no armazenamento de datasets quando ela termina
+    if 'dataset_token' not in st.session_state:
+        st.session_state['dataset_token'] = DATASET_STORE.session_token(st.session_state['session_id'])
+
 init_session_state()
 
+# Cada execução do script (rerun) é uma requisição com seu próprio trace de etapas
+_trace = start_trace("app", cprofile=st.session_state.pop('cprofile_next_run', False))
+
 def reset_zoom():
     st.session_state['chart_key'] += 1
 
+def aplicar_resultado_ajuste(res, meta):
+    """Completa o resultado OLS com os dados do formulário e o torna o resultado atual."""
+    if "error" in res:
+        st.error(res["error"])
+        return
+    res['method'] = meta.get('method', 'OLS')
+    res['name'] = meta['name']
+    res['is_log'] = "ln(" in meta['equation'].split("=")[0]
+    res['alias_map_used'] = meta['alias_map']
+    res['y_col_name'] = meta['y_col']
+    res['dataset_ref'] = meta.get('dataset_ref')
+    st.session_state['last_results'] = res
+    st.session_state['chart_key'] += 1
+
+def aplicar_previa(job, meta):
+    """Mostra a prévia (subamostra) do ajuste progressivo até o resultado completo chegar."""
+    st.session_state.setdefault('jobs_partial_seen', set()).add(job.id)
+    aplicar_resultado_ajuste(job.partial['result'], {**meta, 'method': 'OLS (prévia)'})
+    st.session_state['progressive_info'] = {k: v for k, v in job.partial.items() if k != 'result'}
+
+def concluir_progressivo(job, meta):
+    """Troca a prévia pelo ajuste completo e guarda a distância entre os dois."""
+    aplicar_resultado_ajuste(job.result, meta)
+    if job.partial and "error" not in job.result:
+        st.session_state['progressive_deltas'] = {
+            "result_id": job.result.result_id, "tabela": coefficient_deltas(job.partial['result'], job.result),
+            **{k: v for k, v in job.partial.items() if k != 'result'},
+        }
+
+def aplicar_resultados_multialvo(results, meta):
+    """Um resultado por alvo: todos vão para os modelos salvos; o primeiro vira o resultado atual."""
+    if isinstance(results.get("error"), str):
+        st.error(results["error"])
+        return
+    rows, first = [], None
+    for y, res in results.items():
+        if "error" in res:
+            rows.append({"Alvo": y, "Erro": res["error"]})
+            continue
+        aplicar_resultado_ajuste(res, {**meta, 'name': f"{meta['name']} [{y}]", 'y_col': y,
+                                       'alias_map': {**meta['alias_map'], meta['y_alias']: y}})
+        st.session_state['saved_models'].append(res)
+        rows.append({"Alvo": y, "R² Aj.": res['r2_adj'], "Syx %": res['syx_pct'], "AIC": res['aic'], "N": res['n_obs']})
+        first = first or res
+    if first is not None:
+        st.session_state['last_results'] = first
+    st.session_state['multi_summary'] = pd.DataFrame(rows)
+
+def submeter_job(kind, label, func, *args, **kwargs):
+    """Agenda no pool e espera um pouco: jobs rápidos terminam no próprio rerun."""
+    # Com o cProfile pedido para esta execução, o job (outra thread) também é perfilado
+    job = JOB_MANAGER.submit(kind, label, func, *args, owner=st.session_state['session_id'],
+                             profile=_trace.profiling, **kwargs)
+    if job.wait(JOB_INLINE_WAIT_S):
+        attach_trace(job.trace)  # Etapas do job aparecem no painel Performance desta execução
+    return job
+
+def painel_tarefas():
+    """Progresso dos jobs desta sessão; atualiza sozinho enquanto houver job ativo."""
+    jobs = JOB_MANAGER.jobs_for(st.session_state['session_id'])
+    visible = [j for j in jobs if not j.done or j.id in st.session_state.get('jobs_unseen', ())]
+    if not visible:
+        return
+    st.markdown("#### 🧵 Tarefas em Segundo Plano")
+    for job in visible:
+        c_info, c_btn = st.columns([5, 1])
+        with c_info:
+            st.progress(job.progress, text=f"**{job.label}** — {job.status} | {job.message} ({job.elapsed:.1f} s)")
+            if job.error: st.error(job.error)
+            elif isinstance(job.result, dict) and "error" in job.result: st.error(job.result["error"])
+        with c_btn:
+            if not job.done:
+                if st.button("✖ Cancelar", key=f"cancel_{job.id}"):
+                    job.cancel()
+            elif st.button("OK", key=f"dismiss_{job.id}"):
+                st.session_state['jobs_unseen'].discard(job.id)
+                st.rerun()
+
+    # Prévias publicadas por jobs ainda em execução (ajuste progressivo)
+    for job in visible:
+        if not job.done and job.partial is not None and job.id in st.session_state['jobs_pending'] \
+                and job.id not in st.session_state.get('jobs_partial_seen', ()):
+            aplicar_previa(job, st.session_state['jobs_pending'][job.id])
+            st.rerun()
+
+    # Jobs que terminaram desde a última atualização: entrega o resultado ao app
+    finished = False
+    for job in visible:
+        pending = st.session_state['jobs_pending']
+        if job.done and job.id in pending:
+            meta = pending.pop(job.id)
+            if job.status == "concluído":
+                if job.kind in ("ajuste", "ajuste_streaming", "limpeza", "ajuste_wls"): aplicar_resultado_ajuste(job.result, meta)
+                elif job.kind == "ajuste_progressivo": concluir_progressivo(job, meta)
+                elif job.kind == "ajuste_multi": aplicar_resultados_multialvo(job.result, meta)
+                elif job.kind == "triagem": st.session_state['screen_results'] = job.result
+                elif job.kind == "identidade": st.session_state['identity_results'] = job.result
+                elif job.kind == "agregacao": aplicar_agregacao(job.result, meta)
+                elif job.kind == "relatorio": st.session_state['report_pdf'] = job.result
+                elif job.kind == "exportacao": st.session_state[f"export_zip_{meta['key']}"] = job.result
+            finished = True
+    if finished:
+        st.rerun()
+
+def resolver_dataset(res):
+    """DataFrame do ajuste (IDs e linhas removidas na exportação); None se já saiu do armazenamento."""
+    key = res.get('dataset_ref')
+    return DATASET_STORE.get(key) if key and key in DATASET_STORE else None
+
+def botoes_exportacao(results_list, key):
+    """Formato + botão de exportação colunar; o .zip é gerado em job e baixado aqui."""
+    c_fmt, c_go, c_dl = st.columns([1, 1, 2])
+    fmt = c_fmt.selectbox("Formato:", list(EXPORT_FORMATS), key=f"export_fmt_{key}", label_visibility="collapsed")
+    ids = [r.result_id for r in results_list]
+    if c_go.button("📦 Exportar", key=f"export_{key}"):
+        job = submeter_job("exportacao", f"Exportação ({fmt}, {len(ids)} modelo(s))", job_export, list(results_list), fmt, resolver_dataset)
+        if not job.done: acompanhar_job(job, {'key': key})
+        elif job.error: st.error(f"Erro na exportação: {job.error}")
+        elif job.result is not None: st.session_state[f"export_zip_{key}"] = job.result
+    out = st.session_state.get(f"export_zip_{key}")
+    if out and out['result_ids'] == ids and out['fmt'] == fmt:
+        c_dl.download_button(f"Baixar .zip ({len(out['bytes']) / 1024**2:.1f} MB)", out['bytes'],
+                             file_name=f"resultados_{key}_{fmt}.zip", mime="application/zip", key=f"export_dl_{key}")
+
+def aplicar_agregacao(out, meta):
+    """Guarda a especificação no resultado: tabelas (no cache), PDF e exportação passam a incluí-la."""
+    if out is None or "error" in out:
+        st.error((out or {}).get("error", "Agregação sem resultado."))
+        return
+    meta['result']['aggregation'] = meta['spec']
+
+def acompanhar_job(job, meta=None):
+    """Registra um job ainda em execução para o painel entregar o resultado quando terminar."""
+    st.session_state.setdefault('jobs_pending', {})[job.id] = meta or {}
+    st.session_state.setdefault('jobs_unseen', set()).add(job.id)
+
 # ==============================================================================
 # 3. FUNÇÕES AUXILIARES
 # ==============================================================================
@@ -141,43 +303,15 @@ def auditar_qualidade_dados(df):
         
     return report
 
-@st.cache_data
-def load_data(uploaded_file):
-    try:
-        if uploaded_file.name.endswith('.csv'): df = pd.read_csv(uploaded_file)
-        else: df = pd.read_excel(uploaded_file)
-        return initial_preprocess(df)
-    except Exception as e:
-        st.error(f"Erro ao ler arquivo: {e}")
-        return None
-
-def extract_coefficients_from_formula(equation):
-    return sorted(list(set(re.findall(r"\b(b\d+)\b", equation))))
-
-def calculate_manual_prediction(df, equation, alias_map, coef_values):
-    local_env = {}
-    for alias, col_real in alias_map.items():
-        if col_real in df.columns:
-            local_env[alias] = df[col_real].values
-        else:
-            return None, f"Coluna '{col_real}' não encontrada."
-
-    local_env.update(coef_values)
-    safe_math = {"ln": np.log, "log": np.log, "exp": np.exp, "sqrt": np.sqrt, "np": np}
-    local_env.update(safe_math)
-
-    try:
-        rhs = equation.split("=")[1].strip()
-        y_pred = eval(rhs, {"__builtins__": {}}, local_env)
-        
-        lhs = equation.split("=")[0].strip()
-        is_log = "ln(" in lhs or "log(" in lhs
-        if is_log:
-            y_pred = np.exp(y_pred)
-        
-        return y_pred, None
-    except Exception as e:
-        return None, str(e)
+def load_data(payloads):
+    """Lê e limpa os arquivos enviados (em paralelo); o relatório por arquivo/aba fica na sessão."""
+    with span("parser.leitura_arquivo") as sp:
+        df, import_report = import_sources(payloads)
+        sp.rows = 0 if df is None else len(df)
+    st.session_state['import_report'] = import_report
+    if df is None:
+        st.error("Nenhum arquivo pôde ser lido. Veja o relatório de importação.")
+    return df
 
 # ==============================================================================
 # 4. SIDEBAR
@@ -187,41 +321,79 @@ with st.sidebar:
     st.caption(f"v{APP_VERSION}")
     st.divider()
 
-    uploaded_file = st.file_uploader("Importar Dados", type=['csv', 'xlsx', 'xls'])
-    if uploaded_file:
-        if st.session_state['file_name'] != uploaded_file.name:
-            df_loaded = load_data(uploaded_file)
-            if df_loaded is not None:
-                st.session_state['df_raw'] = df_loaded
-                st.session_state['df_filtered'] = df_loaded.copy()
-                st.session_state['file_name'] = uploaded_file.name
+    session_id = st.session_state['session_id']
+    # Dataset da sessão: referência somente leitura ao armazenamento compartilhado
+    df_raw = DATASET_STORE.get(st.session_state['dataset_key'])
+    if df_raw is None and st.session_state['dataset_key']:
+        st.session_state['dataset_key'] = None
+        st.session_state['file_name'] = ""
+        st.warning("Os dados desta sessão foram liberados da memória do servidor. Importe o arquivo novamente.")
+
+    uploaded_files = st.file_uploader("Importar Dados", type=['csv', 'xlsx', 'xls'], accept_multiple_files=True,
+                                      help="Várias planilhas (ex: uma por equipe) viram um único dataset, com as colunas 'source_file' e 'source_sheet'.")
+    if uploaded_files:
+        upload_name = " + ".join(f.name for f in uploaded_files)
+        if st.session_state['file_name'] != upload_name:
+            payloads = [(f.name, f.getvalue()) for f in uploaded_files]
+            upload_digest = b"".join(hashlib.blake2b(name.encode("utf-8") + b"\0" + data, digest_size=16).digest() for name, data in payloads)
+            # Mesmos arquivos já importados por outra sessão: reaproveita, sem ler/limpar de novo
+            st.session_state['import_report'] = None
+            key = DATASET_STORE.put_upload(upload_digest, upload_name, lambda: load_data(payloads))
+            if key is not None:
+                DATASET_STORE.acquire(session_id, "bruto", key)
+                # Chave do cache de ajustes: conteúdo do arquivo (os filtros entram à parte)
+                st.session_state['dataset_key'] = key
+                st.session_state['file_name'] = upload_name
                 st.session_state['last_results'] = None 
                 
                 # RODAR AUDITORIA IMEDIATAMENTE AO CARREGAR
-                st.session_state['audit_report'] = auditar_qualidade_dados(df_loaded)
+                st.session_state['audit_report'] = auditar_qualidade_dados(DATASET_STORE.get(key))
                 
                 st.success("Carregado!")
                 st.rerun()
 
-    if st.session_state['df_raw'] is not None:
+    import_report = st.session_state.get('import_report')
+    if import_report is not None and (len(import_report) > 1 or (import_report['status'] != "ok").any()):
+        n_err = int((import_report['status'] == "erro").sum())
+        with st.expander(f"📑 Relatório de Importação ({n_err} com erro)" if n_err else "📑 Relatório de Importação", expanded=n_err > 0):
+            st.dataframe(import_report, use_container_width=True, hide_index=True)
+            for final, variants in import_report.attrs.get("colunas_unificadas", {}).items():
+                st.caption(f"'{final}' unifica: {', '.join(variants)}")
+
+    df_filtered = df_raw
+    if df_raw is not None:
         st.divider()
         st.subheader("🔍 Filtros em Cascata")
-        df_funnel = st.session_state['df_raw'].copy()
+        df_funnel = df_raw
         cols_to_filter = st.multiselect("Colunas de Filtro:", df_funnel.columns.tolist())
         
+        # Cada etapa da cascata é um derivado do bruto pela seleção acumulada:
+        # reruns (e outras sessões) com a mesma seleção reaproveitam o DataFrame sem refiltrar
+        filter_state = {}
+        filtered_key = st.session_state['dataset_key']
         for col in cols_to_filter:
-            available = sorted(df_funnel[col].astype(str).unique())
+            available = DATASET_STORE.column_options(filtered_key, col)
             sel = st.multiselect(f"Valores de '{col}':", available)
-            if sel: df_funnel = df_funnel[df_funnel[col].astype(str).isin(sel)]
+            if sel:
+                filter_state[col] = sel
+                filtered_key = DATASET_STORE.derive(
+                    st.session_state['dataset_key'], normalize_filters(filter_state),
+                    lambda df=df_funnel, col=col, sel=sel: df[df[col].astype(str).isin(sel)],
+                    name=f"{st.session_state['file_name']} (filtrado)")
+                df_funnel = DATASET_STORE.get(filtered_key)
             
-        st.session_state['df_filtered'] = df_funnel
+        DATASET_STORE.acquire(session_id, "bruto", st.session_state['dataset_key'])
+        DATASET_STORE.acquire(session_id, "filtrado", filtered_key)
+        st.session_state['filtered_key'] = filtered_key
+        df_filtered = df_funnel
+        st.session_state['filter_state'] = filter_state
         rows = len(df_funnel)
         st.metric("Linhas", rows)
 
 # ==============================================================================
 # 5. ÁREA PRINCIPAL
 # ==============================================================================
-if st.session_state['df_raw'] is not None:
+if df_raw is not None:
     
     # --- PAINEL DE INTEGRIDADE DE DADOS ---
     report = st.session_state.get('audit_report')
@@ -242,12 +414,16 @@ if st.session_state['df_raw'] is not None:
     
     # --- ABA 1 ---
     with tab1:
-        st.dataframe(st.session_state['df_filtered'].head(50), use_container_width=True)
+        st.dataframe(df_filtered.head(50), use_container_width=True)
 
     # --- ABA 2 ---
     with tab2:
-        df_work = st.session_state['df_filtered']
+        df_work = df_filtered
         cols = df_work.columns.tolist()
+        # Escopo do cache: dataset bruto + seleção de filtros (sem re-hashear df_work)
+        cache_scope = {}
+        if st.session_state.get('dataset_key'):
+            cache_scope = {'dataset_key': st.session_state['dataset_key'], 'filter_state': st.session_state.get('filter_state')}
 
         st.header("Construtor de Modelos")
         
@@ -350,6 +526,57 @@ if st.session_state['df_raw'] is not None:
             ```
             """)
 
+        with st.expander("🔎 Busca Automática de Modelos (Best-Subset / Stepwise)", expanded=False):
+            x_aliases = [a for a in alias_map if a != y_alias]
+            if not x_aliases:
+                st.caption("Selecione ao menos uma variável X (com apelido) acima.")
+            else:
+                s1, s2 = st.columns(2)
+                with s1:
+                    search_vars = st.multiselect("Variáveis:", x_aliases, default=x_aliases, key="search_vars")
+                    search_transforms = st.multiselect("Transformações:", list(TRANSFORMS.keys()), default=["linear", "ln", "quadrado", "inverso", "cruzado"],
+                                                       format_func=lambda t: TRANSFORMS[t], key="search_transforms")
+                    search_log = st.checkbox(f"Ajustar ln({y_alias})", value=True, key="search_log")
+                with s2:
+                    search_criterion = st.radio("Critério:", ["aic", "bic", "r2_adj"], format_func=lambda c: {"aic": "AIC", "bic": "BIC", "r2_adj": "R² Ajustado"}[c], horizontal=True, key="search_criterion")
+                    search_k = st.slider("Máximo de termos (além de b0):", 1, 8, 3, key="search_k")
+                    search_method = st.radio("Estratégia:", ["auto", "exaustiva", "stepwise"], horizontal=True, key="search_method")
+
+                if st.button("🔎 Buscar Equações"):
+                    found = search_models(df_work, y_alias, search_vars, alias_map, search_transforms, is_log_y=search_log,
+                                          max_terms=search_k, criterion=search_criterion, method=search_method)
+                    if isinstance(found, dict): st.error(found["error"])
+                    else: st.session_state['search_results'] = found
+
+                found = st.session_state.get('search_results')
+                if found is not None and not found.empty:
+                    st.caption(f"{found.attrs['candidatos']} termos candidatos | {found.attrs['n_obs']} árvores | estratégia: {found.attrs['metodo']}"
+                               + (f" ({found.attrs['subconjuntos']} subconjuntos avaliados)" if found.attrs.get('subconjuntos') else ""))
+                    st.dataframe(found.style.format({"aic": "{:.1f}", "bic": "{:.1f}", "r2_adj": "{:.4f}", "rmse": "{:.4f}"}), use_container_width=True, hide_index=True)
+                    if st.button("📥 Enviar as 5 melhores para a Biblioteca"):
+                        for i, eq in enumerate(found['equacao'].head(5), start=1):
+                            st.session_state['equation_library'][f"Busca #{i} ({search_criterion.upper()})"] = eq
+                        st.success("Equações adicionadas. Carregue-as em 'Carregar Equação da Biblioteca'.")
+                        st.rerun()
+
+        with st.expander("🧪 Triagem em Lote da Biblioteca (segundo plano)", expanded=False):
+            lib = st.session_state['equation_library']
+            screen_eqs = st.multiselect("Equações:", list(lib.keys()), default=list(lib.keys()), key="screen_eqs")
+            screen_group = st.selectbox("Ajustar separadamente por:", ["(todos os dados)"] + cols, key="screen_group")
+            if st.button("▶️ Iniciar Triagem"):
+                if not screen_eqs: st.warning("Escolha ao menos uma equação.")
+                else:
+                    group_col = None if screen_group == "(todos os dados)" else screen_group
+                    job = submeter_job("triagem", f"Triagem ({len(screen_eqs)} equações)", job_batch_screen, df_work,
+                                       {n: lib[n] for n in screen_eqs}, alias_map, group_col=group_col, cache_scope=cache_scope)
+                    if not job.done: acompanhar_job(job)
+                    elif job.error: st.error(f"Erro na triagem: {job.error}")
+                    elif job.result is not None: st.session_state['screen_results'] = job.result
+
+            screen = st.session_state.get('screen_results')
+            if screen is not None and not screen.empty:
+                st.dataframe(screen, use_container_width=True, hide_index=True)
+
         method = st.radio("Método:", ["🤖 Automático (OLS)", "✍️ Manual"], horizontal=True)
 
         # ======================================================
@@ -358,20 +585,120 @@ if st.session_state['df_raw'] is not None:
         
         # MODO AUTOMÁTICO
         if method.startswith("🤖"):
+            progressive = len(df_work) >= PROGRESSIVE_MIN_ROWS and st.checkbox(
+                "⚡ Prévia progressiva (subamostra estratificada primeiro, ajuste completo em seguida)", value=True, key="progressive")
             if st.button("🚀 Calcular Modelo", type="primary"):
                 if not equation_input: st.warning("Digite a equação.")
                 else:
-                    with st.spinner("Processando..."):
-                        res = fit_regression_from_formula(df_work, equation_input, alias_map)
-                        if "error" in res: st.error(res["error"])
+                    meta = {'name': model_name or "Sem Nome", 'equation': equation_input, 'alias_map': alias_map, 'y_col': y_col,
+                            'dataset_ref': st.session_state.get('filtered_key')}
+                    if progressive:
+                        job = submeter_job("ajuste_progressivo", f"Ajuste: {meta['name']}", job_fit_progressive, df_work,
+                                           equation_input, alias_map, cache_scope)
+                        if not job.done:
+                            acompanhar_job(job, meta)
+                            if job.partial is not None: aplicar_previa(job, meta)
+                        elif job.error: st.error(f"Erro no ajuste: {job.error}")
+                        elif job.result is not None: concluir_progressivo(job, meta)
+                    else:
+                        job = submeter_job("ajuste", f"Ajuste: {meta['name']}", job_fit, df_work, equation_input, alias_map, cache_scope)
+                        if not job.done: acompanhar_job(job, meta)
+                        elif job.error: st.error(f"Erro no ajuste: {job.error}")
+                        elif job.result is not None: aplicar_resultado_ajuste(job.result, meta)
+
+            # Arquivos maiores que a memória: lidos em blocos direto do disco do servidor
+            with st.expander("🗄️ Ajuste Out-of-Core (arquivo grande no servidor)", expanded=False):
+                st.caption("Lê o arquivo em blocos (CSV, Parquet ou pasta com um .npy por coluna) usando a equação e os apelidos acima. "
+                           f"As colunas do arquivo devem ter os mesmos nomes das colunas selecionadas. Pasta de dados: {SERVER_DATA_ROOT}")
+                stream_path = st.text_input("Caminho no servidor:", key="stream_path", placeholder="inventario_nacional.csv")
+                stream_chunk = st.number_input("Linhas por bloco:", 10_000, 5_000_000, STREAM_CHUNK_ROWS, step=50_000, key="stream_chunk")
+                if st.button("🚀 Ajustar em Blocos"):
+                    stream_source = resolve_server_path(stream_path) if stream_path else None
+                    if not equation_input or not stream_path: st.warning("Informe a equação e o caminho do arquivo.")
+                    elif isinstance(stream_source, dict): st.error(stream_source["error"])
+                    else:
+                        meta = {'name': model_name or stream_source.name, 'equation': equation_input, 'alias_map': alias_map,
+                                'y_col': y_col, 'method': 'OLS (out-of-core)'}
+                        job = submeter_job("ajuste_streaming", f"Out-of-core: {meta['name']}", job_fit_streaming,
+                                           str(stream_source), equation_input, alias_map, int(stream_chunk))
+                        if not job.done: acompanhar_job(job, meta)
+                        elif job.error: st.error(f"Erro no ajuste: {job.error}")
+                        elif job.result is not None: aplicar_resultado_ajuste(job.result, meta)
+
+            # Mesmo lado direito para vários Y: X montado e fatorado uma vez
+            with st.expander("🎯 Vários Alvos (mesmo lado direito)", expanded=False):
+                st.caption(f"Ajusta a equação acima para cada coluna escolhida no lugar de '{y_alias}' (ex: volume total, comercial, "
+                           "biomassas). Todos os alvos são resolvidos com uma única fatoração de X; os resultados vão para os modelos salvos.")
+                multi_ys = st.multiselect("Colunas Y:", [c for c in cols if c not in x_cols], default=[y_col], key="multi_ys")
+                multi_common = st.radio("Linhas:", ["Comuns a todos os alvos", "Blindagem por alvo"], horizontal=True, key="multi_rows")
+                if st.button("🚀 Ajustar Alvos", key="multi_fit"):
+                    if not equation_input or not multi_ys: st.warning("Informe a equação e ao menos uma coluna Y.")
+                    else:
+                        meta = {'name': model_name or "Sem Nome", 'equation': equation_input, 'alias_map': alias_map, 'y_alias': y_alias,
+                                'method': 'OLS (multialvo)', 'dataset_ref': st.session_state.get('filtered_key')}
+                        job = submeter_job("ajuste_multi", f"Multialvo: {meta['name']} ({len(multi_ys)} Y)", job_fit_multi, df_work,
+                                           equation_input, alias_map, multi_ys, multi_common.startswith("Comuns"))
+                        if not job.done: acompanhar_job(job, meta)
+                        elif job.error: st.error(f"Erro no ajuste: {job.error}")
+                        elif job.result is not None: aplicar_resultados_multialvo(job.result, meta)
+                if st.session_state.get('multi_summary') is not None:
+                    st.dataframe(st.session_state['multi_summary'], use_container_width=True, hide_index=True)
+
+            # Uma equação regional ou uma por talhão? Testes F a partir das somas por grupo
+            with st.expander("🧬 Identidade de Modelos entre Grupos (teste F)", expanded=False):
+                st.caption("Compara a equação acima ajustada por grupo (completo), com inclinações comuns (paralelismo) e "
+                           "única (identidade). X'X, X'y e y'y de cada grupo saem de uma passada pelos dados; os três "
+                           "modelos são resolvidos só com essas somas.")
+                c_g, c_a = st.columns([3, 1])
+                g_default = next((i for i, c in enumerate(cols) if normalize_header(c) == "talhao"), 0)
+                identity_group = c_g.selectbox("Grupo:", cols, index=g_default, key="identity_group")
+                identity_alpha = c_a.number_input("α:", 0.001, 0.2, 0.05, 0.01, key="identity_alpha")
+                if st.button("🧬 Testar Identidade", key="identity_run"):
+                    if not equation_input: st.warning("Digite a equação.")
+                    else:
+                        job = submeter_job("identidade", f"Identidade por {identity_group}", job_identity_test, df_work,
+                                           equation_input, alias_map, identity_group, float(identity_alpha))
+                        if not job.done: acompanhar_job(job)
+                        elif job.error: st.error(f"Erro no teste: {job.error}")
+                        elif job.result is not None: st.session_state['identity_results'] = job.result
+                identity = st.session_state.get('identity_results')
+                if identity is not None:
+                    if "error" in identity: st.error(identity["error"])
+                    else:
+                        tests = identity['testes']
+                        st.info(identity_verdict(tests))
+                        st.dataframe(tests, use_container_width=True, hide_index=True)
+                        st.caption(f"{tests.attrs['grupos']} grupos, {tests.attrs['n_obs']:,} árvores"
+                                   + (f"; {tests.attrs['excluidos']} grupo(s) com n ≤ {tests.attrs['termos']} fora do teste." if tests.attrs['excluidos'] else "."))
+                        st.dataframe(identity['grupos'], use_container_width=True, hide_index=True)
+
+            # Variância crescente com o DAP: pesos 1/X^k, com todos os k avaliados numa única busca em lote
+            with st.expander("⚖️ Mínimos Quadrados Ponderados (pesos 1/X^k)", expanded=False):
+                st.caption("Para resíduos em funil (erro maior nas árvores grossas). A matriz X é montada uma vez e todos os "
+                           "expoentes k são testados juntos; o melhor pelo critério escolhido vira o ajuste completo.")
+                w_options = [a for a in alias_map if a != y_alias]
+                if not w_options:
+                    st.info("Selecione ao menos uma variável X.")
+                else:
+                    c_w, c_c = st.columns(2)
+                    w_default = next((i for i, a in enumerate(w_options) if normalize_header(alias_map[a]) == "dap"), 0)
+                    wls_var = c_w.selectbox("Variável dos pesos:", w_options, index=w_default, key="wls_var")
+                    wls_crit = c_c.selectbox("Critério:", list(WLS_CRITERIA), format_func=WLS_CRITERIA.get, key="wls_crit")
+                    c_a, c_b, c_s = st.columns(3)
+                    k_min = c_a.number_input("k mínimo:", 0.0, 10.0, WLS_K_GRID[0], 0.25, key="wls_kmin")
+                    k_max = c_b.number_input("k máximo:", 0.0, 10.0, WLS_K_GRID[1], 0.25, key="wls_kmax")
+                    k_step = c_s.number_input("Passo:", 0.05, 2.0, WLS_K_GRID[2], 0.05, key="wls_kstep")
+                    if st.button("⚖️ Ajustar WLS", key="wls_fit"):
+                        k_values = np.round(np.arange(k_min, k_max + k_step / 2, k_step), 10)
+                        if not equation_input or not len(k_values): st.warning("Informe a equação e uma faixa de k válida.")
                         else:
-                            res['method'] = 'OLS'
-                            res['name'] = model_name or "Sem Nome"
-                            res['is_log'] = "ln(" in equation_input.split("=")[0]
-                            res['alias_map_used'] = alias_map
-                            res['y_col_name'] = y_col
-                            st.session_state['last_results'] = res
-                            st.session_state['chart_key'] += 1
+                            meta = {'name': model_name or "Sem Nome", 'equation': equation_input, 'alias_map': alias_map, 'y_col': y_col,
+                                    'method': 'WLS', 'dataset_ref': st.session_state.get('filtered_key')}
+                            job = submeter_job("ajuste_wls", f"WLS: {meta['name']} ({len(k_values)} valores de k)", job_fit_wls, df_work,
+                                               equation_input, alias_map, wls_var, k_values, wls_crit)
+                            if not job.done: acompanhar_job(job, meta)
+                            elif job.error: st.error(f"Erro no ajuste: {job.error}")
+                            elif job.result is not None: aplicar_resultado_ajuste(job.result, meta)
         
         # MODO MANUAL
         else:
@@ -398,45 +725,55 @@ if st.session_state['df_raw'] is not None:
                 if not equation_input:
                     st.warning("Digite a equação.")
                 else:
-                    # 1. Calcula a predição manual
-                    y_pred_man, err = calculate_manual_prediction(df_work, equation_input, alias_map, coefs_manual)
-                    
-                    if err:
-                        st.error(err)
+                    res_man = evaluate_manual_cached(df_work, equation_input, alias_map, y_col, coefs_manual, **cache_scope)
+
+                    if "error" in res_man:
+                        st.error(res_man["error"])
                     else:
-                        # 2. Calcula as métricas (Syx, RMSE) para preencher a tabela existente
-                        y_obs = df_work[y_col].values
-                        # Limpa NaNs se houver incompatibilidade de tamanho (segurança)
-                        if len(y_pred_man) != len(y_obs):
-                             st.error("Erro de dimensionalidade. Verifique filtros.")
+                        res_man['name'] = model_name or "Manual"
+                        res_man['dataset_ref'] = st.session_state.get('filtered_key')
+                        st.session_state['last_results'] = res_man
+                        st.session_state['chart_key'] += 1
+
+            # --- VARREDURA DE SENSIBILIDADE (milhares de vetores em uma passada) ---
+            with st.expander("🎚️ Sensibilidade dos Coeficientes (Varredura)", expanded=False):
+                if not equation_input or not coefs_manual:
+                    st.caption("Informe a equação e os coeficientes acima para varrer.")
+                else:
+                    sweep_coefs = st.multiselect("Coeficientes a variar (até 2):", list(coefs_manual.keys()), max_selections=2, key="sweep_coefs")
+                    c_amp, c_pts = st.columns(2)
+                    with c_amp:
+                        amplitude = st.slider("Amplitude (± %):", 1, 100, 10, key="sweep_amplitude")
+                    with c_pts:
+                        n_points = st.slider("Pontos por coeficiente:", 10, 200, 50, key="sweep_points")
+
+                    if sweep_coefs:
+                        spans = {}
+                        for c in sweep_coefs:
+                            base = coefs_manual[c]
+                            delta = abs(base) * amplitude / 100 or amplitude / 100
+                            spans[c] = np.linspace(base - delta, base + delta, n_points)
+
+                        grid = build_coefficient_grid(coefs_manual, spans)
+                        surface = sweep_manual_coefficients(df_work, equation_input, alias_map, y_col, grid)
+
+                        if isinstance(surface, dict):
+                            st.error(surface["error"])
+                        elif not surface['syx_pct'].notna().any():
+                            st.warning("Nenhum vetor gerou predições válidas nessa faixa.")
                         else:
-                            # Métricas Básicas
-                            ss_res = np.sum((y_obs - y_pred_man) ** 2)
-                            ss_tot = np.sum((y_obs - np.mean(y_obs)) ** 2)
-                            r2_man = 1 - (ss_res / ss_tot)
-                            rmse_man = np.sqrt(np.mean((y_obs - y_pred_man) ** 2))
-                            syx_man = (rmse_man / np.mean(y_obs)) * 100
-                            
-                            # Prepara o dicionário 'res' igual ao do OLS para o código de baixo ler
-                            res_man = {
-                                'name': model_name or "Manual",
-                                'equation_fitted': f"Manual: {equation_input}", # Mostra a equação usada
-                                'r2_adj': r2_man,
-                                'rmse': rmse_man,
-                                'syx_pct': syx_man,
-                                'fc_meyer': None, # Não aplicável direto
-                                'aic': 0, # Não calculamos AIC em manual simples
-                                'durbin_watson': 0,
-                                'is_log': "ln(" in equation_input.split("=")[0],
-                                'y_col_real': y_col,
-                                'alias_map_used': alias_map,
-                                'data_points': {
-                                    'y_real': y_obs.tolist(),
-                                    'y_pred': y_pred_man.tolist()
-                                }
-                            }
-                            st.session_state['last_results'] = res_man
-                            st.session_state['chart_key'] += 1
+                            best = surface.loc[surface['syx_pct'].idxmin()]
+                            st.caption(f"{len(surface)} vetores avaliados sobre {surface.attrs['n_obs']} árvores.")
+                            m_cols = st.columns(len(sweep_coefs) + 2)
+                            for i, c in enumerate(sweep_coefs):
+                                m_cols[i].metric(f"Melhor {c}", f"{best[c]:.6f}")
+                            m_cols[-2].metric("Syx % mínimo", f"{best['syx_pct']:.2f}%")
+                            m_cols[-1].metric("Viés %", f"{best['bias_pct']:.2f}%")
+                            st.altair_chart(gerar_grafico_sensibilidade(surface, sweep_coefs), use_container_width=True)
+
+        # Painel de jobs: fragmento que se atualiza sozinho só enquanto há job ativo
+        has_active = any(not j.done for j in JOB_MANAGER.jobs_for(st.session_state['session_id']))
+        st.fragment(painel_tarefas, run_every=JOB_POLL_INTERVAL_S if has_active else None)()
 
         # ==============================================================================
         # 3. RESULTADOS
@@ -471,6 +808,19 @@ if st.session_state['df_raw'] is not None:
 
             st.table(pd.DataFrame(table_data))
 
+            # Ajuste progressivo: prévia em exibição ou comparação com o resultado completo
+            if results.get('method') == 'OLS (prévia)':
+                info = st.session_state.get('progressive_info', {})
+                st.warning(f"⚡ Prévia com {info.get('linhas', 0):,} de {info.get('total', 0):,} árvores "
+                           f"({info.get('estratos', 0)} estratos: {info.get('estratificacao', '')}, {info.get('tempo_s', 0):.2f} s). "
+                           "O ajuste completo está rodando e substituirá este resultado.")
+            deltas = st.session_state.get('progressive_deltas')
+            if deltas and deltas['result_id'] == results.result_id:
+                with st.expander(f"⚡ Prévia ({deltas['linhas']:,} árvores) vs Ajuste Completo", expanded=False):
+                    st.dataframe(deltas['tabela'].rename(columns={"item": "Item", "previa": "Prévia", "final": "Completo",
+                                                                  "diferenca": "Diferença", "diferenca_pct": "Diferença %"}),
+                                 use_container_width=True, hide_index=True)
+
             # Gráficos
             st.subheader("📈 Diagnóstico do Modelo")
             
@@ -480,8 +830,146 @@ if st.session_state['df_raw'] is not None:
             with col_reset:
                 st.button("🔄 Restaurar Visão", on_click=reset_zoom)
 
-            chart = gerar_graficos_interativos(results, df_work, results['alias_map_used'])
-            st.altair_chart(chart, use_container_width=True, key=f"chart_{st.session_state['chart_key']}")
+            # Spec memorizada por resultado: 'Restaurar Visão' só troca a key do componente
+            chart_scope = (cache_scope.get('dataset_key'), normalize_filters(cache_scope.get('filter_state'))) if cache_scope else None
+            if results.get('source'):
+                # Ajuste out-of-core: os pontos são uma amostra do arquivo, sem metadados do dataset carregado
+                st.caption(f"Gráficos com amostra de {len(results['y_real']):,} de {results['n_obs']:,} árvores de {results['source']}.")
+                chart_spec = gerar_spec_graficos(results, df_work.iloc[:0], results['alias_map_used'], scope=("fonte", results['source']))
+            else:
+                chart_spec = gerar_spec_graficos(results, df_work, results['alias_map_used'], scope=chart_scope)
+            with span("app.vega_lite_chart", rows=len(results['y_real'])):
+                st.vega_lite_chart(dict(chart_spec), use_container_width=True, key=f"chart_{st.session_state['chart_key']}")
+
+            # Linhas do ajuste referem-se ao DataFrame ajustado, não aos filtros atuais
+            fitted_df = resolver_dataset(results)
+            if results.get('leverage') is not None:
+                with st.expander("🎯 Diagnóstico de Influência (árvores mais influentes)", expanded=False):
+                    top_k = st.slider("Quantas árvores mostrar:", 5, 100, 20, key="influence_k")
+                    influence_spec = gerar_spec_influencia(results, fitted_df, k=top_k, scope=("dataset", results.get('dataset_ref')))
+                    if influence_spec:
+                        st.vega_lite_chart(dict(influence_spec), use_container_width=True)
+                    top_table = top_influential(results, k=top_k, df_original=fitted_df).rename(columns=INFLUENCE_LABELS)
+                    st.dataframe(top_table, use_container_width=True, hide_index=True)
+                    st.caption("Alertas: h > 2p/n, |t| > 3, Cook > 4/n, |DFFITS| > 2·√(p/n). 'Linha' é a posição no conjunto ajustado.")
+
+            if results.get('cleaning'):
+                report = results['cleaning']
+                with st.expander(f"🧹 Limpeza por Resíduos: {report['removidas']:,} árvores removidas", expanded=False):
+                    st.caption(f"{report['removidas']:,} de {report['n_inicial']:,} árvores em {len(report['rodadas'])} rodada(s), "
+                               f"|t| > {report['limiar']:g}; parada: {report['parada'].replace('_', ' ')}.")
+                    st.dataframe(cleaning_table(results, fitted_df), use_container_width=True, hide_index=True)
+            elif results.get('method') in ('OLS', 'OLS (multialvo)') and not results.get('source'):
+                with st.expander("🧹 Limpeza por Resíduos (pós-ajuste)", expanded=False):
+                    st.caption("Remove, em rodadas, árvores plausíveis em cada eixo mas erradas para o modelo (ex: DAP grande com HT "
+                               "pequena), pelo resíduo studentizado. A solução é atualizada por downdates, sem reajustar a cada rodada.")
+                    c_t, c_r, c_f = st.columns(3)
+                    clean_t = c_t.number_input("Limiar |t|:", 2.0, 10.0, CLEANING_T_THRESHOLD, 0.5, key="clean_t")
+                    clean_rounds = c_r.number_input("Rodadas:", 1, 50, CLEANING_MAX_ROUNDS, key="clean_rounds")
+                    clean_frac = c_f.number_input("Máx. removidas (%):", 0.5, 50.0, CLEANING_MAX_FRACTION * 100, 0.5, key="clean_frac")
+                    if st.button("🧹 Limpar e Reajustar", key="clean_run"):
+                        if fitted_df is None:
+                            st.error("Os dados deste ajuste não estão mais disponíveis: recalcule o modelo antes de limpar.")
+                        else:
+                            meta = {'name': f"{results['name']} (limpo)", 'equation': results['equation_original'],
+                                    'alias_map': results['alias_map_used'], 'y_col': results['y_col_real'], 'method': 'OLS (limpo)',
+                                    'dataset_ref': results.get('dataset_ref')}
+                            job = submeter_job("limpeza", f"Limpeza: {results['name']}", job_clean, fitted_df, results,
+                                               float(clean_t), int(clean_rounds), float(clean_frac) / 100)
+                            if not job.done: acompanhar_job(job, meta)
+                            elif job.error: st.error(f"Erro na limpeza: {job.error}")
+                            elif "error" in job.result: st.error(job.result["error"])
+                            else:
+                                aplicar_resultado_ajuste(job.result, meta)
+                                st.rerun()  # O resultado limpo substitui o atual já nesta tela
+
+            if results.get('weights'):
+                w = results['weights']
+                with st.expander(f"⚖️ Busca do Expoente dos Pesos: k = {w['k']:g}", expanded=False):
+                    st.caption(f"Pesos 1/{w['variavel']}^k; k escolhido por {WLS_CRITERIA.get(w['criterio'], w['criterio'])}. "
+                               "AIC inclui o termo dos pesos (comparável entre k); 'Heterocedasticidade' = |correlação| entre "
+                               "o resíduo ponderado absoluto e o previsto (0 = sem funil).")
+                    labels = {"aic": "AIC", "syx": "Syx %", "hetero": "Heterocedasticidade"}
+                    search = pd.DataFrame(w['busca']).rename(columns=labels)
+                    st.dataframe(search.style.highlight_min(subset=[labels[w['criterio']]]), use_container_width=True, hide_index=True)
+
+            with st.expander("📐 Tabela de Volume / Altura", expanded=False):
+                c_d, c_h = st.columns(2)
+                dap_step = c_d.number_input("Classe de DAP (cm):", 0.5, 20.0, VOLUME_TABLE_DAP_STEP, 0.5, key="vt_dap_step")
+                ht_step = c_h.number_input("Classe de HT (m):", 0.5, 10.0, VOLUME_TABLE_HT_STEP, 0.5, key="vt_ht_step")
+                table = volume_table_cached(results, resolver_dataset(results), dap_step=dap_step, ht_step=ht_step)
+                if isinstance(table, dict):
+                    st.info(table["error"])
+                else:
+                    st.dataframe(table.style.format("{:.4f}", na_rep="-"), use_container_width=True)
+                    st.caption(f"'-' = fora da faixa dos dados ajustados ({table.attrs['celulas_mascaradas']} células). "
+                               "Modelos em ln(Y) já incluem o fator de Meyer. O PDF e a exportação usam as classes padrão.")
+
+            # Entregável por hectare: previsões por árvore somadas por parcela, talhão e fazenda (em blocos)
+            with st.expander("🌳 Agregação por Parcela / Talhão / Fazenda", expanded=False):
+                st.caption("Aplica o modelo (ou usa uma coluna de valor) a todas as árvores do inventário e calcula totais por "
+                           "hectare, médias e erro de amostragem. Arquivos grandes no servidor são lidos em blocos; o resultado "
+                           "entra no PDF e na exportação deste modelo.")
+                agg_from_file = st.radio("Inventário:", ["Dados carregados", "Arquivo no servidor (em blocos)"],
+                                         horizontal=True, key="agg_source").startswith("Arquivo")
+                agg_path = st.text_input("Caminho no servidor:", key="agg_path",
+                                         help=f"Relativo à pasta de dados: {SERVER_DATA_ROOT}") if agg_from_file else None
+                agg_source = resolve_server_path(agg_path) if agg_path else {"error": "Informe o caminho do arquivo."}
+                agg_cols = cols
+                if agg_from_file and not isinstance(agg_source, dict):
+                    try: agg_cols = source_columns(agg_source)
+                    except Exception as e: st.error(f"Não foi possível abrir o arquivo: {e}")
+                guess = guess_inventory_columns(agg_cols)
+                none = "(nenhuma)"
+                labels = {"fazenda": "Fazenda:", "talhao": "Talhão:", "parcela": "Parcela:", "especie": "Espécie:",
+                          "area_parcela": "Área da parcela (m²):", "fator_expansao": "Fator de expansão (árv/ha):",
+                          "area_talhao": "Área do talhão (ha):"}
+                spec = {}
+                role_cols = st.columns(4)
+                for i, role in enumerate(SPEC_ROLES):
+                    options = [none] + agg_cols
+                    chosen = role_cols[i % 4].selectbox(labels[role], options, index=options.index(guess[role]) if guess[role] else 0,
+                                                        key=f"agg_{role}")
+                    spec[role] = None if chosen == none else chosen
+                c_v, c_a, c_al, c_e = st.columns(4)
+                model_label = f"Previsão do modelo ({results.get('y_col_real') or 'Y'})"
+                agg_value = c_v.selectbox("Valor por árvore:", [model_label] + agg_cols, key="agg_valor")
+                spec['valor'] = None if agg_value == model_label else agg_value
+                if not spec['area_parcela'] and not spec['fator_expansao']:
+                    spec['area_parcela_m2'] = float(c_a.number_input("Área fixa da parcela (m²):", 1.0, 100_000.0,
+                                                                     AGGREGATION_PLOT_AREA_M2, 50.0, key="agg_area_m2"))
+                spec['alpha'] = float(c_al.number_input("α:", 0.001, 0.2, AGGREGATION_ALPHA, 0.01, key="agg_alpha"))
+                spec['erro_max'] = float(c_e.number_input("Erro admissível (%):", 1.0, 50.0, AGGREGATION_MAX_ERROR_PCT, 1.0, key="agg_erro"))
+                if agg_from_file and not isinstance(agg_source, dict): spec['fonte'] = str(agg_source)
+                agg_df = resolver_dataset(results)
+                if agg_df is None: agg_df = df_work
+                if st.button("🌳 Agregar", key="agg_run"):
+                    if agg_from_file and isinstance(agg_source, dict): st.error(agg_source["error"])
+                    else:
+                        meta = {'result': results, 'spec': spec}
+                        job = submeter_job("agregacao", f"Agregação: {results['name']}", job_aggregate, results, agg_df, spec)
+                        if not job.done: acompanhar_job(job, meta)
+                        elif job.error: st.error(f"Erro na agregação: {job.error}")
+                        else: aplicar_agregacao(job.result, meta)
+
+                aggregated = aggregation_cached(results, agg_df) if results.get('aggregation') else None
+                if aggregated is not None:
+                    if "error" in aggregated: st.error(aggregated["error"])
+                    else:
+                        stands = aggregated['talhoes']
+                        st.caption(f"{stands.attrs['arvores']:,} árvores | {len(aggregated['parcelas']):,} linhas de parcela | "
+                                   f"erro admissível {stands.attrs['erro_max']:g}% (α = {stands.attrs['alpha']:g}).")
+                        tab_t, tab_f, tab_p = st.tabs(["Talhões", "Fazendas", "Parcelas"])
+                        with tab_t:
+                            species = stands.attrs.get('especie')
+                            view = stands[stands[species] == ALL_SPECIES] if species else stands
+                            st.dataframe(view, use_container_width=True, hide_index=True)
+                            fails = int((~view['atende'].astype(bool)).sum())
+                            if fails: st.warning(f"{fails} talhão(ões) acima do erro admissível (ou com uma só parcela).")
+                        with tab_f:
+                            st.dataframe(aggregated['fazendas'], use_container_width=True, hide_index=True)
+                        with tab_p:
+                            st.dataframe(aggregated['parcelas'], use_container_width=True, hide_index=True)
 
             # Botões
             c_btn1, c_btn2 = st.columns([1, 4])
@@ -491,17 +979,25 @@ if st.session_state['df_raw'] is not None:
                     st.success("Salvo!")
             with c_btn2:
                 if st.button("📄 Gerar Relatório PDF"):
-                    try:
-                        path = gerar_pdf_relatorio(results, plot_paths=[])
-                        st.success(f"PDF Gerado: {path}")
-                        with open(path, "rb") as f: st.download_button("Baixar PDF", f, file_name=f"Relatorio_{results['name']}.pdf")
-                    except Exception as e: st.error(f"Erro PDF: {e}")
+                    job = submeter_job("relatorio", f"Relatório: {results['name']}", job_report, results, resolver_dataset(results))
+                    if not job.done: acompanhar_job(job)
+                    elif job.error: st.error(f"Erro PDF: {job.error}")
+                    elif job.result is not None: st.session_state['report_pdf'] = job.result
+                pdf = st.session_state.get('report_pdf')
+                if pdf and pdf['result_id'] == results.result_id:
+                    st.success(f"PDF Gerado: {pdf['file_name']}")
+                    st.download_button("Baixar PDF", pdf['bytes'], file_name=pdf['file_name'])
+
+            with st.expander("📦 Exportar Resultado (Parquet / Arrow / CSV)", expanded=False):
+                st.caption("Coeficientes, métricas e a tabela por árvore: IDs, observado, previsto, resíduo e a marca de remoção pelo Shield.")
+                botoes_exportacao([results], "atual")
 
         if st.session_state['saved_models']:
             st.divider()
             st.subheader("📚 Modelos na Memória")
             for mod in st.session_state['saved_models']:
                 st.write(f"- **{mod['name']}**: R² {mod.get('r2_adj',0):.4f}")
+            botoes_exportacao(st.session_state['saved_models'], "salvos")
 
     # --- ABA 3 ---
     with tab3:
@@ -511,3 +1007,54 @@ else:
     st.title(f"Bem-vindo ao {APP_NAME}")
     st.info("Carregue um arquivo para começar.")
 
+# ==============================================================================
+# 6. PAINEL DE PERFORMANCE
+# ==============================================================================
+finish_trace(_trace)
+if _trace.spans:
+    st.session_state['last_trace'] = _trace
+last_trace = st.session_state.get('last_trace')
+
+with st.expander("⏱️ Performance", expanded=False):
+    if last_trace is None:
+        st.caption("Nenhuma etapa medida ainda. Carregue dados ou calcule um modelo.")
+    else:
+        st.caption(f"Última execução com processamento: {last_trace.created.strftime('%H:%M:%S')} | "
+                   f"Total: {last_trace.total_seconds * 1000:.1f} ms")
+        st.dataframe(last_trace.to_frame(), use_container_width=True, hide_index=True)
+        if last_trace.profile_path:
+            with open(last_trace.profile_path, "rb") as f:
+                st.download_button("Baixar cProfile (.prof)", f, file_name=os.path.basename(last_trace.profile_path))
+    for job in JOB_MANAGER.jobs_for(st.session_state['session_id']):
+        if job.trace is not None and job.trace.profile_path and os.path.exists(job.trace.profile_path):
+            with open(job.trace.profile_path, "rb") as f:
+                st.download_button(f"Baixar cProfile do job: {job.label}", f, key=f"prof_{job.id}",
+                                   file_name=os.path.basename(job.trace.profile_path))
+
+    if st.button("🔬 Gravar cProfile na próxima execução"):
+        st.session_state['cprofile_next_run'] = True
+        st.info("A próxima interação (ex: Calcular Modelo) será perfilada por completo.")
+    for cache_label, cache_obj in [("Cache de ajustes", FIT_CACHE), ("Cache de gráficos", RENDER_CACHE)]:
+        cache_stats = cache_obj.stats()
+        st.caption(f"{cache_label}: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                   f"({cache_stats['taxa_acerto']:.0%}) | {cache_stats['entradas']} entradas, "
+                   f"{cache_stats['memoria_mb']:.1f} de {cache_stats['limite_mb']:.0f} MB")
+    job_stats = JOB_MANAGER.stats()
+    st.caption(f"Jobs: {job_stats['executando']} executando / {job_stats['na_fila']} na fila "
+               f"({job_stats['workers']} workers) | {job_stats['finalizados']} finalizados")
+    if PROFILE_JSON_LOG:
+        st.caption(f"Log JSON ativo: {PROFILE_JSON_LOG}")
+
+# Mostra datasets de todas as sessões: só para administradores (CANOPY_ADMIN=1)
+if DATASET_STORE_ADMIN:
+    with st.expander("🗄️ Armazenamento de Dados (Admin)", expanded=False):
+        store_stats = DATASET_STORE.stats()
+        a1, a2, a3, a4 = st.columns(4)
+        a1.metric("Datasets", store_stats['datasets'])
+        a2.metric("Memória", f"{store_stats['memoria_mb']:.1f} / {store_stats['limite_mb']:.0f} MB")
+        a3.metric("Sessões com dados", store_stats['sessoes'])
+        a4.metric("Importações reaproveitadas", store_stats['deduplicados'])
+        if store_stats['datasets']:
+            st.dataframe(DATASET_STORE.to_frame().style.format({"memoria_mb": "{:.2f}", "idade_min": "{:.1f}", "ultimo_acesso_s": "{:.0f}"}),
+                         use_container_width=True, hide_index=True)
+        st.caption(f"Despejos por limite de memória: {store_stats['despejos']}. Datasets sem sessão são despejados primeiro.")
@@ -0,0 +1,219 @@
+# benchmarks/run_benchmarks.py
+"""
+Suíte de benchmarks do PryAI Canopy.
+
+Uso:
+    python -m benchmarks.run_benchmarks                      # 1k, 10k, 100k linhas
+    python -m benchmarks.run_benchmarks --sizes 1000 10000000
+    python -m benchmarks.run_benchmarks --fail-on-regression # código 1 se houver regressão
+
+Cada execução grava um JSON em BENCHMARK_DIR e é comparada com a anterior.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.config import BENCHMARK_DIR, BENCHMARK_REGRESSION_TOLERANCE, DEFAULT_EQUATION_LIBRARY
+from src.parser import initial_preprocess
+from src.external_model import fit_regression_from_formula, fit_regression_multi_target
+from src.streaming_model import fit_regression_streaming
+from src.weighted_model import fit_wls_weight_search
+from src.model_identity import model_identity_test
+from src.aggregation import aggregate_inventory
+from benchmarks.synthetic_inventory import gerar_inventario_sintetico
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+ALIAS_MAP = {"Y": "VOL", "DAP": "DAP", "HT": "HT"}
+
+# Acima disso gráfico e PDF deixam de ser representativos (o navegador não desenha milhões de pontos)
+RENDER_MAX_ROWS = 200_000
+
+# Diferenças menores que isso são ruído de medição, não regressão
+MIN_ABS_DELTA_S = 0.005
+
+
+def _time_call(func, repeat):
+    """Executa 'func' 'repeat' vezes. Retorna (melhor tempo, mediana, último retorno)."""
+    times, out = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = func()
+        times.append(time.perf_counter() - t0)
+    return min(times), statistics.median(times), out
+
+
+def _record(results, stage, size, best, median, **extra):
+    results.append({"stage": stage, "size": size, "best_s": best, "median_s": median, **extra})
+    label = f"{stage} [{extra['equation']}]" if "equation" in extra else stage
+    print(f"  {label:<55} {best * 1000:>10.1f} ms")
+
+
+def run_suite(sizes, repeat=3, seed=42):
+    results = []
+
+    for size in sizes:
+        print(f"\n== {size:,} linhas ==")
+        rep = repeat if size <= 100_000 else 1
+        raw = gerar_inventario_sintetico(size, seed=seed)
+
+        best, med, df = _time_call(lambda: initial_preprocess(raw), rep)
+        _record(results, "initial_preprocess", size, best, med)
+
+        fitted = {}
+        for name, equation in DEFAULT_EQUATION_LIBRARY.items():
+            best, med, res = _time_call(lambda: fit_regression_from_formula(df, equation, ALIAS_MAP), rep)
+            ok = "error" not in res
+            _record(results, "fit_regression_from_formula", size, best, med, equation=name, ok=ok)
+            if ok:
+                res["name"] = name
+                res["alias_map_used"] = ALIAS_MAP
+                fitted[name] = res
+
+        # Out-of-core: mesmo dataset lido em blocos (memória independe de n)
+        equation = DEFAULT_EQUATION_LIBRARY["Schumacher-Hall (Log)"]
+        best, med, res = _time_call(lambda: fit_regression_streaming(df, equation, ALIAS_MAP), rep)
+        _record(results, "fit_regression_streaming", size, best, med, equation="Schumacher-Hall (Log)", ok="error" not in res)
+
+        # Vários alvos com o mesmo lado direito: X montado e fatorado uma vez para os três
+        targets = df.assign(VOL_COM=df["VOL"] * 0.88, BIOMASSA=df["VOL"] * 450.0)
+        best, med, res = _time_call(lambda: fit_regression_multi_target(targets, equation, ALIAS_MAP, ["VOL", "VOL_COM", "BIOMASSA"]), rep)
+        _record(results, "fit_regression_multi_target", size, best, med, equation="Schumacher-Hall (Log) x3", ok="error" not in res)
+
+        # WLS: todos os expoentes 1/DAP^k da grade padrão numa busca em lote + o ajuste final
+        best, med, res = _time_call(lambda: fit_wls_weight_search(df, equation, ALIAS_MAP), rep)
+        _record(results, "fit_wls_weight_search", size, best, med, equation="Schumacher-Hall (Log)", ok="error" not in res)
+
+        # Identidade de modelos por talhão: somas por grupo numa passada, três modelos sem voltar às linhas
+        best, med, res = _time_call(lambda: model_identity_test(df, equation, ALIAS_MAP, "Talhao"), rep)
+        _record(results, "model_identity_test", size, best, med, equation="Schumacher-Hall (Log)", ok="error" not in res)
+
+        # Agregação por parcela/talhão: modelo aplicado a todas as árvores + erro de amostragem
+        if "Schumacher-Hall (Log)" in fitted:
+            spec = {"talhao": "Talhao", "parcela": "Parcela", "area_parcela_m2": 400.0}
+            best, med, res = _time_call(lambda: aggregate_inventory(df, spec, fitted["Schumacher-Hall (Log)"]), rep)
+            _record(results, "aggregate_inventory", size, best, med, equation="Schumacher-Hall (Log)", ok="error" not in res)
+
+        if size > RENDER_MAX_ROWS or not fitted:
+            print(f"  (gráficos/PDF ignorados acima de {RENDER_MAX_ROWS:,} linhas)")
+            continue
+
+        # Renderização usa o modelo de Schumacher-Hall (ou o primeiro que ajustou)
+        name = "Schumacher-Hall (Log)" if "Schumacher-Hall (Log)" in fitted else next(iter(fitted))
+        res = fitted[name]
+        _bench_render(results, size, res, df, rep)
+
+    return results
+
+
+def _cold(func, *args):
+    """Mede o caminho sem cache (o cache de renderização guardaria os PNGs da 1ª repetição)."""
+    from src.cache import RENDER_CACHE
+    RENDER_CACHE.clear()
+    return func(*args)
+
+
+def _bench_render(results, size, res, df, repeat):
+    import altair as alt
+    from src.plots import gerar_graficos_interativos
+    from src.report_export import gerar_pdf_bytes
+
+    def build_spec():
+        chart = gerar_graficos_interativos(res, df, ALIAS_MAP)
+        with alt.data_transformers.disable_max_rows():
+            return chart.to_json()
+
+    best, med, spec = _time_call(build_spec, repeat)
+    _record(results, "gerar_graficos_interativos", size, best, med, spec_bytes=len(spec))
+
+    best, med, pdf = _time_call(lambda: _cold(gerar_pdf_bytes, res), repeat)
+    _record(results, "gerar_pdf_relatorio", size, best, med, pdf_bytes=len(pdf))
+
+
+def _key(entry):
+    return (entry["stage"], entry["size"], entry.get("equation"))
+
+
+def compare_runs(current, previous, tolerance=BENCHMARK_REGRESSION_TOLERANCE):
+    """Lista as etapas que ficaram mais lentas que a execução anterior além da tolerância."""
+    baseline = {_key(e): e for e in previous}
+    regressions = []
+    for entry in current:
+        old = baseline.get(_key(entry))
+        if not old or not old.get("best_s"):
+            continue
+        delta = entry["best_s"] - old["best_s"]
+        ratio = entry["best_s"] / old["best_s"]
+        if ratio > 1 + tolerance and delta > MIN_ABS_DELTA_S:
+            regressions.append({**entry, "previous_best_s": old["best_s"], "ratio": ratio})
+    return regressions
+
+
+def _latest_run(folder: Path):
+    runs = sorted(folder.glob("bench_*.json"))
+    if not runs:
+        return None
+    with open(runs[-1], encoding="utf-8") as f:
+        return runs[-1], json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do PryAI Canopy")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Números de linhas (1k a 10M).")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições por etapa (tamanhos <= 100k).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output-dir", type=Path, default=BENCHMARK_DIR)
+    parser.add_argument("--baseline", type=Path, default=None, help="JSON de referência (padrão: última execução).")
+    parser.add_argument("--tolerance", type=float, default=BENCHMARK_REGRESSION_TOLERANCE)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            previous = (args.baseline, json.load(f))
+    else:
+        previous = _latest_run(args.output_dir)
+
+    results = run_suite(args.sizes, repeat=args.repeat, seed=args.seed)
+
+    run = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.platform(),
+        "results": results,
+    }
+    out_path = args.output_dir / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nResultados gravados em {out_path}")
+
+    if not previous:
+        print("Sem execução anterior para comparar.")
+        return 0
+
+    prev_path, prev_run = previous
+    regressions = compare_runs(results, prev_run.get("results", []), args.tolerance)
+    if not regressions:
+        print(f"Nenhuma regressão em relação a {prev_path}.")
+        return 0
+
+    print(f"\n⚠️  {len(regressions)} regressão(ões) em relação a {prev_path}:")
+    for r in regressions:
+        label = f"{r['stage']} [{r['equation']}]" if r.get("equation") else r["stage"]
+        print(f"  {label} @ {r['size']:,}: {r['previous_best_s'] * 1000:.1f} ms -> {r['best_s'] * 1000:.1f} ms (x{r['ratio']:.2f})")
+    return 1 if args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# benchmarks/synthetic_inventory.py
+
+import numpy as np
+import pandas as pd
+
+# Textos acidentais típicos de planilhas de campo
+JUNK_VALUES = np.array(["Vinte", "Erro", "?", "N/A", "15m", "-", "morta", "20,5 cm"], dtype=object)
+
+
+def _br_format(values: np.ndarray, decimals: int) -> np.ndarray:
+    """Formata números no padrão BR (vírgula decimal), como sai do Excel em pt-BR."""
+    return np.char.replace(np.char.mod(f"%.{decimals}f", values), ".", ",").astype(object)
+
+
+def gerar_inventario_sintetico(n_rows: int, n_talhoes: int = None, br_decimal: bool = True,
+                               junk_rate: float = 0.002, outlier_rate: float = 0.001,
+                               seed: int = 42) -> pd.DataFrame:
+    """
+    Gera um inventário florestal sintético realista (DAP, HT, Volume por talhão).
+
+    - DAP (cm) com média por talhão (idades diferentes) e dispersão de Weibull.
+    - HT (m) pela curva hipsométrica de Chapman-Richards com assíntota por talhão.
+    - VOL (m³) pelo modelo de Schumacher-Hall com erro log-normal.
+    - Sujeiras de campo: vírgula decimal (BR), textos em colunas numéricas,
+      zeros/negativos e outliers grosseiros (erro de digitação x10).
+    """
+    rng = np.random.default_rng(seed)
+    if n_talhoes is None:
+        n_talhoes = int(np.clip(n_rows // 2000, 1, 5000))
+
+    talhao = rng.integers(1, n_talhoes + 1, n_rows)
+    parcela = talhao * 100 + rng.integers(1, 21, n_rows)
+
+    # Parâmetros por talhão (idade/sítio)
+    dap_medio = rng.uniform(10.0, 28.0, n_talhoes + 1)
+    ht_assintota = rng.uniform(22.0, 38.0, n_talhoes + 1)
+
+    dap = dap_medio[talhao] * rng.weibull(3.5, n_rows) / 0.9
+    dap = np.clip(dap, 4.0, None)
+    ht = 1.3 + ht_assintota[talhao] * (1 - np.exp(-0.07 * dap)) ** 1.2
+    ht = ht * rng.lognormal(0.0, 0.06, n_rows)
+    vol = np.exp(-9.95 + 1.85 * np.log(dap) + 0.98 * np.log(ht) + rng.normal(0.0, 0.09, n_rows))
+
+    # Outliers grosseiros (vírgula esquecida, zero, sinal trocado)
+    n_out = int(n_rows * outlier_rate)
+    if n_out:
+        idx = rng.choice(n_rows, n_out, replace=False)
+        third = max(1, n_out // 3)
+        dap[idx[:third]] *= 10
+        ht[idx[third:2 * third]] = 0.0
+        vol[idx[2 * third:]] *= -1
+
+    df = pd.DataFrame({
+        "Talhao": talhao,
+        "Parcela": parcela,
+        "Arvore": np.arange(1, n_rows + 1),
+        "DAP": np.round(dap, 1),
+        "HT": np.round(ht, 1),
+        "VOL": np.round(vol, 4),
+    })
+
+    # Vírgula decimal: colunas viram texto, como numa planilha pt-BR
+    if br_decimal:
+        df["DAP"] = _br_format(df["DAP"].to_numpy(), 1)
+        df["HT"] = _br_format(df["HT"].to_numpy(), 1)
+        df["VOL"] = _br_format(df["VOL"].to_numpy(), 4)
+
+    # Textos acidentais em colunas numéricas
+    n_junk = int(n_rows * junk_rate)
+    if n_junk:
+        for col in ("DAP", "HT", "VOL"):
+            if df[col].dtype != object:
+                df[col] = df[col].astype(object)
+            idx = rng.choice(n_rows, n_junk, replace=False)
+            df.loc[idx, col] = rng.choice(JUNK_VALUES, n_junk)
+
+    return df
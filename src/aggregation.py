@@ -0,0 +1,271 @@
+# src/aggregation.py
+
+import json
+import numpy as np
+import pandas as pd
+from scipy import stats
+from typing import Any, Callable, Dict, List, Optional
+
+from src.config import AGGREGATION_ALPHA, AGGREGATION_MAX_ERROR_PCT, AGGREGATION_MAX_PARTIALS, STREAM_CHUNK_ROWS
+from src.cache import cached_render, dataset_fingerprint
+from src.importer import normalize_header
+from src.manual_model import SAFE_MATH
+from src.streaming_model import iter_chunks, source_columns
+from src.volume_table import _predictor
+from src.profiling import span
+
+ALL_SPECIES = "(todas)"
+ALL_FARMS = "(geral)"
+
+# Papéis das colunas do inventário (chave da especificação -> nome normalizado sugerido)
+SPEC_ROLES = {"fazenda": "fazenda", "talhao": "talhao", "parcela": "parcela", "especie": "especie",
+              "area_parcela": "areaparcela", "fator_expansao": "fatorexpansao", "area_talhao": "areatalhao"}
+
+# Somas por parcela, aditivas entre blocos
+_PLOT_SUMS = ["arvores", "sem_valor", "n_ha", "valor_ha", "valor", "area_soma", "area_n"]
+
+
+def guess_inventory_columns(columns: List[str]) -> Dict[str, Optional[str]]:
+    """Sugestão de coluna para cada papel da agregação, pelo nome normalizado."""
+    norm = {c: normalize_header(c) for c in columns}
+    return {role: next((c for c, n in norm.items() if n == key), None) for role, key in SPEC_ROLES.items()}
+
+
+def tree_values(results, frame: pd.DataFrame) -> np.ndarray:
+    """Previsão (escala real) de cada árvore de 'frame' pela equação ajustada; NaN quando não calculável."""
+    code, back_log, fc, env_coefs = _predictor(results)
+    env = dict(SAFE_MATH)
+    env.update(env_coefs)
+    for alias, col in _model_columns(results, code).items():
+        values = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=float)
+        env[alias] = np.where(values > 0, values, np.nan)  # Mesmo critério físico da blindagem
+    with np.errstate(all='ignore'):
+        out = np.broadcast_to(np.asarray(eval(code, {"__builtins__": {}}, env), dtype=float), (len(frame),))
+        if back_log:
+            out = np.exp(out) * fc
+    return np.where(np.isfinite(out), out, np.nan)
+
+
+def _model_columns(results, code=None) -> Dict[str, str]:
+    """Apelido -> coluna das variáveis X usadas pela equação ajustada."""
+    code = code or _predictor(results)[0]
+    alias_map = results.get('alias_map_used') or {}
+    return {a: alias_map[a] for a in code.co_names if a in alias_map and alias_map[a] != results.get('y_col_real')}
+
+
+def _plot_partials(chunk: pd.DataFrame, values: np.ndarray, spec: Dict[str, Any], keys: List[str]) -> pd.DataFrame:
+    """Somas por parcela (e espécie) de um bloco: um groupby vetorizado sobre colunas numéricas."""
+    if spec.get('area_parcela'):
+        area = pd.to_numeric(chunk[spec['area_parcela']], errors='coerce').to_numpy(dtype=float)
+    else:
+        area = np.full(len(chunk), float(spec.get('area_parcela_m2') or np.nan))
+    if spec.get('fator_expansao'):
+        ef = pd.to_numeric(chunk[spec['fator_expansao']], errors='coerce').to_numpy(dtype=float)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ef = 10_000.0 / area  # Árvores/ha representadas por cada árvore da parcela
+    ef = np.where(np.isfinite(ef) & (ef > 0), ef, 0.0)
+    ok = np.isfinite(values)
+    frame = chunk[keys].copy()
+    frame["arvores"] = 1
+    frame["sem_valor"] = (~ok).astype(np.int64)
+    frame["n_ha"] = ef
+    frame["valor_ha"] = np.where(ok, values, 0.0) * ef
+    frame["valor"] = np.where(ok, values, 0.0)
+    frame["area_soma"] = np.where(np.isfinite(area), area, 0.0)
+    frame["area_n"] = np.isfinite(area).astype(np.int64)
+    return frame.groupby(keys, sort=False)[_PLOT_SUMS].sum()
+
+
+def _reduce(partials: List[pd.DataFrame], keys: List[str]) -> pd.DataFrame:
+    return pd.concat(partials).groupby(level=keys, sort=False).sum()
+
+
+def _with_all_species(plots: pd.DataFrame, plot_keys: List[str], species: str) -> pd.DataFrame:
+    """
+    Parcela x espécie com zeros onde a espécie não ocorre (senão a média do talhão
+    ignoraria as parcelas sem ela), mais as linhas ALL_SPECIES com o total da parcela.
+    """
+    totals = plots.groupby(level=plot_keys, sort=False).sum()
+    names = plots.index.get_level_values(species).unique()
+    grid = totals.index.to_frame(index=False).merge(pd.DataFrame({species: names}), how="cross")
+    dense = plots.reindex(pd.MultiIndex.from_frame(grid), fill_value=0)
+    # Área da parcela não depende da espécie
+    dense[["area_soma", "area_n"]] = totals[["area_soma", "area_n"]].reindex(dense.index.droplevel(species)).to_numpy()
+    totals[species] = ALL_SPECIES
+    totals = totals.set_index(species, append=True)
+    return pd.concat([totals, dense])
+
+
+def _ci(out: pd.DataFrame, mean: pd.Series, var_mean: pd.Series, dof: pd.Series, alpha: float, max_error: float) -> pd.DataFrame:
+    """Erro padrão, erro de amostragem (absoluto e %) e intervalo de confiança pela t de Student."""
+    t = stats.t.ppf(1 - alpha / 2, dof.where(dof > 0).to_numpy(dtype=float))
+    out["erro_padrao"] = np.sqrt(var_mean)
+    out["erro_abs"] = t * out["erro_padrao"]
+    out["erro_pct"] = out["erro_abs"] / mean.where(mean != 0) * 100
+    out["ic_inf"] = mean - out["erro_abs"]
+    out["ic_sup"] = mean + out["erro_abs"]
+    out["atende"] = out["erro_pct"] <= max_error
+    return out
+
+
+def _stand_level(plots: pd.DataFrame, keys: List[str], has_area: bool, alpha: float, max_error: float) -> pd.DataFrame:
+    """Amostragem casual simples em cada talhão: a parcela (valor/ha) é a unidade amostral."""
+    g = plots.groupby(keys, sort=True)
+    mean, var, n = g["valor_ha"].mean(), g["valor_ha"].var(ddof=1), g.size()
+    out = pd.DataFrame({"parcelas": n, "n_ha": g["n_ha"].mean(), "media_ha": mean, "desvio": np.sqrt(var)})
+    out["cv_pct"] = out["desvio"] / mean.where(mean != 0) * 100
+    out["media_arvore"] = g["valor"].sum() / (g["arvores"].sum() - g["sem_valor"].sum()).where(lambda s: s > 0)
+    fpc = 1.0
+    if has_area:
+        out["area_ha"] = g["area_talhao"].first()
+        # Correção de população finita: fração amostrada = n·a / A
+        f = (n * g["area_m2"].mean() / 10_000.0 / out["area_ha"]).clip(upper=1.0)
+        fpc = (1 - f).fillna(1.0)
+    out = _ci(out, mean, var / n * fpc, n - 1, alpha, max_error)
+    if has_area:
+        out["total"] = mean * out["area_ha"]
+        out["erro_total"] = out["erro_abs"] * out["area_ha"]
+    return out.reset_index()
+
+
+def _farm_level(stands: pd.DataFrame, keys: List[str], has_area: bool, alpha: float, max_error: float) -> pd.DataFrame:
+    """Amostragem estratificada: talhões como estratos, pesos pela área (ou iguais, sem área)."""
+    w = stands["area_ha"].fillna(0.0) if has_area else pd.Series(1.0, index=stands.index)
+    parts = pd.DataFrame({k: stands[k] for k in keys})
+    parts["talhoes"] = 1
+    parts["parcelas"] = stands["parcelas"]
+    parts["w"] = w
+    parts["wy"] = w * stands["media_ha"]
+    parts["wn"] = w * stands["n_ha"]
+    parts["w2v"] = w ** 2 * stands["erro_padrao"] ** 2
+    parts["sem_erro"] = stands["erro_padrao"].isna().astype(np.int64)
+    parts["gl"] = stands["parcelas"] - 1
+    g = parts.groupby(keys, sort=True).sum()
+    sw = g["w"].where(g["w"] > 0)
+    out = pd.DataFrame({"talhoes": g["talhoes"], "parcelas": g["parcelas"], "n_ha": g["wn"] / sw})
+    mean = g["wy"] / sw
+    out["media_ha"] = mean
+    out = _ci(out, mean, g["w2v"] / sw ** 2, g["gl"], alpha, max_error)
+    out["talhoes_sem_erro"] = g["sem_erro"]
+    if has_area:
+        out["area_ha"] = g["w"]
+        out["total"] = mean * out["area_ha"]
+        out["erro_total"] = out["erro_abs"] * out["area_ha"]
+    return out.reset_index()
+
+
+def aggregate_inventory(source: Any, spec: Dict[str, Any], results=None, chunk_rows: int = STREAM_CHUNK_ROWS,
+                        progress: Optional[Callable[[float, str], None]] = None) -> Dict[str, Any]:
+    """
+    Totais e médias por parcela, talhão e fazenda (e espécie), com erro de amostragem.
+
+    'source' é um DataFrame ou um arquivo grande (CSV, Parquet, pasta de .npy), lido
+    em blocos por iter_chunks. O valor de cada árvore vem da coluna spec['valor'] ou,
+    sem ela, da equação de 'results' aplicada a todas as árvores. Cada bloco vira
+    somas por parcela num groupby vetorizado (fator de expansão = spec['fator_expansao']
+    ou 10.000 / área da parcela em m²); só essas somas ficam em memória.
+
+    Talhão: amostragem casual simples (parcelas), com correção de população finita
+    quando spec['area_talhao'] (ha) existe. Fazenda: estratificada por talhão.
+    Retorna {"parcelas", "talhoes", "fazendas"} (DataFrames) ou {"error": msg}.
+    """
+    with span("agregacao.aggregate_inventory") as sp:
+        out = _aggregate_inventory(source, spec, results, chunk_rows, progress or (lambda *a: None))
+        sp.rows = out.get("talhoes").attrs.get("arvores", 0) if "error" not in out else 0
+        return out
+
+
+def _aggregate_inventory(source, spec, results, chunk_rows, progress):
+    stand, plot, farm, species = spec.get('talhao'), spec.get('parcela'), spec.get('fazenda'), spec.get('especie')
+    value_col = spec.get('valor')
+    if not stand or not plot: return {"error": "Informe as colunas de talhão e de parcela."}
+    if not (spec.get('fator_expansao') or spec.get('area_parcela') or spec.get('area_parcela_m2')):
+        return {"error": "Informe a área da parcela (coluna ou valor em m²) ou o fator de expansão."}
+    if value_col is None and results is None: return {"error": "Sem coluna de valor nem modelo para prever as árvores."}
+    alpha = float(spec.get('alpha', AGGREGATION_ALPHA))
+    max_error = float(spec.get('erro_max', AGGREGATION_MAX_ERROR_PCT))
+
+    try:
+        model_cols = list(_model_columns(results).values()) if value_col is None else []
+        available = source_columns(source)
+    except (ValueError, SyntaxError) as e:
+        return {"error": f"Equação inválida: {e}"}
+    except Exception as e:
+        return {"error": f"Não foi possível abrir a fonte: {e}"}
+
+    plot_keys = [c for c in (farm, stand, plot) if c]
+    keys = plot_keys + ([species] if species else [])
+    extra = [spec.get(r) for r in ("area_parcela", "fator_expansao", "area_talhao")] + [value_col]
+    cols = list(dict.fromkeys(keys + [c for c in extra if c] + model_cols))
+    missing = [c for c in cols if c not in available]
+    if missing: return {"error": f"Colunas inexistentes na fonte: {', '.join(missing)}."}
+
+    stand_keys = [c for c in (farm, stand) if c]
+    partials, areas, n_trees = [], [], 0
+    chunks = iter_chunks(source, cols, chunk_rows)
+    while True:
+        try:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            values = (pd.to_numeric(chunk[value_col], errors='coerce').to_numpy(dtype=float) if value_col
+                      else tree_values(results, chunk))
+            partials.append(_plot_partials(chunk, values, spec, keys))
+            if spec.get('area_talhao'):
+                areas.append(pd.to_numeric(chunk[spec['area_talhao']], errors='coerce').groupby(
+                    [chunk[k] for k in stand_keys]).first())
+            if len(partials) > AGGREGATION_MAX_PARTIALS:
+                partials = [_reduce(partials, keys)]  # Memória limitada ao número de parcelas
+        except Exception as e:
+            return {"error": f"Erro crítico no processamento: {str(e)}"}
+        n_trees += len(chunk)
+        progress(0.0, f"{n_trees:,} árvores lidas")  # Fora do try: o cancelamento do job não vira erro
+    if not partials or not sum(len(p) for p in partials):
+        return {"error": "Nenhuma árvore com talhão e parcela identificados."}
+
+    with span("agregacao.niveis"):
+        plots = _reduce(partials, keys)
+        if species:
+            plots = _with_all_species(plots, plot_keys, species)
+        plots["area_m2"] = plots["area_soma"] / plots["area_n"].where(plots["area_n"] > 0)
+        plots = plots.drop(columns=["area_soma", "area_n"]).sort_index().reset_index()
+        plots["media_arvore"] = plots["valor"] / (plots["arvores"] - plots["sem_valor"]).where(lambda s: s > 0)
+        has_area = bool(areas)
+        if has_area:
+            stand_area = pd.concat(areas).groupby(level=list(range(len(stand_keys)))).first()
+            stand_area.index.names = stand_keys
+            plots = plots.merge(stand_area.rename("area_talhao").reset_index(), on=stand_keys, how="left")
+
+        stands = _stand_level(plots, stand_keys + ([species] if species else []), has_area, alpha, max_error)
+        # Sem coluna de fazenda, o nível de cima é o inventário inteiro
+        farm_key = farm or "fazenda"
+        farm_input = stands if farm else stands.assign(fazenda=ALL_FARMS)
+        farms = _farm_level(farm_input, [farm_key] + ([species] if species else []), has_area, alpha, max_error)
+        plots = plots.drop(columns=["area_talhao"], errors="ignore")
+
+    variable = value_col or (results.get('y_col_real') if results is not None else None) or "valor"
+    meta = {"variavel": variable, "alpha": alpha, "erro_max": max_error, "arvores": n_trees, "especie": species,
+            "talhao": stand, "parcela": plot, "fazenda": farm, "area_talhao": has_area}
+    for table in (plots, stands, farms):
+        table.attrs.update(meta)
+    return {"parcelas": plots, "talhoes": stands, "fazendas": farms}
+
+
+def aggregation_cached(results, df_original: Optional[pd.DataFrame] = None, spec: Optional[Dict[str, Any]] = None,
+                       progress: Optional[Callable[[float, str], None]] = None):
+    """
+    aggregate_inventory memorizada por resultado, com a especificação guardada em
+    results['aggregation'] (ou 'spec'). A fonte é spec['fonte'] (arquivo) ou df_original.
+    None quando o resultado não tem agregação.
+    """
+    spec = spec or results.get('aggregation')
+    if not spec:
+        return None
+    source = spec.get('fonte') or df_original
+    if source is None:
+        return {"error": "Dados do inventário indisponíveis para a agregação."}
+    origin = ("arquivo", spec['fonte']) if spec.get('fonte') else (results.get('dataset_ref') or dataset_fingerprint(df_original),)
+    scope = tuple(origin) + (json.dumps(spec, sort_keys=True, default=str),)
+    model = None if spec.get('valor') else results
+    return cached_render(results, "agregacao", scope, lambda: aggregate_inventory(source, spec, model, progress=progress))
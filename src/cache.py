@@ -0,0 +1,270 @@
+# src/cache.py
+
+import re
+import sys
+import json
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.config import FIT_CACHE_MAX_ENTRIES, FIT_CACHE_MAX_BYTES, RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_MAX_BYTES
+from src.results import ModelResult
+from src.profiling import span
+from src.external_model import fit_regression_from_formula
+from src.manual_model import evaluate_manual_model
+
+
+class LRUCache:
+    """
+    Cache LRU com limite de entradas e de memória (bytes estimados).
+    Seguro entre threads: as sessões do Streamlit compartilham o mesmo processo.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, sizeof: Callable[[Any], int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or _estimate_nbytes
+        self._data: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            if size > self.max_bytes:
+                return  # Maior que o cache inteiro: não armazena
+            self._data[key] = (value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return None
+            self._bytes -= item[1]
+            return item[0]
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Remove todas as entradas cuja chave satisfaz o predicado."""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                self._bytes -= self._data.pop(k)[1]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self._data),
+            "memoria_mb": self._bytes / 2**20,
+            "limite_mb": self.max_bytes / 2**20,
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "despejos": self.evictions,
+        }
+
+
+def _estimate_nbytes(value: Any) -> int:
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_nbytes(v) for v in value)
+    if isinstance(value, dict) and any(isinstance(v, (pd.DataFrame, np.ndarray)) for v in value.values()):
+        return sum(_estimate_nbytes(v) for v in value.values())  # Tabelas (ex: agregação) e arrays (influência)
+    if isinstance(value, dict):
+        # Specs Vega-Lite: tamanho do JSON (calculado uma vez, na inserção)
+        return len(json.dumps(value, default=str))
+    if isinstance(value, ModelResult):
+        return value.nbytes + 2048  # arrays + metadados
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=False).sum())
+    return sys.getsizeof(value)
+
+
+# ==============================================================================
+# Chaves: impressão digital do dataset + filtros + equação normalizada + apelidos
+# ==============================================================================
+_FINGERPRINTS: Dict[int, Tuple[weakref.ref, str]] = {}
+_FINGERPRINTS_LOCK = threading.Lock()
+
+
+def dataset_fingerprint(df: pd.DataFrame) -> str:
+    """
+    Hash do conteúdo (valores, índice, colunas e tipos) do DataFrame.
+    Memorizado por objeto: o DataFrame não deve ser alterado in-place depois disso.
+    """
+    with _FINGERPRINTS_LOCK:
+        memo = _FINGERPRINTS.get(id(df))
+        if memo is not None and memo[0]() is df:
+            return memo[1]
+
+    with span("cache.fingerprint", rows=len(df)):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+        fp = h.hexdigest()
+
+    with _FINGERPRINTS_LOCK:
+        # Limpa memos de DataFrames já coletados
+        for key in [k for k, (ref, _) in _FINGERPRINTS.items() if ref() is None]:
+            del _FINGERPRINTS[key]
+        try:
+            _FINGERPRINTS[id(df)] = (weakref.ref(df), fp)
+        except TypeError:
+            pass
+    return fp
+
+
+def normalize_equation(equation: str) -> str:
+    """'ln (Y) = b0 + b1 * log(DAP)' e 'ln(Y)=b0+b1*ln(DAP)' geram a mesma chave."""
+    eq = re.sub(r"\blog\s*\(", "ln(", equation.strip(), flags=re.IGNORECASE)
+    eq = re.sub(r"\bln\s*\(", "ln(", eq, flags=re.IGNORECASE)
+    return re.sub(r"\s+", "", eq)
+
+
+def normalize_filters(filter_state: Optional[Dict[str, Any]]) -> Tuple:
+    """Seleção de filtros em cascata como tupla ordenada e hasheável."""
+    if not filter_state:
+        return ()
+    return tuple(sorted((str(col), tuple(sorted(map(str, values)))) for col, values in filter_state.items() if values))
+
+
+def _used_aliases(equation: str, alias_map: Dict[str, str]) -> Tuple:
+    names = set(re.findall(r"[a-zA-Z_]\w*", equation))
+    return tuple(sorted((a, c) for a, c in alias_map.items() if a in names))
+
+
+def fit_cache_key(kind: str, dataset_key: str, equation: str, alias_map: Dict[str, str],
+                  filter_state: Optional[Dict[str, Any]] = None, extra: Tuple = ()) -> Tuple:
+    return (kind, dataset_key, normalize_filters(filter_state), normalize_equation(equation),
+            _used_aliases(equation, alias_map), extra)
+
+
+# ==============================================================================
+# Cache de ajustes (compartilhado pelo processo)
+# ==============================================================================
+FIT_CACHE = LRUCache(FIT_CACHE_MAX_ENTRIES, FIT_CACHE_MAX_BYTES)
+
+
+def _cached(key: Tuple, compute: Callable[[], Any]) -> Any:
+    hit = FIT_CACHE.get(key)
+    if hit is None:
+        hit = compute()
+        if isinstance(hit, ModelResult):
+            hit.freeze()
+        FIT_CACHE.put(key, hit)
+    # O chamador costuma preencher nome/método: nunca devolve o objeto do cache
+    return hit.copy() if isinstance(hit, ModelResult) else dict(hit)
+
+
+def fit_regression_cached(df: pd.DataFrame, equation: str, alias_map: Dict[str, str],
+                          dataset_key: Optional[str] = None, filter_state: Optional[Dict[str, Any]] = None):
+    """
+    fit_regression_from_formula memorizado.
+    'dataset_key' (impressão digital do dataset bruto) + 'filter_state' evitam
+    re-hashear o DataFrame filtrado a cada rerun; sem eles, o df é hasheado.
+    """
+    if dataset_key is None:
+        dataset_key, filter_state = dataset_fingerprint(df), None
+    key = fit_cache_key("ols", dataset_key, equation, alias_map, filter_state)
+    res = _cached(key, lambda: fit_regression_from_formula(df, equation, alias_map))
+    if isinstance(res, ModelResult):
+        res.equation_original = equation
+    return res
+
+
+def evaluate_manual_cached(df: pd.DataFrame, equation: str, alias_map: Dict[str, str], y_col: str,
+                           coef_values: Dict[str, float], dataset_key: Optional[str] = None,
+                           filter_state: Optional[Dict[str, Any]] = None):
+    """evaluate_manual_model memorizado (a chave inclui Y e os coeficientes)."""
+    if dataset_key is None:
+        dataset_key, filter_state = dataset_fingerprint(df), None
+    extra = (y_col, tuple(sorted((k, float(v)) for k, v in coef_values.items())))
+    key = fit_cache_key("manual", dataset_key, equation, alias_map, filter_state, extra)
+    return _cached(key, lambda: evaluate_manual_model(df, equation, alias_map, y_col, coef_values))
+
+
+# ==============================================================================
+# Cache de renderização (spec dos gráficos e PNGs do PDF) por identidade do resultado
+# ==============================================================================
+RENDER_CACHE = LRUCache(RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_MAX_BYTES)
+# result_id -> {id(objeto): finalizador}: cópias (ModelResult.copy) mantêm o result_id,
+# então as entradas só saem quando a última cópia viva for coletada
+_RENDER_OWNERS: Dict[str, Dict[int, weakref.finalize]] = {}
+
+
+def discard_renders(result_id: str) -> int:
+    """Remove do cache tudo o que foi renderizado para um resultado."""
+    for fin in _RENDER_OWNERS.pop(result_id, {}).values():
+        fin.detach()
+    return RENDER_CACHE.discard_where(lambda k: k[0] == result_id)
+
+
+def _release_render_owner(result_id: str, owner: int) -> None:
+    owners = _RENDER_OWNERS.get(result_id)
+    if owners is None:
+        return
+    owners.pop(owner, None)
+    if not owners:
+        discard_renders(result_id)
+
+
+def _track_render_owner(result: ModelResult) -> None:
+    owners = _RENDER_OWNERS.setdefault(result.result_id, {})
+    if id(result) not in owners:
+        owners[id(result)] = weakref.finalize(result, _release_render_owner, result.result_id, id(result))
+
+
+def cached_render(result: ModelResult, kind: str, scope: Tuple, build: Callable[[], Any]) -> Any:
+    """
+    Busca (ou constrói e guarda) um artefato de renderização de 'result'.
+    Quando o resultado e todas as suas cópias são descartados pelo app (coletados),
+    suas entradas saem do cache.
+    """
+    _track_render_owner(result)
+    key = (result.result_id, kind, scope)
+    hit = RENDER_CACHE.get(key)
+    if hit is not None:
+        return hit
+
+    value = build()
+    RENDER_CACHE.put(key, value)
+    return value
@@ -34,7 +34,103 @@ APPEARANCE_MODE = "System"  # "System" (segue o OS), "Dark", "Light"
 COLOR_THEME = "green"   # "blue", "green", "dark-blue"
 
 # ==============================================================================
-# 3. Inicialização
+# 3. Modelagem
+# ==============================================================================
+# Biblioteca de equações carregada em cada sessão (o usuário pode ampliar)
+DEFAULT_EQUATION_LIBRARY = {
+    "Linear Simples": "Y = b0 + b1*DAP",
+    "Linear Múltiplo": "Y = b0 + b1*DAP + b2*HT",
+    "Schumacher-Hall (Log)": "ln(Y) = b0 + b1*ln(DAP) + b2*ln(HT)",
+    "Spurr (Potência)": "Y = b0 + b1 * (DAP**2 * HT)",
+    "Hipsométrica (Log-Lin)": "ln(HT) = b0 + b1 * (1/DAP)",
+    "Polinomial Quadrática": "Y = b0 + b1*DAP + b2*(DAP**2)"
+}
+
+# Importação de várias planilhas (src/importer.py): grafias equivalentes de cabeçalho.
+# Chave = nome canônico normalizado; valores = variações normalizadas (sem acento,
+# minúsculas, sem unidade entre parênteses e sem pontuação).
+COLUMN_SYNONYMS = {
+    "dap": ["dbh", "diametro", "diam", "dapcm"],
+    "ht": ["h", "altura", "alturatotal", "htotal", "htm", "hcm"],
+    "vol": ["volume", "v", "volm3", "vtcc", "volumetotal"],
+    "talhao": ["stand", "talh", "quadra"],
+    "parcela": ["plot", "parc", "unidadeamostral", "ua"],
+    "arvore": ["arv", "tree", "narvore", "numarvore"],
+}
+
+# ==============================================================================
+# 4. Desempenho
+# ==============================================================================
+# Benchmarks (python -m benchmarks.run_benchmarks)
+BENCHMARK_DIR = OUTPUT_DIR / "benchmarks"
+BENCHMARK_REGRESSION_TOLERANCE = 0.20  # +20% de tempo sobre a execução anterior = regressão
+
+# Cache de ajustes (src/cache.py), compartilhado entre sessões do mesmo processo
+FIT_CACHE_MAX_ENTRIES = 64
+FIT_CACHE_MAX_BYTES = 256 * 1024**2  # 256 MB
+
+# Cache de renderização: spec Altair e PNGs do PDF por resultado
+RENDER_CACHE_MAX_ENTRIES = 32
+RENDER_CACHE_MAX_BYTES = 128 * 1024**2  # 128 MB
+
+# Perfilamento por etapa (src/profiling.py)
+PROFILE_DIR = OUTPUT_DIR / "profiles"                 # Dumps do cProfile (.prof)
+PROFILE_JSON_LOG = os.environ.get("CANOPY_PROFILE_LOG")  # Caminho .jsonl (opt-in): um trace por linha
+
+# Armazenamento de datasets (src/datastore.py): uma cópia por conteúdo, para todas as sessões
+DATASET_STORE_MAX_BYTES = int(os.environ.get("CANOPY_DATASET_STORE_MB", 1024)) * 1024**2  # 1 GB
+# Painel de administração do armazenamento (lista datasets de todas as sessões): só com CANOPY_ADMIN=1
+DATASET_STORE_ADMIN = os.environ.get("CANOPY_ADMIN", "0") == "1"
+
+# Ajuste out-of-core (src/streaming_model.py)
+STREAM_CHUNK_ROWS = 250_000      # Linhas por bloco lido do arquivo
+STREAM_SKETCH_K = 4096           # Capacidade por nível do sketch de quantis (erro de posto ~ 1/K)
+STREAM_SAMPLE_POINTS = 20_000    # Amostra (reservatório) de pontos guardada para os gráficos
+# Caminhos digitados na interface (out-of-core, agregação) só são aceitos dentro desta pasta
+SERVER_DATA_ROOT = Path(os.environ.get("CANOPY_DATA_ROOT", DATA_DIR))
+
+# Importação paralela: arquivos/abas lidos em processos separados
+IMPORT_MAX_WORKERS = int(os.environ.get("CANOPY_IMPORT_WORKERS", max(1, min(8, os.cpu_count() or 1))))
+IMPORT_PARALLEL_MIN_BYTES = 2 * 1024**2  # Abaixo disso (soma dos arquivos) lê tudo no processo atual
+
+# Jobs em segundo plano (src/jobs.py): pool de workers compartilhado pelas sessões
+JOB_POOL_SIZE = int(os.environ.get("CANOPY_JOB_WORKERS", max(2, min(4, (os.cpu_count() or 2) // 2))))
+JOB_INLINE_WAIT_S = 1.5      # Jobs rápidos terminam dentro do rerun, sem barra de progresso
+JOB_POLL_INTERVAL_S = 1.0    # Intervalo de atualização do painel de tarefas
+JOB_RETENTION_S = 3600       # Jobs finalizados ficam disponíveis por 1 h
+JOB_MAX_FINISHED = 200
+
+# Exportação colunar (src/result_export.py): linhas por lote na tabela por árvore
+EXPORT_BATCH_ROWS = 500_000
+
+# Tabelas de volume/altura (src/volume_table.py): amplitude das classes
+VOLUME_TABLE_DAP_STEP = 5.0   # cm
+VOLUME_TABLE_HT_STEP = 2.0    # m
+VOLUME_TABLE_PDF_COLS = 10    # Classes de HT por bloco no PDF (tabelas largas viram vários blocos)
+
+# Ajuste progressivo (src/progressive.py): prévia em subamostra estratificada, depois o ajuste completo
+PROGRESSIVE_MIN_ROWS = 200_000     # Abaixo disso o ajuste completo já é rápido: sem prévia
+PROGRESSIVE_BUDGET_S = 1.0         # Orçamento de latência da prévia
+PROGRESSIVE_START_ROWS = 5_000     # Primeira amostra (quadruplica enquanto couber no orçamento)
+PROGRESSIVE_MAX_FRACTION = 0.25    # Prévia nunca passa de 25% das linhas
+
+# Limpeza pós-ajuste por resíduo studentizado (src/residual_cleaning.py)
+CLEANING_T_THRESHOLD = 3.0     # |t| acima disso sai do ajuste
+CLEANING_MAX_ROUNDS = 5
+CLEANING_MAX_FRACTION = 0.05   # Nunca remove mais que 5% das árvores do ajuste
+
+# --- Mínimos quadrados ponderados (pesos 1/DAP^k) ---
+WLS_K_GRID = (0.0, 4.0, 0.25)     # (início, fim, passo) dos expoentes testados na busca
+WLS_BLOCK_ELEMENTS = 4_000_000    # Linhas x k x termos por bloco na busca em lote (~32 MB)
+
+# Agregação por parcela/talhão/fazenda (src/aggregation.py)
+AGGREGATION_PLOT_AREA_M2 = 400.0   # Área padrão da parcela quando não há coluna de área
+AGGREGATION_ALPHA = 0.05           # Nível de significância do intervalo de confiança
+AGGREGATION_MAX_ERROR_PCT = 10.0   # Erro de amostragem admissível (%)
+AGGREGATION_MAX_PARTIALS = 64      # Blocos de somas por parcela acumulados antes de consolidar
+
+# ==============================================================================
+# 5. Inicialização
 # ==============================================================================
 def init_directories():
     """Cria as pastas necessárias se elas não existirem."""
@@ -0,0 +1,237 @@
+# src/datastore.py
+
+import time
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from src.config import DATASET_STORE_MAX_BYTES
+from src.cache import dataset_fingerprint
+
+
+class _Entry:
+    __slots__ = ("key", "df", "nbytes", "name", "owners", "created", "last_access", "parent", "options")
+
+    def __init__(self, key: str, df: pd.DataFrame, name: str, parent: Optional[str]):
+        self.key = key
+        self.df = df
+        self.nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        self.name = name
+        self.owners = set()
+        self.created = self.last_access = time.time()
+        self.parent = parent
+        self.options: Dict[str, List[str]] = {}  # coluna -> valores distintos (filtros)
+
+
+class DatasetStore:
+    """
+    Datasets compartilhados pelo processo (todas as sessões do Streamlit).
+
+    - Deduplicados pelo hash do conteúdo: dez sessões com a mesma planilha
+      apontam para um único DataFrame.
+    - Cada sessão referencia no máximo um dataset por 'slot' ("bruto", "filtrado").
+      Entradas sem referência saem primeiro quando o orçamento de memória estoura.
+    - Os DataFrames entregues são somente leitura por contrato (não há trava:
+      o mesmo objeto está em todas as sessões). Filtre ou faça df.copy() antes
+      de alterar; nunca atribua colunas/células no DataFrame recebido.
+    """
+
+    def __init__(self, max_bytes: int = DATASET_STORE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._uploads: Dict[str, str] = {}          # hash do arquivo -> chave do dataset
+        self._slots: Dict[str, Dict[str, str]] = {}  # sessão -> slot -> chave
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.dedup_hits = 0
+        self.evictions = 0
+
+    # --- Inserção ---
+    def put(self, df: pd.DataFrame, name: str = "", key: Optional[str] = None, parent: Optional[str] = None) -> str:
+        """
+        Guarda df (ou reaproveita o já existente com o mesmo conteúdo) e devolve a chave.
+        O df passa a ser do armazenamento: quem o inseriu não deve mais alterá-lo.
+        """
+        key = key or dataset_fingerprint(df)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.dedup_hits += 1
+                entry.last_access = time.time()
+                self._entries.move_to_end(key)
+                return key
+            entry = _Entry(key, df, name, parent)
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            self._evict(keep=key)
+        return key
+
+    def put_upload(self, raw: bytes, name: str, load: Callable[[], Optional[pd.DataFrame]]) -> Optional[str]:
+        """
+        Importa um arquivo enviado: o mesmo arquivo (mesmos bytes) não é lido
+        nem limpo de novo enquanto seu dataset estiver no armazenamento.
+        """
+        file_hash = hashlib.blake2b(raw, digest_size=16).hexdigest()
+        with self._lock:
+            key = self._uploads.get(file_hash)
+            if key in self._entries:
+                self.dedup_hits += 1
+                return key
+        df = load()
+        if df is None:
+            return None
+        key = self.put(df, name)
+        with self._lock:
+            self._uploads[file_hash] = key
+        return key
+
+    def derive(self, parent: str, variant: Any, build: Callable[[], pd.DataFrame], name: str = "") -> str:
+        """
+        Dataset derivado (ex: seleção de filtros) compartilhado entre sessões com a mesma seleção.
+        'build' só roda se (parent, variant) ainda não estiver no armazenamento: reruns com a
+        mesma seleção não refiltram.
+        """
+        key = f"{parent}:{hashlib.blake2b(repr(variant).encode('utf-8'), digest_size=8).hexdigest()}"
+        with self._lock:
+            if key in self._entries:
+                return self.put(self._entries[key].df, key=key)
+        return self.put(build(), name=name, key=key, parent=parent)
+
+    # --- Acesso e referências ---
+    def get(self, key: Optional[str]) -> Optional[pd.DataFrame]:
+        """DataFrame compartilhado (sem cópia): somente leitura, use df.copy() antes de alterar."""
+        with self._lock:
+            entry = self._entries.get(key) if key else None
+            if entry is None:
+                return None
+            entry.last_access = time.time()
+            self._entries.move_to_end(key)
+            return entry.df
+
+    def column_options(self, key: str, col: str) -> List[str]:
+        """Valores distintos (como texto, ordenados) de uma coluna, calculados uma vez por dataset."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return []
+            options = entry.options.get(col)
+            df = entry.df
+        if options is None:
+            options = sorted(df[col].astype(str).unique())
+            with self._lock:
+                entry.options[col] = options
+        return options
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def acquire(self, owner: str, slot: str, key: str) -> None:
+        """
+        A sessão 'owner' passa a referenciar 'key' no slot (a referência anterior do slot é liberada).
+        A referência só protege do despejo; o DataFrame continua compartilhado e somente leitura.
+        """
+        with self._lock:
+            slots = self._slots.setdefault(owner, {})
+            old = slots.get(slot)
+            if old == key:
+                return
+            if old in self._entries:
+                self._entries[old].owners.discard((owner, slot))
+            if key in self._entries:
+                self._entries[key].owners.add((owner, slot))
+                slots[slot] = key
+            else:
+                slots.pop(slot, None)
+
+    def release_owner(self, owner: str) -> None:
+        """Solta todas as referências de uma sessão (chamado quando a sessão é descartada)."""
+        with self._lock:
+            for key in self._slots.pop(owner, {}).values():
+                if key in self._entries:
+                    self._entries[key].owners = {o for o in self._entries[key].owners if o[0] != owner}
+            self._evict()
+
+    def session_token(self, owner: str) -> object:
+        """
+        Objeto a guardar no session_state: quando a sessão termina e o estado é
+        coletado, suas referências são liberadas.
+        """
+        token = _SessionToken(owner)
+        weakref.finalize(token, self.release_owner, owner)
+        return token
+
+    # --- Memória ---
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
+        self.evictions += 1
+        for file_hash in [h for h, k in self._uploads.items() if k == key]:
+            del self._uploads[file_hash]
+        for owner, slot in entry.owners:
+            if self._slots.get(owner, {}).get(slot) == key:
+                del self._slots[owner][slot]
+        # Derivados não sobrevivem ao dataset de origem
+        for child in [k for k, e in self._entries.items() if e.parent == key]:
+            self._drop(child)
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Despeja por LRU: primeiro o que nenhuma sessão usa, depois (se preciso) o resto."""
+        for only_unreferenced in (True, False):
+            for key in list(self._entries):
+                if self._bytes <= self.max_bytes:
+                    return
+                entry = self._entries.get(key)
+                if entry is None or key == keep or (keep and entry.key == self._entries[keep].parent):
+                    continue
+                if only_unreferenced and entry.owners:
+                    continue
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._uploads.clear()
+            self._slots.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "datasets": len(self._entries),
+                "memoria_mb": self._bytes / 2**20,
+                "limite_mb": self.max_bytes / 2**20,
+                "sessoes": len([s for s in self._slots.values() if s]),
+                "deduplicados": self.dedup_hits,
+                "despejos": self.evictions,
+            }
+
+    def to_frame(self) -> pd.DataFrame:
+        """Visão de administração: um dataset por linha."""
+        now = time.time()
+        with self._lock:
+            rows: List[Dict[str, Any]] = [{
+                "chave": e.key[:12] + ("…" if len(e.key) > 12 else ""),
+                "nome": e.name,
+                "tipo": "derivado" if e.parent else "importado",
+                "linhas": len(e.df),
+                "colunas": e.df.shape[1],
+                "memoria_mb": e.nbytes / 2**20,
+                "sessoes": len({o for o, _ in e.owners}),
+                "idade_min": (now - e.created) / 60,
+                "ultimo_acesso_s": now - e.last_access,
+            } for e in reversed(self._entries.values())]
+        return pd.DataFrame(rows)
+
+
+class _SessionToken:
+    __slots__ = ("owner", "__weakref__")
+
+    def __init__(self, owner: str):
+        self.owner = owner
+
+
+DATASET_STORE = DatasetStore()
@@ -5,7 +5,11 @@ import numpy as np
 import pandas as pd
 import statsmodels.api as sm
 from statsmodels.stats.stattools import durbin_watson
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Tuple, Union
+from src.results import ModelResult
+from src.influence import leverage_from_pinv
+from src.profiling import span
+from src.jobs import checkpoint
 
 def _extract_dependent_variable(equation: str) -> Tuple[str, bool]:
     if "=" not in equation: raise ValueError("A equação deve conter um sinal de igual '='.")
@@ -24,189 +28,382 @@ def _extract_dependent_variable(equation: str) -> Tuple[str, bool]:
         # Se não tem log/ln, assume que é a variável direta (Linear)
         return eq_left.strip(), False
 
-def fit_regression_from_formula(df: pd.DataFrame, equation: str, alias_map: Dict[str, str]) -> Dict[str, Any]:
-    """
-    Ajuste OLS Blindado (PryAI Shielded).
-    Filtra erros físicos (negativos) e estatísticos (outliers extremos) automaticamente.
-    """
-    
-    # 1. Validação Y
-    try:
-        y_var_sym, is_log_y = _extract_dependent_variable(equation)
-    except ValueError as e: return {"error": str(e)}
+MATH_RESERVED = {"ln", "log", "exp", "sqrt", "pow", "pi", "e", "sin", "cos", "tan"}
+SAFE_FUNCS = {"ln": np.log, "log": np.log, "exp": np.exp, "sqrt": np.sqrt}
+
+def _parse_equation(equation: str, alias_map: Dict[str, str]) -> Tuple[str, bool, str, str, List[str]]:
+    """Separa Y (e se é log), a coluna real de Y, o lado direito e os símbolos X."""
+    y_var_sym, is_log_y = _extract_dependent_variable(equation)
 
     y_col_real = alias_map.get(y_var_sym)
-    if not y_col_real: return {"error": f"Variável '{y_var_sym}' não encontrada nos apelidos."}
-    if y_col_real not in df.columns: return {"error": f"Coluna '{y_col_real}' inexistente."}
-    
-    # 2. Variáveis X
+    if not y_col_real: raise ValueError(f"Variável '{y_var_sym}' não encontrada nos apelidos.")
+
     rhs_equation = equation.split("=")[1]
-    potential_vars = set(re.findall(r"[a-zA-Z_]\w*", rhs_equation))
-    math_reserved = {"ln", "log", "exp", "sqrt", "pow", "pi", "e", "sin", "cos", "tan"}
-    x_vars_sym = [v for v in potential_vars if v not in math_reserved and not v.startswith("b")]
-    
-    # 3. Preparação e BLINDAGEM de Dados
-    df_filtered = df.copy()
-    
-    try:
-        # === INÍCIO DA BLINDAGEM PryAI ===
-        
-        # Lista de colunas críticas (Y e Xs)
-        cols_to_check = [y_col_real]
-        for sym in x_vars_sym:
-            real = alias_map.get(sym)
-            if real and real in df_filtered.columns:
-                cols_to_check.append(real)
-        
-        # A. Limpeza Física e Numérica
-        for col in cols_to_check:
-            # Garante numérico (caso algo tenha passado pelo parser)
-            df_filtered[col] = pd.to_numeric(df_filtered[col], errors='coerce')
-            
-            # FILTRO FÍSICO: Remove valores <= 0
-            # Motivo: Em florestal, DAP, HT e Vol não podem ser negativos ou zero.
-            # Além disso, log(0) ou log(-1) quebra o script.
-            mask_invalid = df_filtered[col] <= 0
-            if mask_invalid.any():
-                df_filtered.loc[mask_invalid, col] = np.nan
-
-        # Remove linhas com NaN gerados acima
-        df_filtered = df_filtered.dropna(subset=cols_to_check)
-
-        # B. Filtro Estatístico (IQR - Caça Alienígenas)
-        # Remove outliers extremos (como DAP=500 quando a média é 15)
-        # Usa 3x IQR, que é um critério bem conservador (só remove erros grotescos)
+    # Ordem de aparição na equação (determinística, ao contrário de um set)
+    potential_vars = list(dict.fromkeys(re.findall(r"[a-zA-Z_]\w*", rhs_equation)))
+    x_vars_sym = [v for v in potential_vars if v not in MATH_RESERVED and not v.startswith("b")]
+    return y_var_sym, is_log_y, y_col_real, rhs_equation, x_vars_sym
+
+def _shield_columns(df: pd.DataFrame, y_col_real: str, x_vars_sym: List[str], alias_map: Dict[str, str]) -> List[str]:
+    """Lista de colunas críticas (Y e Xs) que passam pela blindagem."""
+    cols_to_check = [y_col_real]
+    for sym in x_vars_sym:
+        real = alias_map.get(sym)
+        if real and real in df.columns:
+            cols_to_check.append(real)
+    return cols_to_check
+
+def physical_filter(df: pd.DataFrame, cols_to_check: List[str]) -> pd.DataFrame:
+    """Etapa A da blindagem: colunas críticas numéricas e estritamente positivas."""
+    df_filtered = df[list(dict.fromkeys(cols_to_check))].copy()
+    for col in cols_to_check:
+        # Garante numérico (caso algo tenha passado pelo parser)
+        df_filtered[col] = pd.to_numeric(df_filtered[col], errors='coerce')
+
+        # FILTRO FÍSICO: Remove valores <= 0
+        # Motivo: Em florestal, DAP, HT e Vol não podem ser negativos ou zero.
+        # Além disso, log(0) ou log(-1) quebra o script.
+        mask_invalid = df_filtered[col] <= 0
+        if mask_invalid.any():
+            df_filtered.loc[mask_invalid, col] = np.nan
+
+    # Remove linhas com NaN gerados acima
+    return df_filtered.dropna(subset=cols_to_check)
+
+def apply_shield(df: pd.DataFrame, cols_to_check: List[str]) -> pd.DataFrame:
+    """
+    BLINDAGEM PryAI: filtro físico (<= 0) seguido do filtro IQR (3x).
+    Retorna apenas as colunas críticas das linhas sobreviventes (índice original preservado).
+    """
+    # A. Limpeza Física e Numérica
+    with span("shield.filtro_fisico", rows=len(df)):
+        df_filtered = physical_filter(df, cols_to_check)
+
+    # B. Filtro Estatístico (IQR - Caça Alienígenas)
+    # Remove outliers extremos (como DAP=500 quando a média é 15)
+    # Usa 3x IQR, que é um critério bem conservador (só remove erros grotescos)
+    with span("shield.filtro_iqr", rows=len(df_filtered)) as sp:
         for col in cols_to_check:
             if len(df_filtered) < 5: continue # Não filtra se tiver poucos dados
 
             Q1 = df_filtered[col].quantile(0.25)
             Q3 = df_filtered[col].quantile(0.75)
             IQR = Q3 - Q1
-            
+
             if IQR > 0:
                 lower_bound = Q1 - 3.0 * IQR
                 upper_bound = Q3 + 3.0 * IQR
-                
+
                 df_filtered = df_filtered[
-                    (df_filtered[col] >= lower_bound) & 
+                    (df_filtered[col] >= lower_bound) &
                     (df_filtered[col] <= upper_bound)
                 ]
-        
-        # === FIM DA BLINDAGEM ===
+        sp.rows = len(df_filtered)
+
+    return df_filtered
+
+def _build_design(df_filtered: pd.DataFrame, rhs_equation: str, x_vars_sym: List[str], alias_map: Dict[str, str]) -> pd.DataFrame:
+    """Avalia cada termo do lado direito e monta a matriz X (uma coluna por termo)."""
+    local_env = {}
+    for sym in x_vars_sym:
+        real_col = alias_map.get(sym)
+        # Verifica log interno em X (ex: 1/DAP ou ln(DAP))
+        # Como já filtramos <= 0 na blindagem, aqui deve estar seguro
+        local_env[sym] = df_filtered[real_col].values
+
+    # Avalia Termos da Equação
+    terms = rhs_equation.replace("-", "+-").split("+")
+    X_dict = {}
+
+    for term in terms:
+        term = term.strip()
+        if not term: continue
+
+        term_clean = re.sub(r"^[+-]?\s*[\d\.]+\s*\*", "", term)
+        term_clean = re.sub(r"^[+-]?\s*b\d+\s*\*", "", term_clean)
+
+        if not term_clean or term_clean.lower() in ["b0", "const", "intercept"]:
+            X_dict["const"] = 1.0
+            continue
+
+        safe_locals = local_env.copy()
+        safe_locals.update(SAFE_FUNCS)
+
+        try:
+            val = eval(term_clean, {"__builtins__": {}}, safe_locals)
+            X_dict[term_clean] = val
+        except Exception as e:
+            raise ValueError(f"Erro matemático no termo '{term_clean}': {e}")
+
+    X_df = pd.DataFrame(X_dict, index=df_filtered.index)
+
+    # Garante alinhamento final (caso o eval tenha gerado NaNs/Infs)
+    return X_df.replace([np.inf, -np.inf], np.nan).dropna()
+
+def _format_fitted_equation(params: Dict[str, float], y_var_sym: str, is_log_y: bool) -> str:
+    """Montagem da String da Equação"""
+    eq_parts = []
+    for k, v in params.items():
+        if k == "const": eq_parts.append(f"{v:.4f}")
+        else:
+            signal = "+" if v >= 0 else ""
+            eq_parts.append(f"{signal} {v:.4f}*({k})")
+
+    return f"{'ln(' if is_log_y else ''}{y_var_sym}{')' if is_log_y else ''} = " + " ".join(eq_parts)
+
+def fit_regression_from_formula(df: pd.DataFrame, equation: str, alias_map: Dict[str, str]) -> Union[ModelResult, Dict[str, Any]]:
+    """
+    Ajuste OLS Blindado (PryAI Shielded).
+    Filtra erros físicos (negativos) e estatísticos (outliers extremos) automaticamente.
+    """
+    with span("modelo.fit_regression_from_formula", rows=len(df)):
+        return _fit_regression_from_formula(df, equation, alias_map)
+
+def _fit_regression_from_formula(df: pd.DataFrame, equation: str, alias_map: Dict[str, str]) -> Union[ModelResult, Dict[str, Any]]:
+    # 1. Validação Y e 2. Variáveis X
+    try:
+        y_var_sym, is_log_y, y_col_real, rhs_equation, x_vars_sym = _parse_equation(equation, alias_map)
+    except ValueError as e: return {"error": str(e)}
+
+    if y_col_real not in df.columns: return {"error": f"Coluna '{y_col_real}' inexistente."}
+
+    # 3. Preparação e BLINDAGEM de Dados
+    checkpoint("Shield: filtros físico e IQR...", 0.1)  # Pontos de cancelamento entre etapas (em job)
+    try:
+        cols_to_check = _shield_columns(df, y_col_real, x_vars_sym, alias_map)
+        df_filtered = apply_shield(df, cols_to_check)
 
         if len(df_filtered) < 3:
             return {"error": "Dados insuficientes após remoção de erros e outliers."}
 
-        # Preparação Y
-        if is_log_y:
-            y_data = np.log(df_filtered[y_col_real])
-        else:
-            y_data = df_filtered[y_col_real]
-            
-        # Preparação X
-        local_env = {}
-        for sym in x_vars_sym:
-            real_col = alias_map.get(sym)
-            # Verifica log interno em X (ex: 1/DAP ou ln(DAP))
-            # Como já filtramos <= 0 na blindagem, aqui deve estar seguro
-            local_env[sym] = df_filtered[real_col].values
-
-        # Avalia Termos da Equação
-        terms = rhs_equation.replace("-", "+-").split("+")
-        X_dict = {}
-        
-        for term in terms:
-            term = term.strip()
-            if not term: continue
-            
-            term_clean = re.sub(r"^[+-]?\s*[\d\.]+\s*\*", "", term) 
-            term_clean = re.sub(r"^[+-]?\s*b\d+\s*\*", "", term_clean)
-            
-            if not term_clean or term_clean.lower() in ["b0", "const", "intercept"]:
-                X_dict["const"] = 1.0
-                continue
-                
-            safe_locals = local_env.copy()
-            safe_locals.update({"ln": np.log, "log": np.log, "exp": np.exp, "sqrt": np.sqrt})
-            
+        checkpoint("Montando a matriz X...", 0.3)
+        with span("modelo.matriz_x", rows=len(df_filtered)):
+            # Preparação Y
+            if is_log_y:
+                y_data = np.log(df_filtered[y_col_real])
+            else:
+                y_data = df_filtered[y_col_real]
+
             try:
-                val = eval(term_clean, {"__builtins__": {}}, safe_locals)
-                X_dict[term_clean] = val
-            except Exception as e:
-                return {"error": f"Erro matemático no termo '{term_clean}': {e}"}
-
-        X_df = pd.DataFrame(X_dict, index=df_filtered.index)
-        
-        # Garante alinhamento final (caso o eval tenha gerado NaNs/Infs)
-        X_df = X_df.replace([np.inf, -np.inf], np.nan).dropna()
-        
-        common_idx = X_df.index.intersection(y_data.index)
-        Y_final = y_data.loc[common_idx]
-        X_final = X_df.loc[common_idx]
-        
+                X_df = _build_design(df_filtered, rhs_equation, x_vars_sym, alias_map)
+            except ValueError as e:
+                return {"error": str(e)}
+
+            common_idx = X_df.index.intersection(y_data.index)
+            Y_final = y_data.loc[common_idx]
+            X_final = X_df.loc[common_idx]
+
         if len(Y_final) < 3:
             return {"error": "Número insuficiente de dados válidos (< 3) para regressão."}
 
         # 4. Ajuste OLS
-        model = sm.OLS(Y_final, X_final)
-        results = model.fit()
+        checkpoint("Ajustando OLS...", 0.5)
+        with span("modelo.ols", rows=len(Y_final)):
+            model = sm.OLS(Y_final, X_final)
+            results = model.fit()
 
     except Exception as e:
         return {"error": f"Erro crítico no processamento: {str(e)}"}
 
     # 5. Métricas e Retorno
-    r2_adj = results.rsquared_adj
-    rmse = np.sqrt(results.mse_resid)
-    
-    if is_log_y:
-        fc = float(np.exp(results.mse_resid / 2.0))
-    else:
-        fc = None
+    checkpoint("Métricas e diagnósticos...", 0.8)
+    with span("modelo.metricas", rows=len(Y_final)):
+        r2_adj = results.rsquared_adj
+        rmse = np.sqrt(results.mse_resid)
 
-    aic = results.aic
-    bic = results.bic
-    dw_stat = durbin_watson(results.resid)
-    
-    # Syx%
-    y_mean_real = df_filtered.loc[common_idx, y_col_real].mean()
-    
+        if is_log_y:
+            fc = float(np.exp(results.mse_resid / 2.0))
+        else:
+            fc = None
+
+        aic = results.aic
+        bic = results.bic
+        dw_stat = durbin_watson(results.resid)
+
+        # Alavancagem com a pseudo-inversa do próprio ajuste; os diagnósticos saem sob demanda
+        leverage = leverage_from_pinv(X_final.to_numpy(dtype=float), results.model.pinv_wexog)
+
+        # Syx%
+        y_mean_real = df_filtered.loc[common_idx, y_col_real].mean()
+
+        if is_log_y:
+            y_pred_log = results.fittedvalues
+            y_pred_real = np.exp(y_pred_log) * fc
+            y_obs_real = df_filtered.loc[common_idx, y_col_real]
+            rmse_real = np.sqrt(((y_obs_real - y_pred_real) ** 2).mean())
+            syx_pct = (rmse_real / y_mean_real) * 100 if y_mean_real != 0 else 0
+        else:
+            syx_pct = (rmse / y_mean_real) * 100 if y_mean_real != 0 else 0
+
+    eq_final_str = _format_fitted_equation(results.params.to_dict(), y_var_sym, is_log_y)
+
+    return ModelResult(
+        equation_original=equation,
+        equation_fitted=eq_final_str,
+        r2_adj=r2_adj,
+        rmse=rmse,
+        fc_meyer=fc,
+        syx_pct=syx_pct,
+        aic=aic,
+        bic=bic,
+        durbin_watson=dw_stat,
+        n_obs=int(results.nobs),
+        coefs=results.params.to_dict(),
+        is_log=is_log_y,
+        y_col_real=y_col_real,
+        # Arrays float64 (sem .tolist()) + posições (iloc) das linhas usadas em df
+        row_index=df.index.get_indexer(common_idx),
+        y_real=Y_final.to_numpy(dtype=np.float64),
+        y_pred=results.fittedvalues.to_numpy(dtype=np.float64),
+        leverage=leverage
+    )
+
+def _solve_shared(X: np.ndarray, Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Resolve X·B = Y para todas as colunas de Y com uma única fatoração de X.
+    QR fina quando X tem posto completo; SVD (pseudo-inversa, como o statsmodels) se não.
+    Retorna (B, alavancagem, posto).
+    """
+    n, p = X.shape
+    Q, R = np.linalg.qr(X, mode="reduced")
+    diag = np.abs(np.diag(R))
+    if p and diag.min() > diag.max() * max(n, p) * np.finfo(float).eps:
+        B = np.linalg.solve(R, Q.T @ Y)
+        return B, np.einsum("ij,ij->i", Q, Q), p
+    U, sv, Vt = np.linalg.svd(X, full_matrices=False)
+    rank = int((sv > sv.max() * max(n, p) * np.finfo(float).eps).sum()) if p else 0
+    U, sv, Vt = U[:, :rank], sv[:rank], Vt[:rank]
+    B = Vt.T @ ((U.T @ Y) / sv[:, np.newaxis])
+    return B, np.einsum("ij,ij->i", U, U), rank
+
+def _ols_result(equation: str, y_var_sym: str, is_log_y: bool, y_col: str, alias_map: Dict[str, str],
+                columns: List[str], X: np.ndarray, y: np.ndarray, y_real: np.ndarray, beta: np.ndarray,
+                fitted: np.ndarray, rank: int, leverage: np.ndarray, row_index: np.ndarray) -> ModelResult:
+    """
+    ModelResult de uma solução OLS obtida fora do statsmodels (QR compartilhada,
+    downdates), com as mesmas fórmulas do statsmodels: R² (centrado com constante),
+    AIC/BIC pela log-verossimilhança gaussiana com k = posto, Meyer e Syx% na escala real.
+    """
+    n = len(y)
+    k_constant = int("const" in columns)
+    e = y - fitted
+    ssr = float(e @ e)
+    df_resid = n - rank
+    mse_resid = ssr / df_resid if df_resid > 0 else np.nan
+    tss = float(((y - y.mean()) ** 2).sum()) if k_constant else float(y @ y)
+    r2 = 1 - ssr / tss if tss > 0 else np.nan
+    r2_adj = 1 - (n - k_constant) / df_resid * (1 - r2) if df_resid > 0 else np.nan
+    llf = -n / 2.0 * (np.log(2 * np.pi) + np.log(ssr / n) + 1)
+    fc = float(np.exp(mse_resid / 2.0)) if is_log_y else None
+
+    y_mean_real = y_real.mean()
     if is_log_y:
-        y_pred_log = results.fittedvalues
-        y_pred_real = np.exp(y_pred_log) * fc
-        y_obs_real = df_filtered.loc[common_idx, y_col_real]
-        rmse_real = np.sqrt(((y_obs_real - y_pred_real) ** 2).mean())
+        rmse_real = np.sqrt(((y_real - np.exp(fitted) * fc) ** 2).mean())
         syx_pct = (rmse_real / y_mean_real) * 100 if y_mean_real != 0 else 0
     else:
-        syx_pct = (rmse / y_mean_real) * 100 if y_mean_real != 0 else 0
+        syx_pct = (np.sqrt(mse_resid) / y_mean_real) * 100 if y_mean_real != 0 else 0
 
-    # Montagem da String da Equação
-    eq_parts = []
-    for k, v in results.params.items():
-        if k == "const": eq_parts.append(f"{v:.4f}")
+    params = dict(zip(columns, np.asarray(beta, dtype=float).tolist()))
+    return ModelResult(
+        equation_original=equation,
+        equation_fitted=_format_fitted_equation(params, y_var_sym, is_log_y),
+        r2_adj=r2_adj,
+        rmse=np.sqrt(mse_resid),
+        fc_meyer=fc,
+        syx_pct=syx_pct,
+        aic=-2 * llf + 2 * rank,
+        bic=-2 * llf + np.log(n) * rank,
+        durbin_watson=float(np.sum(np.diff(e) ** 2) / ssr) if ssr > 0 else np.nan,
+        n_obs=n,
+        coefs=params,
+        is_log=is_log_y,
+        y_col_real=y_col,
+        alias_map_used={**alias_map, y_var_sym: y_col},
+        row_index=row_index,
+        y_real=y,
+        y_pred=fitted,
+        leverage=leverage
+    )
+
+def fit_regression_multi_target(df: pd.DataFrame, equation: str, alias_map: Dict[str, str], y_cols: List[str],
+                                common_rows: bool = True) -> Union[Dict[str, Union[ModelResult, Dict[str, str]]], Dict[str, str]]:
+    """
+    Ajusta o mesmo lado direito a vários Y (ex: volume total, comercial, biomassas).
+
+    A matriz X é montada uma vez e cada conjunto de linhas é fatorado uma única
+    vez (QR): todos os Y desse conjunto são resolvidos juntos, e a alavancagem
+    (da mesma QR) serve a todos os diagnósticos de influência.
+    common_rows=True: linhas válidas para todos os Y (blindagem sobre Ys + Xs).
+    common_rows=False: blindagem por alvo, como em fit_regression_from_formula;
+    alvos com as mesmas linhas compartilham a fatoração.
+    Retorna {coluna Y: ModelResult ou {"error": ...}}.
+    """
+    with span("modelo.fit_regression_multi_target", rows=len(df)) as sp:
+        out = _fit_regression_multi_target(df, equation, alias_map, y_cols, common_rows)
+        sp.rows = len(df) * len(y_cols)
+    return out
+
+def _fit_regression_multi_target(df, equation, alias_map, y_cols, common_rows):
+    try:
+        y_var_sym, is_log_y, _, rhs_equation, x_vars_sym = _parse_equation(equation, alias_map)
+    except ValueError as e: return {"error": str(e)}
+
+    y_cols = list(dict.fromkeys(y_cols))
+    if not y_cols: return {"error": "Selecione ao menos uma coluna Y."}
+    missing = [c for c in y_cols if c not in df.columns]
+    if missing: return {"error": f"Colunas inexistentes: {', '.join(missing)}."}
+    x_cols = [c for c in _shield_columns(df, y_cols[0], x_vars_sym, alias_map)[1:] if c not in y_cols]
+
+    out: Dict[str, Any] = {}
+    checkpoint("Shield dos alvos...", 0.1)
+    try:
+        # 1. Blindagem: uma vez para todos os Y, ou uma por alvo
+        if common_rows:
+            shielded = apply_shield(df, y_cols + x_cols)
+            kept = {y: shielded.index for y in y_cols}
         else:
-            signal = "+" if v >= 0 else ""
-            eq_parts.append(f"{signal} {v:.4f}*({k})")
-            
-    eq_final_str = f"{'ln(' if is_log_y else ''}{y_var_sym}{')' if is_log_y else ''} = " + " ".join(eq_parts)
-
-    return {
-        "success": True,
-        "equation_original": equation,
-        "equation_fitted": eq_final_str,
-        "r2_adj": r2_adj,
-        "rmse": rmse,
-        "fc_meyer": fc,
-        "syx_pct": syx_pct,
-        "aic": aic,
-        "bic": bic,
-        "durbin_watson": dw_stat,
-        "n_obs": int(results.nobs),
-        "coefs": results.params.to_dict(),
-        "is_log": is_log_y,
-        "y_col_real": y_col_real,
-        "data_points": {
-            "y_real": Y_final.tolist(),
-            "y_pred": results.fittedvalues.tolist()
-        }
-    }
+            kept = {y: apply_shield(df, [y] + x_cols).index for y in y_cols}
+
+        # 2. X uma única vez, sobre a união das linhas sobreviventes
+        union = kept[y_cols[0]]
+        for idx in kept.values():
+            union = union.union(idx)
+        checkpoint("Montando a matriz X...", 0.3)
+        with span("modelo.matriz_x", rows=len(union)):
+            df_x = physical_filter(df.loc[union], x_cols) if x_cols else df.loc[union, []]
+            X_df = _build_design(df_x, rhs_equation, x_vars_sym, alias_map)
+            y_real_all = df.loc[X_df.index, y_cols].apply(pd.to_numeric, errors='coerce')
+
+        # 3. Alvos com o mesmo conjunto de linhas dividem a fatoração
+        groups: Dict[bytes, List[str]] = {}
+        rows_of: Dict[bytes, pd.Index] = {}
+        for y in y_cols:
+            rows = X_df.index.intersection(kept[y])
+            key = df.index.get_indexer(rows).tobytes()
+            groups.setdefault(key, []).append(y)
+            rows_of[key] = rows
+    except Exception as e:
+        return {"error": f"Erro crítico no processamento: {str(e)}"}
+
+    for key, targets in groups.items():
+        rows = rows_of[key]
+        n = len(rows)
+        if n < 3:
+            for y in targets: out[y] = {"error": "Número insuficiente de dados válidos (< 3) para regressão."}
+            continue
+
+        checkpoint(f"Ajustando {', '.join(targets)}...", 0.5)
+        with span("modelo.ols_qr_compartilhada", rows=n * len(targets)):
+            X = X_df.loc[rows].to_numpy(dtype=float)
+            Y_real = y_real_all.loc[rows, targets].to_numpy(dtype=float)
+            Y = np.log(Y_real) if is_log_y else Y_real
+            B, leverage, rank = _solve_shared(X, Y)
+            fitted = X @ B
 
+        checkpoint("Métricas e diagnósticos...", 0.8)
+        with span("modelo.metricas", rows=n * len(targets)):
+            row_index = df.index.get_indexer(rows)
+            for j, y in enumerate(targets):
+                out[y] = _ols_result(equation, y_var_sym, is_log_y, y, alias_map, list(X_df.columns), X,
+                                     Y[:, j], Y_real[:, j], B[:, j], fitted[:, j], rank, leverage, row_index)
+    return {y: out[y] for y in y_cols}
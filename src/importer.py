@@ -0,0 +1,233 @@
+# src/importer.py
+"""
+Importação de várias planilhas (arquivos e abas) em paralelo.
+
+Uso sem interface (pasta inteira):
+    python -m src.importer dados/campanha_2026 -o outputs/campanha.parquet
+"""
+
+import io
+import re
+import sys
+import argparse
+import multiprocessing
+import unicodedata
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.config import COLUMN_SYNONYMS, IMPORT_MAX_WORKERS, IMPORT_PARALLEL_MIN_BYTES
+from src.parser import initial_preprocess, clean_and_convert_data
+from src.profiling import span
+
+SUPPORTED_SUFFIXES = (".csv", ".xlsx", ".xls")
+SOURCE_FILE_COL = "source_file"
+SOURCE_SHEET_COL = "source_sheet"
+
+# Variação normalizada -> nome canônico normalizado
+_SYNONYM_LOOKUP = {alt: canon for canon, alts in COLUMN_SYNONYMS.items() for alt in alts + [canon]}
+
+
+def normalize_header(name: Any) -> str:
+    """'DAP (cm)', 'dap_cm' e 'D.A.P.' viram 'dap'; 'Altura Total' e 'HT (m)' viram 'ht'."""
+    text = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii").lower()
+    text = re.sub(r"[\(\[].*?[\)\]]", "", text)   # Unidades: (cm), [m³]
+    text = re.sub(r"[^a-z0-9]", "", text)
+    return _SYNONYM_LOOKUP.get(text, text)
+
+
+def header_unit(name: Any) -> str:
+    """Unidade entre parênteses/colchetes do cabeçalho, normalizada: 'DAP (cm)' -> 'cm'; sem unidade -> ''."""
+    text = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii").lower()
+    return "".join(re.sub(r"[^a-z0-9]", "", u) for u in re.findall(r"[\(\[](.*?)[\)\]]", text))
+
+
+# ==============================================================================
+# Leitura de um arquivo (roda no processo worker)
+# ==============================================================================
+def _parse_source(name: str, payload: Union[bytes, str]) -> Tuple[List[Tuple[Optional[str], pd.DataFrame]], List[Dict[str, Any]]]:
+    """
+    Lê e limpa todas as abas de um arquivo. 'payload' são os bytes enviados ou um caminho.
+    Nunca levanta exceção: problemas vão para a lista de ocorrências.
+    """
+    frames, report = [], []
+    buffer = io.BytesIO(payload) if isinstance(payload, (bytes, bytearray)) else payload
+    try:
+        if name.lower().endswith(".csv"):
+            sheets = {None: pd.read_csv(buffer)}
+        else:
+            sheets = pd.read_excel(buffer, sheet_name=None)
+    except Exception as e:
+        return [], [{"arquivo": name, "aba": None, "status": "erro", "linhas": 0, "mensagem": f"{type(e).__name__}: {e}"}]
+
+    for sheet, raw in sheets.items():
+        try:
+            df = initial_preprocess(raw)
+            if df.empty:
+                report.append({"arquivo": name, "aba": sheet, "status": "ignorada", "linhas": 0, "mensagem": "Aba vazia."})
+                continue
+            if not len(df.select_dtypes(include=[np.number]).columns):
+                # Abas de anotações/legendas não entram no dataset
+                report.append({"arquivo": name, "aba": sheet, "status": "ignorada", "linhas": len(df), "mensagem": "Sem colunas numéricas."})
+                continue
+            frames.append((sheet, df))
+            report.append({"arquivo": name, "aba": sheet, "status": "ok", "linhas": len(df), "mensagem": ""})
+        except Exception as e:
+            report.append({"arquivo": name, "aba": sheet, "status": "erro", "linhas": 0, "mensagem": f"{type(e).__name__}: {e}"})
+    return frames, report
+
+
+# ==============================================================================
+# Reconciliação de esquemas
+# ==============================================================================
+def reconcile_schemas(frames: Sequence[pd.DataFrame]) -> Tuple[List[pd.DataFrame], Dict[str, List[str]]]:
+    """
+    Renomeia colunas equivalentes para uma grafia única: a mais frequente entre
+    os arquivos (empate: a que apareceu primeiro). Unidades diferentes não se
+    juntam ('DAP (cm)' e 'DAP (mm)' seguem separadas); grafia sem unidade entra
+    na coluna com unidade só se houver uma única unidade para aquele nome.
+    Retorna os frames renomeados e {nome final: [grafias encontradas]} para o relatório.
+    """
+    units: Dict[str, set] = {}
+    for df in frames:
+        for col in df.columns:
+            units.setdefault(normalize_header(col), set()).add(header_unit(col))
+
+    def key(col):
+        name, unit = normalize_header(col), header_unit(col)
+        explicit = units[name] - {""}
+        return name, unit or (next(iter(explicit)) if len(explicit) == 1 else "")
+
+    spellings: Dict[Tuple[str, str], Counter] = {}
+    for df in frames:
+        for col in df.columns:
+            spellings.setdefault(key(col), Counter())[str(col)] += 1
+    canonical = {k: counts.most_common(1)[0][0] for k, counts in spellings.items()}
+
+    renamed = []
+    for df in frames:
+        mapping, used = {}, set()
+        for col in df.columns:
+            target = canonical[key(col)]
+            # Duas colunas do mesmo arquivo caindo no mesmo nome: mantém a segunda como está
+            mapping[col] = target if target not in used else str(col)
+            used.add(mapping[col])
+        renamed.append(df.rename(columns=mapping))
+    merged = {canonical[k]: sorted(v) for k, v in spellings.items() if len(v) > 1}
+    return renamed, merged
+
+
+def _combine(parsed: List[Tuple[str, Optional[str], pd.DataFrame]]) -> Tuple[pd.DataFrame, Dict[str, List[str]]]:
+    with span("importacao.reconciliacao", rows=sum(len(df) for _, _, df in parsed)):
+        frames, merged = reconcile_schemas([df for _, _, df in parsed])
+        tag = len(parsed) > 1
+        if tag:
+            # Coluna numérica em um arquivo e texto em outro: converte o texto em cada bloco,
+            # antes de juntar (a detecção de vírgula decimal é por bloco; colunas já numéricas não mudam)
+            numeric_somewhere = {c for f in frames for c in f.select_dtypes(include=[np.number]).columns}
+            for i, f in enumerate(frames):
+                mixed = [c for c in f.columns if c in numeric_somewhere and not pd.api.types.is_numeric_dtype(f[c])]
+                if mixed:
+                    frames[i] = f.assign(**clean_and_convert_data(f[mixed]))
+            frames = [df.assign(**{SOURCE_FILE_COL: name, SOURCE_SHEET_COL: sheet if sheet is not None else ""})
+                      for (name, sheet, _), df in zip(parsed, frames)]
+        df = pd.concat(frames, ignore_index=True, sort=False) if len(frames) > 1 else frames[0]
+        if tag:
+            df[SOURCE_FILE_COL] = df[SOURCE_FILE_COL].astype("category")
+            df[SOURCE_SHEET_COL] = df[SOURCE_SHEET_COL].astype("category")
+    return df, merged
+
+
+# ==============================================================================
+# API
+# ==============================================================================
+def import_sources(sources: Sequence[Tuple[str, Union[bytes, str]]], max_workers: int = IMPORT_MAX_WORKERS,
+                   parallel_min_bytes: int = IMPORT_PARALLEL_MIN_BYTES) -> Tuple[Optional[pd.DataFrame], pd.DataFrame]:
+    """
+    Lê (nome, bytes ou caminho) de vários arquivos e devolve (dataset, relatório).
+
+    Arquivos são lidos e limpos em processos separados; cada aba com dados vira
+    um bloco. Blocos são reconciliados (mesma coluna com grafias diferentes),
+    concatenados e marcados com 'source_file'/'source_sheet' quando há mais de
+    um. Falhas ficam no relatório, uma linha por arquivo/aba, sem abortar.
+    O dataset é None se nada pôde ser lido.
+    """
+    with span("importacao.import_sources") as sp:
+        total_bytes = sum(len(p) if isinstance(p, (bytes, bytearray)) else Path(p).stat().st_size for _, p in sources)
+        results: Dict[int, Tuple[list, list]] = {}
+        workers = min(max_workers, len(sources))
+
+        with span("importacao.leitura_paralela" if workers > 1 and total_bytes >= parallel_min_bytes else "importacao.leitura"):
+            if workers > 1 and total_bytes >= parallel_min_bytes:
+                try:
+                    # 'spawn': o servidor do Streamlit tem threads, e fork com threads pode travar
+                    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                        futures = {pool.submit(_parse_source, name, payload): i for i, (name, payload) in enumerate(sources)}
+                        for fut in as_completed(futures):
+                            results[futures[fut]] = fut.result()
+                except Exception as e:
+                    # Ambiente sem multiprocessamento (ou worker morto): segue no processo atual
+                    print(f"[importer] Pool de processos indisponível ({e}); lendo em série.", file=sys.stderr)
+                    results = {}
+            for i, (name, payload) in enumerate(sources):
+                if i not in results:
+                    results[i] = _parse_source(name, payload)
+
+        parsed, report = [], []
+        for i, (name, _) in enumerate(sources):  # Ordem estável: a de entrada
+            frames, rows = results[i]
+            parsed.extend((name, sheet, df) for sheet, df in frames)
+            report.extend(rows)
+        report_df = pd.DataFrame(report, columns=["arquivo", "aba", "status", "linhas", "mensagem"])
+        if not parsed:
+            return None, report_df
+
+        df, merged = _combine(parsed)
+        report_df.attrs["colunas_unificadas"] = merged
+        sp.rows = len(df)
+    return df, report_df
+
+
+def import_directory(folder: Union[str, Path], recursive: bool = False, **kwargs) -> Tuple[Optional[pd.DataFrame], pd.DataFrame]:
+    """Modo pasta (sem interface): importa todos os CSV/Excel de 'folder'."""
+    folder = Path(folder)
+    pattern = "**/*" if recursive else "*"
+    files = sorted(p for p in folder.glob(pattern)
+                   if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES and not p.name.startswith("~$"))
+    sources = [(str(p.relative_to(folder)), str(p)) for p in files]
+    if not sources:
+        return None, pd.DataFrame([{"arquivo": str(folder), "aba": None, "status": "erro", "linhas": 0,
+                                    "mensagem": "Nenhum arquivo CSV/Excel encontrado."}])
+    return import_sources(sources, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa uma pasta de planilhas para um único dataset.")
+    parser.add_argument("pasta", help="Pasta com arquivos .csv/.xlsx/.xls")
+    parser.add_argument("-o", "--saida", help="Arquivo de saída (.csv ou .parquet)")
+    parser.add_argument("-r", "--recursivo", action="store_true", help="Inclui subpastas")
+    parser.add_argument("--workers", type=int, default=IMPORT_MAX_WORKERS)
+    args = parser.parse_args(argv)
+
+    df, report = import_directory(args.pasta, recursive=args.recursivo, max_workers=args.workers)
+    print(report.to_string(index=False))
+    for final, variants in report.attrs.get("colunas_unificadas", {}).items():
+        print(f"Coluna '{final}' unifica: {', '.join(variants)}")
+    if df is None:
+        return 1
+    print(f"\n{len(df):,} linhas x {df.shape[1]} colunas")
+    if args.saida:
+        out = Path(args.saida)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == ".parquet": df.to_parquet(out, index=False)
+        else: df.to_csv(out, index=False)
+        print(f"Gravado em {out}")
+    return 0 if (report["status"] != "erro").all() else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
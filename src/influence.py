@@ -0,0 +1,137 @@
+# src/influence.py
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+
+from src.profiling import span
+
+INFLUENCE_FIELDS = ("leverage", "student_resid", "cooks_d", "dffits")
+
+# Colunas da tabela de árvores influentes (nome interno -> rótulo)
+INFLUENCE_LABELS = {
+    "linha": "Linha",
+    "observado": "Observado",
+    "previsto": "Previsto",
+    "leverage": "Alavancagem (h)",
+    "student_resid": "Resíduo Studentizado",
+    "cooks_d": "Distância de Cook",
+    "dffits": "DFFITS",
+}
+
+
+def influence_measures(X: np.ndarray, resid: np.ndarray, rank: Optional[int] = None,
+                       leverage: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Diagnósticos de influência de um ajuste OLS, vetorizados.
+
+    A alavancagem h_i é a soma dos quadrados da linha i do fator Q da QR fina
+    (n x p): a matriz chapéu n x n nunca é formada. Com s² = SQRes/(n-p):
+      r_i = e_i / (s·sqrt(1-h_i))                      (studentizado interno)
+      t_i = r_i·sqrt((n-p-1)/(n-p-r_i²))               (studentizado externo)
+      D_i = r_i²·h_i / (p·(1-h_i))                     (Cook)
+      DFFITS_i = t_i·sqrt(h_i/(1-h_i))
+    Com 'leverage' já calculada (ex: QR compartilhada entre vários Y), a QR é pulada.
+    """
+    X = np.asarray(X, dtype=float)
+    e = np.asarray(resid, dtype=float)
+    n, p = X.shape
+    p = rank or p
+
+    if leverage is not None:
+        h = np.asarray(leverage, dtype=float)
+    else:
+        with span("influencia.qr", rows=n):
+            Q = np.linalg.qr(X, mode="reduced")[0]
+            h = np.einsum("ij,ij->i", Q, Q)
+            del Q
+    return _from_leverage(h, e, p)
+
+
+def leverage_from_pinv(X: np.ndarray, pinv: np.ndarray) -> np.ndarray:
+    """h_i = x_i·(X⁺)_i com a pseudo-inversa que o statsmodels já calculou no ajuste (sem nova QR)."""
+    return np.einsum("ij,ji->i", np.asarray(X, dtype=float), pinv)
+
+
+def influence_cached(results) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Os quatro diagnósticos de um resultado, calculados só quando pedidos (painel,
+    PDF, exportação) e guardados no cache de renderização do resultado.
+
+    O resultado guarda apenas a alavancagem (da fatoração do próprio ajuste) e, no
+    WLS, √w; resíduos vêm de observado - previsto na escala do ajuste e o posto é
+    Σh (traço da matriz chapéu). None se o resultado não tem alavancagem (Manual,
+    out-of-core).
+    """
+    from src.cache import cached_render
+    if results.get('leverage') is None:
+        return None
+
+    def build():
+        h = results['leverage']
+        e = results['y_real'] - results['y_pred']
+        if results.get('resid_weight') is not None:
+            e = e * results['resid_weight']
+        with span("influencia.diagnosticos", rows=len(h)):
+            return _from_leverage(h, e, max(int(round(float(h.sum()))), 1))
+
+    return cached_render(results, "influencia", (), build)
+
+
+def _from_leverage(h: np.ndarray, e: np.ndarray, p: int) -> Dict[str, np.ndarray]:
+    n = len(e)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        one_minus_h = np.clip(1.0 - h, 1e-12, None)
+        s2 = float(e @ e) / (n - p) if n > p else np.nan
+        r = e / np.sqrt(s2 * one_minus_h)
+        t = r * np.sqrt((n - p - 1) / np.clip(n - p - r ** 2, 1e-12, None))
+        cooks = r ** 2 * h / (p * one_minus_h)
+        dffits = t * np.sqrt(h / one_minus_h)
+    return {"leverage": h, "student_resid": t, "cooks_d": cooks, "dffits": dffits}
+
+
+def influence_thresholds(n: int, p: int) -> Dict[str, float]:
+    """Limites usuais de alerta (Belsley, Kuh & Welsch; Cook)."""
+    return {
+        "leverage": 2.0 * p / n,
+        "student_resid": 3.0,
+        "cooks_d": 4.0 / n,
+        "dffits": 2.0 * np.sqrt(p / n),
+    }
+
+
+def top_influential(results, k: int = 10, by: str = "cooks_d", df_original: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    As k árvores mais influentes (pelo critério 'by'), com os quatro diagnósticos.
+    'linha' é a posição da árvore no DataFrame ajustado; com df_original, as três
+    primeiras colunas dele (ex: talhão/parcela/árvore) identificam cada linha.
+    Vazio se o resultado não tem diagnósticos (ex: modo Manual, out-of-core).
+    """
+    diagnostics = influence_cached(results)
+    if diagnostics is None or not len(diagnostics[by]):
+        return pd.DataFrame(columns=list(INFLUENCE_LABELS))
+    values = diagnostics[by]
+
+    k = min(k, len(values))
+    score = np.abs(values)
+    score = np.where(np.isfinite(score), score, -np.inf)
+    top = np.argpartition(-score, k - 1)[:k]
+    top = top[np.argsort(-score[top], kind="stable")]
+
+    out = pd.DataFrame({
+        "linha": results['row_index'][top],
+        "observado": results['y_real'][top],
+        "previsto": results['y_pred'][top],
+        **{f: diagnostics[f][top] for f in INFLUENCE_FIELDS},
+    })
+    if df_original is not None and len(df_original) and out["linha"].max() < len(df_original):
+        ids = df_original.iloc[out["linha"].to_numpy()][df_original.columns[:3]].reset_index(drop=True)
+        out = pd.concat([ids, out], axis=1)
+
+    p = len(results.get('coefs', {})) or 1
+    limits = influence_thresholds(len(values), p)
+    out["alertas"] = [
+        ", ".join(INFLUENCE_LABELS[f] for f, lim in limits.items() if abs(row[f]) > lim)
+        for _, row in out.iterrows()
+    ]
+    return out
@@ -0,0 +1,340 @@
+# src/jobs.py
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from src.config import JOB_POOL_SIZE, JOB_RETENTION_S, JOB_MAX_FINISHED
+from src.profiling import start_trace, finish_trace
+
+# Estados de um job
+PENDENTE, EXECUTANDO, CONCLUIDO, ERRO, CANCELADO = "pendente", "executando", "concluído", "erro", "cancelado"
+FINAL_STATES = (CONCLUIDO, ERRO, CANCELADO)
+
+
+class JobCancelled(BaseException):
+    """
+    Levantada dentro do job quando o usuário pede cancelamento. Herda de BaseException
+    (como asyncio.CancelledError) para atravessar os 'except Exception' das funções de modelo.
+    """
+
+
+class JobContext:
+    """Entregue à função do job: reporta progresso e verifica cancelamento."""
+
+    def __init__(self, job: "Job"):
+        self._job = job
+
+    def progress(self, fraction: float, message: str = "") -> None:
+        self.check_cancelled()
+        self._job.progress = float(min(max(fraction, 0.0), 1.0))
+        if message:
+            self._job.message = message
+
+    def publish(self, partial: Any) -> None:
+        """Entrega um resultado preliminar (ex: prévia em subamostra) antes do final."""
+        self.check_cancelled()
+        self._job.partial = partial
+        self._job._partial_ready.set()
+
+    def check_cancelled(self) -> None:
+        if self._job._cancel.is_set():
+            raise JobCancelled()
+
+    def checkpoint(self, message: str = "", fraction: Optional[float] = None) -> None:
+        """Como progress, mas sem mexer na barra quando não há fração."""
+        self.check_cancelled()
+        if fraction is not None:
+            self._job.progress = float(min(max(fraction, self._job.progress), 1.0))
+        if message:
+            self._job.message = message
+
+
+# JobContext do job em execução nesta thread (None fora dos workers)
+_current_job: ContextVar[Optional[JobContext]] = ContextVar("canopy_job", default=None)
+
+
+def checkpoint(message: str = "", fraction: Optional[float] = None) -> None:
+    """
+    Ponto de cancelamento entre etapas de um cálculo (Shield, matriz X, ajuste, diagnósticos,
+    rodadas...). Dentro de um job levanta JobCancelled se o usuário cancelou e atualiza a
+    mensagem; fora de um job não faz nada.
+    """
+    ctx = _current_job.get()
+    if ctx is not None:
+        ctx.checkpoint(message, fraction)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._job._cancel.is_set()
+
+
+class Job:
+    """Um cálculo submetido ao pool. Vive fora do ciclo de rerun do Streamlit."""
+
+    def __init__(self, kind: str, label: str, owner: Optional[str], profile: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.label = label
+        self.owner = owner
+        self.profile = profile
+        self.status = PENDENTE
+        self.progress = 0.0
+        self.message = "Na fila..."
+        self.result = None
+        self.partial = None
+        self.error = None
+        self.trace = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._partial_ready = threading.Event()
+        self._future = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL_STATES
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Bloqueia até o fim do job (ou timeout). True se terminou."""
+        return self._done.wait(timeout)
+
+    def wait_partial(self, timeout: Optional[float] = None) -> bool:
+        """Bloqueia até haver resultado preliminar ou o job terminar. True se há algo para mostrar."""
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._partial_ready.is_set() and not self._done.is_set():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            self._partial_ready.wait(0.05 if remaining is None else min(0.05, remaining))
+        return self._partial_ready.is_set() or self._done.is_set()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+        # Ainda na fila: nem chega a executar
+        if self._future is not None and self._future.cancel():
+            self._finish(CANCELADO, message="Cancelado antes de iniciar.")
+
+    def _finish(self, status: str, message: str = "", result: Any = None, error: str = None) -> None:
+        self.status = status
+        self.result = result
+        self.error = error
+        if message:
+            self.message = message
+        self.finished = time.time()
+        self._done.set()
+
+
+class JobManager:
+    """Pool de workers compartilhado pelo processo (todas as sessões) e registro de jobs."""
+
+    def __init__(self, max_workers: int = JOB_POOL_SIZE):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="canopy-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, label: str, func: Callable[..., Any], *args,
+               owner: Optional[str] = None, profile: bool = False, **kwargs) -> Job:
+        """
+        Agenda func(ctx, *args, **kwargs). 'ctx' é um JobContext para progresso
+        e cancelamento cooperativo: ctx.progress(...) e checkpoint() (chamado entre as
+        etapas das funções de modelo) verificam o cancelamento.
+        profile=True grava um cProfile da execução na thread do worker (job.trace.profile_path).
+        """
+        job = Job(kind, label, owner, profile)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        job._future = self._pool.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job: Job, func: Callable, args, kwargs) -> None:
+        if job._cancel.is_set():
+            job._finish(CANCELADO, message="Cancelado antes de iniciar.")
+            return
+        job.status, job.started, job.message = EXECUTANDO, time.time(), "Executando..."
+        trace, outcome = None, dict(status=ERRO, message="Falhou.")
+        ctx = JobContext(job)
+        token = _current_job.set(ctx)  # checkpoint() nas funções de modelo encontra este job
+        try:
+            # Cada job tem seu próprio trace de etapas (contexto da thread do worker).
+            # Dentro do try: qualquer falha ao abrir o trace ainda termina o job.
+            trace = start_trace(f"job_{job.kind}", cprofile=job.profile)
+            outcome = dict(status=CONCLUIDO, message="Concluído.", result=func(ctx, *args, **kwargs))
+            job.progress = 1.0
+        except JobCancelled:
+            outcome = dict(status=CANCELADO, message="Cancelado pelo usuário.")
+        except Exception as e:
+            outcome = dict(status=ERRO, message="Falhou.", error=f"{type(e).__name__}: {e}")
+        finally:
+            _current_job.reset(token)
+            # O trace fica pronto antes de sinalizar o fim (quem espera pode anexá-lo)
+            try:
+                job.trace = finish_trace(trace) if trace is not None else None
+            finally:
+                job._finish(**outcome)
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        if not job_id:
+            return None
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, owner: Optional[str]) -> List[Job]:
+        with self._lock:
+            self._prune()  # Chamado a cada atualização do painel: libera resultados antigos sem esperar um submit
+            return sorted((j for j in self._jobs.values() if j.owner == owner), key=lambda j: j.created)
+
+    def forget(self, job_id: str) -> None:
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job and not job.done:
+            job.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._prune()
+            jobs = list(self._jobs.values())
+        return {
+            "workers": self.max_workers,
+            "executando": sum(j.status == EXECUTANDO for j in jobs),
+            "na_fila": sum(j.status == PENDENTE for j in jobs),
+            "finalizados": sum(j.done for j in jobs),
+        }
+
+    def _prune(self) -> None:
+        """Descarta jobs finalizados antigos (chamado com o lock adquirido)."""
+        now = time.time()
+        finished = sorted((j for j in self._jobs.values() if j.done), key=lambda j: j.finished)
+        excess = len(finished) - JOB_MAX_FINISHED
+        for i, job in enumerate(finished):
+            if i < excess or now - job.finished > JOB_RETENTION_S:
+                self._jobs.pop(job.id, None)
+
+
+JOB_MANAGER = JobManager()
+
+
+# ==============================================================================
+# Tarefas prontas para o app
+# ==============================================================================
+def job_fit(ctx: JobContext, df, equation: str, alias_map: Dict[str, str], cache_scope: Dict[str, Any]):
+    from src.cache import fit_regression_cached
+    ctx.progress(0.05, "Ajustando modelo...")
+    return fit_regression_cached(df, equation, alias_map, **(cache_scope or {}))
+
+
+def job_fit_progressive(ctx: JobContext, df, equation: str, alias_map: Dict[str, str], cache_scope: Dict[str, Any],
+                        budget_s: Optional[float] = None):
+    """
+    Ajuste progressivo: prévia em subamostra estratificada publicada em ctx.publish
+    ({"result", "linhas", "estratos", ...}) e depois o ajuste completo (retorno do job).
+    Sem prévia quando o ajuste completo já está no cache.
+    """
+    from src.cache import FIT_CACHE, fit_cache_key, fit_regression_cached
+    from src.progressive import preview_fit
+
+    scope = cache_scope or {}
+    cached = scope.get('dataset_key') and fit_cache_key("ols", scope['dataset_key'], equation, alias_map,
+                                                        scope.get('filter_state')) in FIT_CACHE
+    if not cached:
+        ctx.progress(0.02, "Prévia em subamostra estratificada...")
+        preview, info = preview_fit(df, equation, alias_map, **({"budget_s": budget_s} if budget_s else {}))
+        if "error" not in preview:
+            ctx.publish({"result": preview, **info})
+            ctx.progress(0.3, f"Prévia com {info['linhas']:,} árvores pronta; ajustando as {len(df):,}...")
+    return fit_regression_cached(df, equation, alias_map, **scope)
+
+
+def job_clean(ctx: JobContext, df, result, threshold: float, max_rounds: int, max_fraction: float):
+    from src.residual_cleaning import fit_cleaned
+    ctx.progress(0.05, "Removendo árvores com resíduo alto...")
+    return fit_cleaned(df, result, threshold=threshold, max_rounds=max_rounds, max_fraction=max_fraction)
+
+
+def job_fit_multi(ctx: JobContext, df, equation: str, alias_map: Dict[str, str], y_cols, common_rows: bool = True):
+    from src.external_model import fit_regression_multi_target
+    ctx.progress(0.05, f"Ajustando {len(y_cols)} alvos...")
+    return fit_regression_multi_target(df, equation, alias_map, list(y_cols), common_rows=common_rows)
+
+
+def job_fit_wls(ctx: JobContext, df, equation: str, alias_map: Dict[str, str], weight_alias, k_values, criterion: str):
+    from src.weighted_model import fit_wls_weight_search
+    ctx.progress(0.05, f"Testando {len(k_values)} expoentes de peso...")
+    return fit_wls_weight_search(df, equation, alias_map, weight_alias=weight_alias, k_values=k_values, criterion=criterion)
+
+
+def job_identity_test(ctx: JobContext, df, equation: str, alias_map: Dict[str, str], group_col: str, alpha: float):
+    from src.model_identity import model_identity_test
+    ctx.progress(0.05, f"Somando X'X, X'y e y'y por {group_col}...")
+    return model_identity_test(df, equation, alias_map, group_col, alpha=alpha)
+
+
+def job_fit_streaming(ctx: JobContext, source, equation: str, alias_map: Dict[str, str], chunk_rows: int):
+    from src.streaming_model import fit_regression_streaming
+    return fit_regression_streaming(source, equation, alias_map, chunk_rows=chunk_rows, progress=ctx.progress)
+
+
+def job_batch_screen(ctx: JobContext, df, equations: Dict[str, str], alias_map: Dict[str, str],
+                     group_col: Optional[str] = None, cache_scope: Dict[str, Any] = None):
+    """
+    Triagem em lote: ajusta cada equação (opcionalmente por grupo, ex: talhão).
+    Retorna uma tabela com as métricas; cancelável entre ajustes.
+    """
+    import pandas as pd
+    from src.cache import fit_regression_cached
+
+    groups = [(None, df)] if not group_col else list(df.groupby(group_col, sort=True))
+    total = max(len(groups) * len(equations), 1)
+    rows, done = [], 0
+    for group, df_group in groups:
+        scope = dict(cache_scope or {})
+        if group_col and scope.get('dataset_key'):
+            scope['filter_state'] = {**(scope.get('filter_state') or {}), f"__grupo__{group_col}": [group]}
+        elif group_col:
+            scope = {}
+        for name, equation in equations.items():
+            ctx.progress(done / total, f"{name}" + (f" | {group_col} = {group}" if group_col else ""))
+            res = fit_regression_cached(df_group, equation, alias_map, **scope)
+            row = {"Modelo": name}
+            if group_col: row[group_col] = group
+            if "error" in res:
+                row.update({"Erro": res["error"]})
+            else:
+                row.update({"R² Aj.": res['r2_adj'], "Syx %": res['syx_pct'], "AIC": res['aic'], "N": res['n_obs']})
+            rows.append(row)
+            done += 1
+    return pd.DataFrame(rows)
+
+
+def job_aggregate(ctx: JobContext, results, df_original, spec: Dict[str, Any]):
+    """Agregação por parcela/talhão/fazenda; o resultado fica no cache de renderização do modelo."""
+    from src.aggregation import aggregation_cached
+    ctx.progress(0.02, "Somando árvores por parcela...")
+    return aggregation_cached(results, df_original, spec, progress=lambda _, msg: ctx.progress(0.5, msg))
+
+
+def job_report(ctx: JobContext, results, df_original=None):
+    from src.report_export import gerar_pdf_bytes, nome_relatorio
+    ctx.progress(0.1, "Renderizando relatório...")
+    return {"result_id": results.result_id, "file_name": nome_relatorio(results),
+            "bytes": gerar_pdf_bytes(results, df_original=df_original)}
+
+
+def job_export(ctx: JobContext, results_list, fmt, resolve_df=None):
+    from src.result_export import export_results
+    data = export_results(results_list, fmt, resolve_df=resolve_df, progress=ctx.progress)
+    return {"result_ids": [r.result_id for r in results_list], "fmt": fmt, "bytes": data}
@@ -0,0 +1,222 @@
+# src/manual_model.py
+
+import re
+import itertools
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import Dict, Tuple, Optional, Union
+from src.results import ModelResult
+from src.profiling import span
+
+# Funções liberadas dentro da equação (mesmo conjunto do modo Manual original)
+SAFE_MATH = {"ln": np.log, "log": np.log, "exp": np.exp, "sqrt": np.sqrt, "np": np}
+
+# Limite de elementos (vetores x linhas) avaliados por bloco na varredura.
+# Mantém a matriz de predições em ~64 MB (float64) mesmo com milhões de árvores.
+SWEEP_BLOCK_ELEMENTS = 8_000_000
+
+
+@lru_cache(maxsize=128)
+def compile_manual_equation(equation: str):
+    """
+    Compila o lado direito da equação uma única vez.
+    Retorna (código compilado, lado esquerdo é log?, nomes usados na expressão).
+    """
+    if "=" not in equation: raise ValueError("A equação deve conter um sinal de igual '='.")
+    lhs, rhs = equation.split("=", 1)
+    code = compile(rhs.strip(), "<equacao>", "eval")
+    is_log = "ln(" in lhs or "log(" in lhs
+    return code, is_log, frozenset(code.co_names)
+
+
+def extract_coefficients_from_formula(equation: str):
+    return sorted(list(set(re.findall(r"\b(b\d+)\b", equation))))
+
+
+def _data_env(df: pd.DataFrame, alias_map: Dict[str, str]) -> Tuple[Optional[dict], Optional[str]]:
+    env = {}
+    for alias, col_real in alias_map.items():
+        if col_real in df.columns:
+            env[alias] = df[col_real].values
+        else:
+            return None, f"Coluna '{col_real}' não encontrada."
+    return env, None
+
+
+def calculate_manual_prediction(df, equation, alias_map, coef_values):
+    local_env, err = _data_env(df, alias_map)
+    if err: return None, err
+
+    local_env.update(coef_values)
+    local_env.update(SAFE_MATH)
+
+    try:
+        code, is_log, _ = compile_manual_equation(equation)
+        y_pred = eval(code, {"__builtins__": {}}, local_env)
+        if is_log:
+            y_pred = np.exp(y_pred)
+
+        return y_pred, None
+    except Exception as e:
+        return None, str(e)
+
+
+def _valid_rows(df: pd.DataFrame, y_col: str, alias_map: Dict[str, str],
+                names_used) -> Tuple[Optional[np.ndarray], Optional[dict], Optional[np.ndarray], Optional[str]]:
+    """
+    Linhas válidas: Y e todas as variáveis usadas pela equação finitas.
+    Mesmo critério na avaliação manual e na varredura, para as métricas baterem.
+    Retorna (y válido, variáveis válidas, máscara, erro).
+    """
+    if y_col not in df.columns: return None, None, None, f"Coluna '{y_col}' inexistente."
+    data_env, err = _data_env(df, {a: c for a, c in alias_map.items() if a in names_used})
+    if err: return None, None, None, err
+
+    y_obs = pd.to_numeric(df[y_col], errors='coerce').to_numpy(dtype=float)
+    valid = np.isfinite(y_obs)
+    for alias in data_env:
+        data_env[alias] = pd.to_numeric(pd.Series(data_env[alias]), errors='coerce').to_numpy(dtype=float)
+        valid &= np.isfinite(data_env[alias])
+
+    if valid.sum() < 3: return None, None, None, "Número insuficiente de dados válidos (< 3)."
+    return y_obs[valid], {alias: values[valid] for alias, values in data_env.items()}, valid, None
+
+
+def evaluate_manual_model(df: pd.DataFrame, equation: str, alias_map: Dict[str, str], y_col: str,
+                          coef_values: Dict[str, float]) -> Union[ModelResult, Dict[str, str]]:
+    """
+    Avalia um vetor de coeficientes informado pelo usuário (Ajuste Manual).
+    Retorna um ModelResult com as mesmas métricas da tabela do OLS.
+    """
+    with span("manual.avaliacao", rows=len(df)):
+        try:
+            code, is_log, names_used = compile_manual_equation(equation)
+        except (ValueError, SyntaxError) as e:
+            return {"error": f"Equação inválida: {e}"}
+
+        # 1. Calcula a predição manual nas linhas válidas (mesmo recorte da varredura)
+        y_obs, local_env, valid, err = _valid_rows(df, y_col, alias_map, names_used)
+        if err: return {"error": err}
+
+        local_env.update(coef_values)
+        local_env.update(SAFE_MATH)
+        try:
+            with np.errstate(all='ignore'):
+                y_pred_man = eval(code, {"__builtins__": {}}, local_env)
+                if is_log:
+                    y_pred_man = np.exp(y_pred_man)
+        except Exception as e:
+            return {"error": str(e)}
+
+        # Equação sem variáveis gera escalar: replica para todas as linhas
+        y_pred_man = np.broadcast_to(np.asarray(y_pred_man, dtype=float), y_obs.shape).copy()
+
+        # 2. Calcula as métricas (Syx, RMSE) para preencher a tabela existente
+        ss_res = np.sum((y_obs - y_pred_man) ** 2)
+        ss_tot = np.sum((y_obs - np.mean(y_obs)) ** 2)
+        r2_man = 1 - (ss_res / ss_tot)
+        rmse_man = np.sqrt(np.mean((y_obs - y_pred_man) ** 2))
+        syx_man = (rmse_man / np.mean(y_obs)) * 100
+
+    return ModelResult(
+        method='Manual',
+        equation_original=equation,
+        equation_fitted=f"Manual: {equation}", # Mostra a equação usada
+        coefs=dict(coef_values),
+        r2_adj=r2_man,
+        rmse=rmse_man,
+        syx_pct=syx_man,
+        fc_meyer=None, # Não aplicável direto
+        aic=0, # Não calculamos AIC em manual simples
+        durbin_watson=0,
+        is_log=is_log,
+        y_col_real=y_col,
+        alias_map_used=dict(alias_map),
+        row_index=np.flatnonzero(valid),
+        y_real=y_obs,
+        y_pred=y_pred_man
+    )
+
+
+def build_coefficient_grid(base: Dict[str, float], spans: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    Monta a grade (produto cartesiano) de vetores de coeficientes.
+    Coeficientes fora de 'spans' ficam fixos no valor de 'base'.
+    Ex: spans={'b1': np.linspace(1.8, 2.0, 50), 'b2': np.linspace(0.8, 1.0, 50)} -> 2500 vetores.
+    """
+    names = list(spans.keys())
+    combos = np.array(list(itertools.product(*[np.asarray(spans[n], dtype=float) for n in names])))
+    grid = pd.DataFrame(combos, columns=names) if names else pd.DataFrame(index=[0])
+    for name, value in base.items():
+        if name not in grid.columns:
+            grid[name] = float(value)
+    return grid[sorted(grid.columns, key=lambda c: int(c[1:]) if c[1:].isdigit() else c)]
+
+
+def sweep_manual_coefficients(df: pd.DataFrame, equation: str, alias_map: Dict[str, str],
+                              y_col: str, coef_vectors: Union[pd.DataFrame, Dict[str, np.ndarray]],
+                              block_elements: int = SWEEP_BLOCK_ELEMENTS) -> Union[pd.DataFrame, Dict[str, str]]:
+    """
+    Avalia milhares de vetores de coeficientes em uma passada vetorizada.
+
+    Cada coeficiente vira uma coluna (m, 1) e cada variável uma linha (1, n),
+    então a equação compilada produz direto a matriz de predições (m, n).
+    Os vetores são processados em blocos para limitar a memória.
+
+    Retorna um DataFrame com os coeficientes e a superfície de métricas
+    (R², RMSE, Syx%, Viés e Viés%) por vetor, na escala real de Y.
+    """
+    try:
+        code, is_log, names_used = compile_manual_equation(equation)
+    except (ValueError, SyntaxError) as e:
+        return {"error": f"Equação inválida: {e}"}
+
+    coefs = pd.DataFrame(coef_vectors).astype(float).reset_index(drop=True)
+    missing = [c for c in names_used if re.fullmatch(r"b\d+", c) and c not in coefs.columns]
+    if missing: return {"error": f"Coeficientes sem valor: {', '.join(sorted(missing))}."}
+    y_obs, data_env, _, err = _valid_rows(df, y_col, alias_map, names_used)
+    if err: return {"error": err}
+    n = len(y_obs)
+
+    env = {alias: values[np.newaxis, :] for alias, values in data_env.items()}
+    env.update(SAFE_MATH)
+
+    y_mean = y_obs.mean()
+    ss_tot = np.sum((y_obs - y_mean) ** 2)
+    m = len(coefs)
+    ss_res = np.empty(m)
+    resid_sum = np.empty(m)
+
+    block = max(1, int(block_elements // max(n, 1)))
+    with np.errstate(all='ignore'):
+        for start in range(0, m, block):
+            stop = min(start + block, m)
+            local_env = dict(env)
+            for name in coefs.columns:
+                local_env[name] = coefs[name].to_numpy()[start:stop, np.newaxis]
+
+            try:
+                y_pred = eval(code, {"__builtins__": {}}, local_env)
+            except Exception as e:
+                return {"error": f"Erro matemático na equação: {e}"}
+
+            y_pred = np.broadcast_to(np.asarray(y_pred, dtype=float), (stop - start, n))
+            if is_log:
+                y_pred = np.exp(y_pred)
+
+            resid = y_pred - y_obs
+            ss_res[start:stop] = np.einsum('ij,ij->i', resid, resid)
+            resid_sum[start:stop] = resid.sum(axis=1)
+
+    rmse = np.sqrt(ss_res / n)
+    bias = resid_sum / n
+
+    surface = coefs.copy()
+    surface['r2'] = 1 - (ss_res / ss_tot) if ss_tot > 0 else np.nan
+    surface['rmse'] = rmse
+    surface['syx_pct'] = (rmse / y_mean) * 100 if y_mean != 0 else np.nan
+    surface['bias'] = bias
+    surface['bias_pct'] = (bias / y_mean) * 100 if y_mean != 0 else np.nan
+    surface.attrs['n_obs'] = n
+    return surface
@@ -0,0 +1,160 @@
+# src/model_identity.py
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from typing import Any, Dict, Optional, Tuple, Union
+
+from src.external_model import _parse_equation, _shield_columns, _build_design, apply_shield
+from src.profiling import span
+from src.jobs import checkpoint
+
+# Autovalor relativo mínimo para um termo contar no posto de um grupo (colinearidade)
+_RANK_TOL = 1e-10
+
+
+def group_sufficient_stats(X: np.ndarray, y: np.ndarray, codes: np.ndarray, n_groups: int
+                           ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    X'X, X'y, y'y e n de cada grupo numa passada: um bincount por elemento do
+    triângulo de X'X (e por coluna de X'y), sem ordenar nem separar as linhas.
+    Retorna (G: g x p x p, Xy: g x p, yy: g, n: g).
+    """
+    p = X.shape[1]
+    G = np.empty((n_groups, p, p))
+    for i in range(p):
+        for j in range(i, p):
+            G[:, i, j] = G[:, j, i] = np.bincount(codes, weights=X[:, i] * X[:, j], minlength=n_groups)
+    Xy = np.column_stack([np.bincount(codes, weights=X[:, i] * y, minlength=n_groups) for i in range(p)])
+    yy = np.bincount(codes, weights=y * y, minlength=n_groups)
+    n = np.bincount(codes, minlength=n_groups)
+    return G, Xy, yy, n
+
+
+def _rss_from_blocks(G: np.ndarray, Xy: np.ndarray, yy: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    SQ dos resíduos, posto e coeficientes de cada sistema (lote ... x p x p) só pelas
+    estatísticas suficientes: decomposição espectral em lote, com pseudo-inversa
+    para grupos com termos colineares.
+    """
+    lam, V = np.linalg.eigh(G)
+    keep = lam > _RANK_TOL * lam.max(axis=-1, keepdims=True)
+    inv = np.where(keep, 1.0 / np.where(keep, lam, 1.0), 0.0)
+    z = np.einsum("...ji,...j->...i", V, Xy)
+    beta = np.einsum("...ij,...j->...i", V, inv * z)
+    rss = np.maximum(yy - np.einsum("...i,...i->...", beta, Xy), 0.0)
+    return rss, keep.sum(axis=-1), beta
+
+
+def _f_row(name: str, rss_r: float, df_r: float, rss_f: float, df_f: float, alpha: float,
+           denominator: Optional[Tuple[float, int]] = None) -> Dict[str, Any]:
+    """Linha da tabela de testes: F = (ΔSQR/Δgl) / QMR, com o QMR do completo por padrão."""
+    rss_den, df_den = denominator or (rss_f, df_f)
+    num_df = df_r - df_f
+    F = ((rss_r - rss_f) / num_df) / (rss_den / df_den) if num_df > 0 and df_den > 0 and rss_den > 0 else np.nan
+    p = float(stats.f.sf(F, num_df, df_den)) if np.isfinite(F) else np.nan
+    return {"teste": name, "sqr_reduzido": rss_r, "gl_reduzido": int(df_r), "sqr_completo": rss_f,
+            "gl_completo": int(df_f), "F": F, "gl_num": int(num_df), "gl_den": int(df_den), "p_valor": p,
+            "rejeita_h0": bool(p < alpha) if np.isfinite(p) else None}
+
+
+def model_identity_test(df: pd.DataFrame, equation: str, alias_map: Dict[str, str], group_col: str,
+                        alpha: float = 0.05) -> Union[Dict[str, pd.DataFrame], Dict[str, str]]:
+    """
+    Teste F de identidade de modelos entre grupos (ex: talhões) e de paralelismo.
+
+    Sobre as linhas aprovadas pelo Shield, X'X, X'y e y'y de cada grupo saem de uma
+    única passada (group_sufficient_stats). Daí, sem voltar às linhas:
+      - completo: uma equação por grupo (SQR = soma das SQR de cada grupo);
+      - paralelismo: inclinações comuns e intercepto por grupo (blocos centrados no grupo);
+      - identidade: uma equação única (blocos somados).
+    Identidade e paralelismo são comparados ao completo; 'nível' (interceptos iguais,
+    dadas inclinações comuns) compara a equação única ao paralelismo. Grupos com
+    n <= p ficam de fora de todos os modelos.
+
+    Retorna {"testes": DataFrame, "grupos": DataFrame com n, SQR e coeficientes por grupo}.
+    """
+    with span("identidade.model_identity_test", rows=len(df)):
+        return _model_identity_test(df, equation, alias_map, group_col, alpha)
+
+
+def _model_identity_test(df, equation, alias_map, group_col, alpha):
+    try:
+        y_var_sym, is_log_y, y_col_real, rhs_equation, x_vars_sym = _parse_equation(equation, alias_map)
+    except ValueError as e: return {"error": str(e)}
+    if y_col_real not in df.columns: return {"error": f"Coluna '{y_col_real}' inexistente."}
+    if group_col not in df.columns: return {"error": f"Coluna de grupo '{group_col}' inexistente."}
+
+    checkpoint("Shield e matriz X...", 0.1)
+    with span("identidade.matriz_x", rows=len(df)) as sp:
+        cols = _shield_columns(df, y_col_real, x_vars_sym, alias_map)
+        df_filtered = apply_shield(df, cols)
+        try:
+            X_df = _build_design(df_filtered, rhs_equation, x_vars_sym, alias_map)
+        except ValueError as e:
+            return {"error": str(e)}
+        groups = df[group_col].reindex(X_df.index)
+        valid = groups.notna().to_numpy()
+        X_df = X_df[valid]
+        y = df_filtered.loc[X_df.index, y_col_real].to_numpy(dtype=float)
+        if is_log_y: y = np.log(y)
+        X = X_df.to_numpy(dtype=float)
+        codes, labels = pd.factorize(groups[valid], sort=True)
+        sp.rows = len(y)
+
+    p = X.shape[1]
+    terms = list(X_df.columns)
+    checkpoint("Somas por grupo...", 0.4)
+    with span("identidade.estatisticas_grupo", rows=len(y)):
+        # Escala global das colunas: melhora o condicionamento sem mudar as SQR
+        scale = np.sqrt(np.einsum("ij,ij->j", X, X))
+        scale[scale == 0] = 1.0
+        G, Xy, yy, n = group_sufficient_stats(X / scale, y, codes, len(labels))
+
+    used = n > p
+    if used.sum() < 2:
+        return {"error": f"São necessários ao menos 2 grupos com mais de {p} árvores."}
+    G, Xy, yy, n_used = G[used], Xy[used], yy[used], n[used]
+    N, g = int(n_used.sum()), int(used.sum())
+
+    checkpoint("Modelos completo, paralelo e único...", 0.7)
+    with span("identidade.modelos", rows=g):
+        # Completo: um ajuste por grupo
+        rss_g, rank_g, beta_g = _rss_from_blocks(G, Xy, yy)
+        rss_full, df_full = float(rss_g.sum()), N - int(rank_g.sum())
+        # Identidade: blocos somados
+        rss_id, rank_id, _ = _rss_from_blocks(G.sum(axis=0), Xy.sum(axis=0), yy.sum())
+        rss_id, df_id = float(rss_id), N - int(rank_id)
+
+        rows = [_f_row("identidade", rss_id, df_id, rss_full, df_full, alpha)]
+        if "const" in terms and p > 1:
+            # Paralelismo: intercepto por grupo = blocos das inclinações centrados na média do grupo
+            c = terms.index("const")
+            s = [j for j in range(p) if j != c]
+            sx, sy = G[:, c, s], Xy[:, c]                      # Σx e Σy de cada grupo (coluna const escalada)
+            n_c = G[:, c, c]                                   # n do grupo na mesma escala
+            W = (G[:, s][:, :, s] - np.einsum("gi,gj->gij", sx, sx) / n_c[:, None, None]).sum(axis=0)
+            w = (Xy[:, s] - sx * (sy / n_c)[:, None]).sum(axis=0)
+            rss_par, rank_par, _ = _rss_from_blocks(W, w, float((yy - sy ** 2 / n_c).sum()))
+            rss_par, df_par = float(rss_par), N - g - int(rank_par)
+            rows.insert(1, _f_row("paralelismo", rss_par, df_par, rss_full, df_full, alpha))
+            # Nível: só os interceptos diferem? Denominador com o QMR do modelo completo
+            rows.append(_f_row("nivel", rss_id, df_id, rss_par, df_par, alpha, denominator=(rss_full, df_full)))
+
+    tests = pd.DataFrame(rows)
+    tests.attrs.update({"n_obs": N, "grupos": g, "excluidos": int((~used).sum()), "alpha": alpha, "termos": p})
+
+    coefs = pd.DataFrame(beta_g / scale, columns=terms)
+    per_group = pd.concat([pd.DataFrame({group_col: np.asarray(labels)[used], "n": n_used, "sqr": rss_g,
+                                         "posto": rank_g}), coefs], axis=1)
+    return {"testes": tests, "grupos": per_group}
+
+
+def identity_verdict(tests: pd.DataFrame) -> str:
+    """Leitura dos testes: equação única, inclinações comuns ou uma equação por grupo."""
+    rejected = dict(zip(tests["teste"], tests["rejeita_h0"]))
+    if rejected.get("identidade") is False:
+        return "Identidade não rejeitada: uma equação única atende todos os grupos."
+    if rejected.get("paralelismo") is False:
+        return "Modelos paralelos: inclinações comuns com intercepto por grupo."
+    return "Modelos diferem entre grupos: use uma equação por grupo."
@@ -0,0 +1,265 @@
+# src/model_search.py
+
+import heapq
+import itertools
+import numpy as np
+import pandas as pd
+from math import comb
+from typing import Dict, List, Optional, Tuple, Union
+from src.external_model import apply_shield
+from src.profiling import span
+
+# Transformações oferecidas na busca (chave -> rótulo na interface)
+TRANSFORMS = {
+    "linear": "X",
+    "ln": "ln(X)",
+    "quadrado": "X²",
+    "inverso": "1/X",
+    "raiz": "√X",
+    "cruzado": "Xi·Xj",
+    "cruzado_quadrado": "Xi²·Xj",
+}
+
+CRITERIA = ("aic", "bic", "r2_adj")
+
+# Acima disso a busca exaustiva vira stepwise (modo 'auto')
+EXHAUSTIVE_MAX_SUBSETS = 200_000
+
+# Pivô relativo mínimo para aceitar um termo (colinearidade)
+_COLLINEAR_TOL = 1e-10
+
+
+def build_candidate_terms(variables: List[str], transforms: List[str]) -> List[str]:
+    """Lista de termos candidatos já na sintaxe aceita por fit_regression_from_formula."""
+    terms = []
+    for v in variables:
+        if "linear" in transforms: terms.append(v)
+        if "ln" in transforms: terms.append(f"ln({v})")
+        if "quadrado" in transforms: terms.append(f"({v}**2)")
+        if "inverso" in transforms: terms.append(f"(1/{v})")
+        if "raiz" in transforms: terms.append(f"sqrt({v})")
+    for a, b in itertools.combinations(variables, 2):
+        if "cruzado" in transforms: terms.append(f"({a}*{b})")
+        if "cruzado_quadrado" in transforms:
+            terms.append(f"({a}**2*{b})")
+            terms.append(f"({b}**2*{a})")
+    return terms
+
+
+def format_equation(y_alias: str, is_log_y: bool, terms: List[str]) -> str:
+    lhs = f"ln({y_alias})" if is_log_y else y_alias
+    rhs = " + ".join(["b0"] + [f"b{i}*{t}" for i, t in enumerate(terms, start=1)])
+    return f"{lhs} = {rhs}"
+
+
+class _GramSearch:
+    """
+    Critérios de todos os subconjuntos a partir da matriz de Gram [Z y]'[Z y].
+    Incluir um termo estende o fator de Cholesky em uma borda (O(k²)), e a
+    soma de quadrados dos resíduos sai direto do fator, sem refazer o ajuste.
+    """
+
+    def __init__(self, G: np.ndarray, Zty: np.ndarray, yty: float, tss: float, n: int):
+        self.G, self.Zty, self.yty, self.tss, self.n = G, Zty, yty, tss, n
+
+    def extend(self, L: np.ndarray, z: np.ndarray, idx: List[int], j: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Acrescenta a coluna j ao fator (L, z) do subconjunto idx. None se colinear."""
+        g = self.G[idx, j]
+        l = _forward_solve(L, g) if len(idx) else g[:0]
+        d2 = self.G[j, j] - l @ l
+        if d2 <= _COLLINEAR_TOL * self.G[j, j]:
+            return None
+        d = np.sqrt(d2)
+        k = len(idx)
+        L_new = np.zeros((k + 1, k + 1))
+        L_new[:k, :k] = L
+        L_new[k, :k] = l
+        L_new[k, k] = d
+        z_new = np.append(z, (self.Zty[j] - l @ z) / d)
+        return L_new, z_new
+
+    def factor(self, idx: List[int]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        L, z, done = np.zeros((0, 0)), np.zeros(0), []
+        for j in idx:
+            out = self.extend(L, z, done, j)
+            if out is None:
+                return None
+            (L, z), done = out, done + [j]
+        return L, z
+
+    def rss(self, z: np.ndarray) -> float:
+        return max(self.yty - z @ z, 0.0)
+
+    def score(self, rss: float, k: int) -> Dict[str, float]:
+        n = self.n
+        llf = -n / 2.0 * (np.log(2 * np.pi) + np.log(max(rss, 1e-300) / n) + 1)
+        r2 = 1 - rss / self.tss if self.tss > 0 else np.nan
+        return {
+            "aic": -2 * llf + 2 * k,
+            "bic": -2 * llf + np.log(n) * k,
+            "r2_adj": 1 - (n - 1) / (n - k) * (1 - r2) if n > k else np.nan,
+            "rmse": np.sqrt(rss / (n - k)) if n > k else np.nan,
+        }
+
+
+def _forward_solve(L: np.ndarray, b: np.ndarray) -> np.ndarray:
+    x = np.empty_like(b, dtype=float)
+    for i in range(len(b)):
+        x[i] = (b[i] - L[i, :i] @ x[:i]) / L[i, i]
+    return x
+
+
+def _criterion_key(metrics: Dict[str, float], criterion: str) -> float:
+    """Menor é melhor para todos (R² ajustado entra com sinal trocado)."""
+    return -metrics["r2_adj"] if criterion == "r2_adj" else metrics[criterion]
+
+
+def search_models(df: pd.DataFrame, y_alias: str, variables: List[str], alias_map: Dict[str, str],
+                  transforms: List[str], is_log_y: bool = False, max_terms: int = 3,
+                  criterion: str = "aic", method: str = "auto", top_n: int = 10) -> Union[pd.DataFrame, Dict[str, str]]:
+    """
+    Busca automática de equações (best-subset ou stepwise).
+
+    Os termos candidatos são montados uma vez sobre as linhas aprovadas pelo
+    PryAI Shield, e a matriz de Gram é calculada uma única vez. Cada subconjunto
+    (sempre com b0) é avaliado por atualização do fator de Cholesky.
+
+    Retorna um DataFrame ordenado pelo critério, com a equação pronta para
+    fit_regression_from_formula e as métricas na escala do ajuste.
+    """
+    if criterion not in CRITERIA: return {"error": f"Critério inválido: {criterion}."}
+    y_col = alias_map.get(y_alias)
+    if not y_col or y_col not in df.columns: return {"error": f"Variável '{y_alias}' não encontrada nos apelidos."}
+    x_cols = [alias_map.get(v) for v in variables]
+    if not variables or any(c is None or c not in df.columns for c in x_cols):
+        return {"error": "Selecione variáveis X com apelidos válidos."}
+
+    terms = build_candidate_terms(variables, transforms)
+    if not terms: return {"error": "Nenhum termo candidato: escolha ao menos uma transformação."}
+
+    with span("busca.matriz_candidatos", rows=len(df)) as sp:
+        df_clean = apply_shield(df, [y_col] + x_cols)
+        env = {v: df_clean[c].to_numpy(dtype=float) for v, c in zip(variables, x_cols)}
+        env.update({"ln": np.log, "sqrt": np.sqrt})
+        with np.errstate(all="ignore"):
+            Z = np.column_stack([np.ones(len(df_clean))] +
+                                [np.broadcast_to(eval(t, {"__builtins__": {}}, env), (len(df_clean),)) for t in terms])
+            y = df_clean[y_col].to_numpy(dtype=float)
+            if is_log_y: y = np.log(y)
+        valid = np.isfinite(Z).all(axis=1) & np.isfinite(y)
+        Z, y = Z[valid], y[valid]
+        sp.rows = n = len(y)
+
+    if n < max_terms + 3: return {"error": "Dados insuficientes para a busca."}
+
+    with span("busca.gram", rows=n):
+        # Escala das colunas melhora o condicionamento (não altera a SQ dos resíduos)
+        scale = np.sqrt((Z ** 2).sum(axis=0))
+        scale[scale == 0] = 1.0
+        Zs = Z / scale
+        G = Zs.T @ Zs
+        Zty = Zs.T @ y
+        yty = float(y @ y)
+        tss = float(((y - y.mean()) ** 2).sum())
+
+    gs = _GramSearch(G, Zty, yty, tss, n)
+    p = len(terms)
+    max_terms = max(1, min(max_terms, p, n - 2))
+    n_subsets = sum(comb(p, k) for k in range(1, max_terms + 1))
+    if method == "auto":
+        method = "exaustiva" if n_subsets <= EXHAUSTIVE_MAX_SUBSETS else "stepwise"
+
+    with span("busca." + method, rows=n):
+        if method == "exaustiva":
+            ranked = _exhaustive(gs, p, max_terms, criterion, top_n)
+        else:
+            ranked = _stepwise(gs, p, max_terms, criterion, top_n)
+
+    rows = []
+    for metrics, subset in ranked:
+        chosen = [terms[j - 1] for j in subset]
+        rows.append({
+            "equacao": format_equation(y_alias, is_log_y, chosen),
+            "termos": len(chosen),
+            "aic": metrics["aic"], "bic": metrics["bic"],
+            "r2_adj": metrics["r2_adj"], "rmse": metrics["rmse"],
+        })
+    out = pd.DataFrame(rows)
+    out.attrs.update({"n_obs": n, "candidatos": p, "metodo": method,
+                      "subconjuntos": n_subsets if method == "exaustiva" else None})
+    return out
+
+
+def _exhaustive(gs: _GramSearch, p: int, max_terms: int, criterion: str, top_n: int):
+    """Percorre todos os subconjuntos em profundidade, reaproveitando o fator do pai."""
+    heap = []  # max-heap (pelo negativo) dos top_n melhores
+    counter = itertools.count()
+    base = gs.factor([0])  # intercepto
+    if base is None: return []
+
+    def visit(L, z, idx, start):
+        k = len(idx)
+        if k > 1:
+            metrics = gs.score(gs.rss(z), k)
+            key = _criterion_key(metrics, criterion)
+            item = (-key, next(counter), metrics, tuple(idx[1:]))
+            if len(heap) < top_n: heapq.heappush(heap, item)
+            elif -key > heap[0][0]: heapq.heapreplace(heap, item)
+        if k - 1 >= max_terms: return
+        for j in range(start, p + 1):
+            out = gs.extend(L, z, idx, j)
+            if out is not None:
+                visit(out[0], out[1], idx + [j], j + 1)
+
+    visit(base[0], base[1], [0], 1)
+    return [(m, s) for _, _, m, s in sorted(heap, key=lambda t: -t[0])]
+
+
+def _stepwise(gs: _GramSearch, p: int, max_terms: int, criterion: str, top_n: int):
+    """Seleção stepwise (entrada e saída) guiada pelo critério; guarda todo modelo visitado."""
+    seen = {}
+    current = [0]
+    L, z = gs.factor(current)
+    best_key = np.inf
+
+    def record(idx, z_):
+        key_ = tuple(sorted(idx[1:]))
+        if key_ and key_ not in seen:
+            m = gs.score(gs.rss(z_), len(idx))
+            seen[key_] = (_criterion_key(m, criterion), m)
+        return seen.get(key_, (np.inf, None))[0]
+
+    for _ in range(4 * max_terms):
+        improved = False
+        # Entrada: melhor termo a acrescentar (atualização de borda do Cholesky)
+        if len(current) - 1 < max_terms:
+            cand = None
+            for j in range(1, p + 1):
+                if j in current: continue
+                out = gs.extend(L, z, current, j)
+                if out is None: continue
+                key = record(current + [j], out[1])
+                if key < best_key and (cand is None or key < cand[0]):
+                    cand = (key, j, out)
+            if cand:
+                best_key, j, (L, z) = cand[0], cand[1], cand[2]
+                current = current + [j]
+                improved = True
+        # Saída: remove um termo se melhorar o critério
+        if len(current) > 2:
+            cand = None
+            for j in current[1:]:
+                idx = [c for c in current if c != j]
+                out = gs.factor(idx)
+                if out is None: continue
+                key = record(idx, out[1])
+                if key < best_key and (cand is None or key < cand[0]):
+                    cand = (key, idx, out)
+            if cand:
+                best_key, current, (L, z) = cand[0], cand[1], cand[2]
+                improved = True
+        if not improved:
+            break
+
+    ranked = sorted(seen.items(), key=lambda kv: kv[1][0])[:top_n]
+    return [(m, s) for s, (_, m) in ranked]
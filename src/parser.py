@@ -3,6 +3,7 @@
 import pandas as pd
 import numpy as np
 from collections import Counter
+from src.profiling import span
 
 def _make_unique_columns(cols):
     """Garante nomes únicos para as colunas."""
@@ -63,7 +64,8 @@ def clean_and_convert_data(df: pd.DataFrame) -> pd.DataFrame:
             continue
             
         # --- TRAVA 2: STRINGS & DECIMAIS ---
-        if df_clean[col].dtype == 'object':
+        # (pandas >= 3 lê texto como dtype 'str', não mais 'object')
+        if df_clean[col].dtype == 'object' or pd.api.types.is_string_dtype(df_clean[col].dtype):
             # Remove espaços extras
             df_clean[col] = df_clean[col].astype(str).str.strip()
             
@@ -97,28 +99,32 @@ def initial_preprocess(df_raw: pd.DataFrame) -> pd.DataFrame:
     """
     Pipeline de Limpeza Total.
     """
-    # 1. Ajuste de Cabeçalho (Header)
-    if _looks_like_good_header(df_raw.columns):
-        df = df_raw.copy()
-    else:
-        if df_raw.shape[0] == 0: return df_raw.copy()
-        df = df_raw.iloc[1:].copy()
-        df.columns = df_raw.iloc[0].tolist()
+    with span("parser.initial_preprocess", rows=len(df_raw)):
+        # 1. Ajuste de Cabeçalho (Header)
+        with span("parser.cabecalho", rows=len(df_raw)):
+            if _looks_like_good_header(df_raw.columns):
+                df = df_raw.copy()
+            else:
+                if df_raw.shape[0] == 0: return df_raw.copy()
+                df = df_raw.iloc[1:].copy()
+                df.columns = df_raw.iloc[0].tolist()
 
-    # 2. Garante nomes únicos
-    df.columns = _make_unique_columns(df.columns)
-    
-    # 3. Remove linhas/colunas TOTALMENTE vazias
-    df = df.dropna(axis=1, how="all")
-    df = df.dropna(how="all")
+            # 2. Garante nomes únicos
+            df.columns = _make_unique_columns(df.columns)
+
+            # 3. Remove linhas/colunas TOTALMENTE vazias
+            df = df.dropna(axis=1, how="all")
+            df = df.dropna(how="all")
 
-    # 4. Limpa espaços em branco dentro das células de texto
-    df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
+        # 4. Limpa espaços em branco dentro das células de texto
+        with span("parser.strip_texto", rows=len(df)):
+            df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
 
-    # 5. O PULO DO GATO: Limpeza Numérica Profunda
-    df = clean_and_convert_data(df)
+        # 5. O PULO DO GATO: Limpeza Numérica Profunda
+        with span("parser.clean_and_convert_data", rows=len(df)):
+            df = clean_and_convert_data(df)
 
-    # 6. Reset final
-    df = df.reset_index(drop=True)
+        # 6. Reset final
+        df = df.reset_index(drop=True)
 
     return df
\ No newline at end of file
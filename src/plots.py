@@ -2,26 +2,63 @@
 import altair as alt
 import pandas as pd
 import numpy as np
+from src.profiling import span
+from src.cache import cached_render, dataset_fingerprint
+from src.influence import INFLUENCE_LABELS, influence_thresholds, top_influential
+
+def _align(values, n):
+    """Ajusta o tamanho da coluna de metadados ao número de pontos do gráfico."""
+    if len(values) >= n:
+        return values[:n]
+    return np.concatenate([values, np.full(n - len(values), None, dtype=object)])
 
 def gerar_graficos_interativos(results, df_original, alias_map):
     """
     Gera gráficos interativos com Altair.
     Tooltips formatados e linha zero destacada.
     """
+    with span("graficos.gerar_graficos_interativos", rows=len(results['y_real'])):
+        return _gerar_graficos_interativos(results, df_original, alias_map)
+
+def gerar_spec_graficos(results, df_original, alias_map, scope=None):
+    """
+    Spec Vega-Lite (dict) dos gráficos de diagnóstico, memorizada por resultado.
+    'scope' identifica o DataFrame de origem (dataset + filtros); sem ele o df é hasheado.
+    Reruns como 'Restaurar Visão' reaproveitam a spec sem reconstruir nada.
+    """
+    if scope is None:
+        scope = (dataset_fingerprint(df_original),)
+    scope = tuple(scope) + (tuple(sorted(alias_map.items())),)
+
+    def build():
+        chart = gerar_graficos_interativos(results, df_original, alias_map)
+        with span("graficos.serializacao_spec", rows=len(results['y_real'])):
+            with alt.data_transformers.disable_max_rows():
+                return chart.to_dict()
+
+    return cached_render(results, "spec_altair", scope, build)
+
+def _gerar_graficos_interativos(results, df_original, alias_map):
     
-    y_real = results['data_points']['y_real']
-    y_pred = results['data_points']['y_pred']
-    
+    y_real = np.asarray(results['y_real'], dtype=float)
+    y_pred = np.asarray(results['y_pred'], dtype=float)
+
     df_plot = pd.DataFrame({
         'Observado': y_real,
         'Previsto': y_pred,
-        'Residuo_Pct': ((np.array(y_pred) - np.array(y_real)) / np.array(y_real)) * 100
+        'Residuo_Pct': ((y_pred - y_real) / y_real) * 100
     })
-    
+
+    # Linhas do DataFrame original que entraram no ajuste (alinha metadados)
+    row_index = results.get('row_index')
+    if row_index is None or len(row_index) != len(df_plot) or (len(row_index) and row_index.max() >= len(df_original)):
+        row_index = np.arange(min(len(df_plot), len(df_original)))
+    df_rows = df_original.iloc[row_index]
+
     # Adiciona metadados
     cols_info = df_original.columns[:3].tolist()
     for col in cols_info:
-        df_plot[col] = df_original[col].values[:len(df_plot)]
+        df_plot[col] = _align(df_rows[col].values, len(df_plot))
 
     # Eixo X
     x_col_name = None
@@ -33,7 +70,7 @@ def gerar_graficos_interativos(results, df_original, alias_map):
             break
             
     if x_col_name:
-        df_plot[x_alias] = df_original[x_col_name].values[:len(df_plot)]
+        df_plot[x_alias] = _align(df_rows[x_col_name].values, len(df_plot))
 
     # Tooltips
     tooltips_padrao = [alt.Tooltip(c) for c in cols_info]
@@ -46,8 +83,8 @@ def gerar_graficos_interativos(results, df_original, alias_map):
         tooltips_obs_prev.append(alt.Tooltip(x_alias, format='.2f'))
 
     # GRÁFICO 1: PRECISÃO
-    line_min = min(min(y_real), min(y_pred))
-    line_max = max(max(y_real), max(y_pred))
+    line_min = min(y_real.min(), y_pred.min())
+    line_max = max(y_real.max(), y_pred.max())
     line_data = pd.DataFrame({'x': [line_min, line_max], 'y': [line_min, line_max]})
     
     line_1_1 = alt.Chart(line_data).mark_line(color='#e74c3c', strokeDash=[5,5]).encode(x='x', y='y')
@@ -91,4 +128,98 @@ def gerar_graficos_interativos(results, df_original, alias_map):
         
         return (chart1 | chart2 | chart3)
     else:
-        return (chart1 | chart2)
\ No newline at end of file
+        return (chart1 | chart2)
+
+def gerar_grafico_sensibilidade(surface, coef_names):
+    """
+    Superfície de sensibilidade da varredura manual.
+    1 coeficiente: curvas de Syx% e Viés% | 2 coeficientes: mapa de calor de Syx%.
+    """
+    tooltips = [alt.Tooltip(c, format='.6f') for c in coef_names] + [
+        alt.Tooltip('syx_pct', format='.2f', title='Syx %'),
+        alt.Tooltip('bias_pct', format='.2f', title='Viés %'),
+        alt.Tooltip('r2', format='.4f', title='R²')
+    ]
+
+    if len(coef_names) == 1:
+        c = coef_names[0]
+        df_long = surface[[c, 'syx_pct', 'bias_pct']].melt(c, var_name='Métrica', value_name='Valor')
+        df_long['Métrica'] = df_long['Métrica'].map({'syx_pct': 'Syx %', 'bias_pct': 'Viés %'})
+
+        curves = alt.Chart(df_long).mark_line(size=3).encode(
+            x=alt.X(c, title=c),
+            y=alt.Y('Valor', title='%'),
+            color=alt.Color('Métrica', scale=alt.Scale(range=['#2E8B57', '#E67E22']))
+        )
+        rule = alt.Chart(pd.DataFrame({'y': [0]})).mark_rule(color='red', opacity=0.6).encode(y='y')
+        points = alt.Chart(surface).mark_circle(size=30, opacity=0).encode(
+            x=c, y='syx_pct', tooltip=tooltips
+        )
+        return (curves + rule + points).properties(title=f"Sensibilidade do Syx % a {c}").interactive()
+
+    c1, c2 = coef_names[:2]
+    return alt.Chart(surface).mark_rect().encode(
+        x=alt.X(c1, bin=alt.Bin(maxbins=60), title=c1),
+        y=alt.Y(c2, bin=alt.Bin(maxbins=60), title=c2),
+        color=alt.Color('min(syx_pct)', title='Syx %', scale=alt.Scale(scheme='greens', reverse=True)),
+        tooltip=[alt.Tooltip('min(syx_pct)', format='.2f', title='Syx %')]
+    ).properties(title=f"Superfície de Syx % ({c1} x {c2})")
+
+def gerar_spec_influencia(results, df_original, k=20, scope=None):
+    """
+    Spec Vega-Lite do painel de influência: só as k árvores com maior distância
+    de Cook (milhões de pontos ficam no resultado, não no navegador).
+    Memorizada por resultado, como gerar_spec_graficos.
+    """
+    if scope is None:
+        scope = (dataset_fingerprint(df_original),)
+
+    def build():
+        with span("graficos.painel_influencia", rows=len(results['y_real'])):
+            chart = _gerar_painel_influencia(results, df_original, k)
+            return None if chart is None else chart.to_dict()
+
+    return cached_render(results, "spec_influencia", tuple(scope) + (k,), build)
+
+def _gerar_painel_influencia(results, df_original, k):
+    top = top_influential(results, k=k, by="cooks_d", df_original=df_original)
+    if top.empty:
+        return None
+
+    p = len(results.get('coefs', {})) or 1
+    limits = influence_thresholds(len(results['y_real']), p)
+    id_cols = [c for c in top.columns if c not in INFLUENCE_LABELS and c != "alertas"]
+    top["arvore"] = [" | ".join(str(row[c]) for c in id_cols) or f"Linha {row['linha']}" for _, row in top.iterrows()]
+    tooltips = [alt.Tooltip(c) for c in id_cols] + [
+        alt.Tooltip('linha', title='Linha'),
+        alt.Tooltip('observado', format='.4f', title='Observado'),
+        alt.Tooltip('previsto', format='.4f', title='Previsto'),
+        alt.Tooltip('leverage', format='.4f', title='Alavancagem (h)'),
+        alt.Tooltip('student_resid', format='.2f', title='Resíduo Studentizado'),
+        alt.Tooltip('cooks_d', format='.4f', title='Cook'),
+        alt.Tooltip('dffits', format='.3f', title='DFFITS'),
+        alt.Tooltip('alertas', title='Alertas'),
+    ]
+
+    # Alavancagem x resíduo studentizado (tamanho = Cook)
+    bubbles = alt.Chart(top).mark_circle(color='#C0392B', opacity=0.7).encode(
+        x=alt.X('leverage', title='Alavancagem (h)'),
+        y=alt.Y('student_resid', title='Resíduo Studentizado (externo)'),
+        size=alt.Size('cooks_d', title='Cook', legend=None),
+        tooltip=tooltips
+    )
+    rules_t = alt.Chart(pd.DataFrame({'y': [-limits['student_resid'], limits['student_resid']]})).mark_rule(
+        color='red', strokeDash=[5, 5]).encode(y='y')
+    rule_h = alt.Chart(pd.DataFrame({'x': [limits['leverage']]})).mark_rule(color='gray', strokeDash=[5, 5]).encode(x='x')
+    chart1 = (bubbles + rules_t + rule_h).properties(title=f"Influência: {len(top)} árvores mais influentes").interactive()
+
+    # Distância de Cook por árvore
+    bars = alt.Chart(top).mark_bar(color='#E67E22').encode(
+        x=alt.X('cooks_d', title='Distância de Cook'),
+        y=alt.Y('arvore', sort='-x', title=None),
+        tooltip=tooltips
+    )
+    rule_d = alt.Chart(pd.DataFrame({'x': [limits['cooks_d']]})).mark_rule(color='red', strokeDash=[5, 5]).encode(x='x')
+    chart2 = (bars + rule_d).properties(title="Distância de Cook (linha = 4/n)")
+
+    return chart1 | chart2
@@ -0,0 +1,171 @@
+# src/profiling.py
+
+import os
+import sys
+import json
+import time
+import cProfile
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from src.config import PROFILE_DIR, PROFILE_JSON_LOG
+
+# Trace ativo no contexto atual (cada execução do script Streamlit roda em sua própria thread)
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("canopy_trace", default=None)
+
+
+def _rss_bytes() -> Optional[int]:
+    """Memória residente do processo (Linux via /proc, demais via psutil se disponível)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+class Span:
+    """Uma etapa medida: duração, linhas processadas e variação de memória."""
+
+    __slots__ = ("name", "depth", "offset", "seconds", "rows", "mem_delta")
+
+    def __init__(self, name: str, depth: int = 0, offset: float = 0.0, rows: Optional[int] = None):
+        self.name = name
+        self.depth = depth
+        self.offset = offset
+        self.seconds = None
+        self.rows = rows
+        self.mem_delta = None
+
+    def to_dict(self):
+        return {
+            "etapa": self.name, "nivel": self.depth, "inicio_ms": self.offset * 1000,
+            "duracao_ms": None if self.seconds is None else self.seconds * 1000,
+            "linhas": self.rows, "memoria_delta_mb": None if self.mem_delta is None else self.mem_delta / 2**20,
+        }
+
+
+class Trace:
+    """Coleção de spans de uma requisição (uma execução do app ou um job)."""
+
+    def __init__(self, name: str, cprofile: bool = False):
+        self.name = name
+        self.created = datetime.now()
+        self.spans = []
+        self.profile_path = None
+        self._t0 = time.perf_counter()
+        self._depth = 0
+        self._profiler = cProfile.Profile() if cprofile else None
+        if self._profiler:
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Python >= 3.12: um só profiler ativo por interpretador (ex: o do script
+                # perfilando enquanto o job inicia). Segue só com as etapas.
+                self._profiler = None
+
+    @property
+    def profiling(self) -> bool:
+        """cProfile ativo neste trace (jobs submetidos durante ele também são perfilados)."""
+        return self._profiler is not None
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(s.seconds or 0.0 for s in self.spans if s.depth == 0)
+
+    def to_dict(self):
+        return {
+            "trace": self.name, "criado_em": self.created.isoformat(timespec="seconds"),
+            "total_ms": self.total_seconds * 1000, "cprofile": self.profile_path,
+            "spans": [s.to_dict() for s in self.spans],
+        }
+
+    def to_frame(self):
+        import pandas as pd
+        df = pd.DataFrame([s.to_dict() for s in self.spans])
+        if not df.empty:
+            df["etapa"] = ["   " * d + n for d, n in zip(df["nivel"], df["etapa"])]
+            df = df.drop(columns=["nivel"])
+        return df
+
+
+def start_trace(name: str = "execucao", cprofile: bool = False) -> Trace:
+    """Abre um novo trace no contexto atual. Spans só são coletados com um trace ativo."""
+    trace = Trace(name, cprofile=cprofile)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def finish_trace(trace: Optional[Trace] = None) -> Optional[Trace]:
+    """Fecha o trace: grava o dump do cProfile e a linha do log JSON (se habilitados)."""
+    trace = trace or _current_trace.get()
+    if trace is None:
+        return None
+
+    if trace._profiler:
+        trace._profiler.disable()
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        path = PROFILE_DIR / f"{trace.name}_{trace.created.strftime('%Y%m%d_%H%M%S_%f')}.prof"
+        trace._profiler.dump_stats(str(path))
+        trace._profiler = None
+        trace.profile_path = str(path)
+
+    if PROFILE_JSON_LOG and trace.spans:
+        try:
+            with open(PROFILE_JSON_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[profiling] Falha ao gravar log JSON: {e}", file=sys.stderr)
+
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    return trace
+
+
+def attach_trace(child: Optional[Trace], parent: Optional[Trace] = None) -> None:
+    """Anexa as etapas de um trace filho (ex: job executado em outra thread) ao trace atual."""
+    parent = parent or _current_trace.get()
+    if parent is None or child is None or child is parent:
+        return
+    base_offset = time.perf_counter() - parent._t0 - child.total_seconds
+    for s in child.spans:
+        sp = Span(s.name, parent._depth + s.depth, base_offset + s.offset, s.rows)
+        sp.seconds, sp.mem_delta = s.seconds, s.mem_delta
+        parent.spans.append(sp)
+
+
+@contextmanager
+def span(name: str, rows: Optional[int] = None):
+    """
+    Mede uma etapa do pipeline. Sem trace ativo é praticamente gratuito.
+    O span retornado aceita 'rows' para registrar linhas processadas:
+        with span("shield.iqr") as sp: ...; sp.rows = len(df)
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield Span(name, rows=rows)
+        return
+
+    sp = Span(name, trace._depth, time.perf_counter() - trace._t0, rows)
+    trace.spans.append(sp)
+    trace._depth += 1
+    mem0 = _rss_bytes()
+    t0 = time.perf_counter()
+    try:
+        yield sp
+    finally:
+        sp.seconds = time.perf_counter() - t0
+        mem1 = _rss_bytes()
+        if mem0 is not None and mem1 is not None:
+            sp.mem_delta = mem1 - mem0
+        trace._depth -= 1
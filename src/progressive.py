@@ -0,0 +1,117 @@
+# src/progressive.py
+
+import time
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from src.config import (PROGRESSIVE_BUDGET_S, PROGRESSIVE_START_ROWS, PROGRESSIVE_MAX_FRACTION,
+                        VOLUME_TABLE_DAP_STEP)
+from src.external_model import fit_regression_from_formula
+from src.importer import normalize_header
+from src.results import ModelResult
+from src.profiling import span
+
+
+def strata_columns(df: pd.DataFrame, alias_map: Dict[str, str]) -> Tuple[Optional[str], Optional[str]]:
+    """(coluna de talhão, coluna de DAP) para estratificar; None quando não existem."""
+    stand = next((c for c in df.columns if normalize_header(c) == "talhao"), None)
+    dap = next((c for c in alias_map.values() if c in df.columns and normalize_header(c) == "dap"), None)
+    return stand, dap
+
+
+class StratifiedSampler:
+    """
+    Amostras estratificadas (talhão x classe de DAP) de tamanhos crescentes.
+
+    A permutação aleatória dentro de cada estrato é sorteada uma única vez, então
+    cada amostra maior contém a anterior e pedir outro tamanho custa O(n) sem
+    novo sorteio. A alocação é proporcional, com pelo menos uma árvore por estrato.
+    """
+
+    def __init__(self, df: pd.DataFrame, strata: Sequence[str] = (), dap_col: Optional[str] = None,
+                 dap_step: float = VOLUME_TABLE_DAP_STEP, seed: int = 0):
+        n = len(df)
+        codes = np.zeros(n, dtype=np.int64)
+        keys = [pd.factorize(df[col], use_na_sentinel=False)[0] for col in strata]
+        if dap_col is not None:
+            d = pd.to_numeric(df[dap_col], errors='coerce').to_numpy(dtype=float)
+            keys.append(pd.factorize(np.where(np.isfinite(d), np.floor(d / dap_step), -1))[0])
+        for key in keys:
+            codes = pd.factorize(codes * (int(key.max()) + 1 if len(key) else 1) + key)[0]
+
+        rng = np.random.default_rng(seed)
+        perm = rng.permutation(n)
+        # Estrato a estrato, ordem aleatória dentro; códigos de 16 bits usam radix sort (~4x mais rápido)
+        small = codes.astype(np.int16) if codes.max(initial=0) < np.iinfo(np.int16).max else codes
+        self.order = perm[np.argsort(small[perm], kind="stable")]
+        sorted_codes = codes[self.order]
+        self.counts = np.bincount(codes) if n else np.zeros(0, dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]]) if n else self.counts
+        self.rank = np.arange(n) - starts[sorted_codes]
+        self.sorted_codes = sorted_codes
+        self.n = n
+
+    @property
+    def n_strata(self) -> int:
+        return len(self.counts)
+
+    def sample(self, size: int) -> np.ndarray:
+        """Posições (iloc, em ordem crescente) de ~size árvores."""
+        if size >= self.n:
+            return np.arange(self.n)
+        alloc = np.minimum(self.counts, np.maximum(1, np.round(self.counts * (size / self.n)).astype(np.int64)))
+        return np.sort(self.order[self.rank < alloc[self.sorted_codes]])
+
+
+def preview_fit(df: pd.DataFrame, equation: str, alias_map: Dict[str, str], budget_s: float = PROGRESSIVE_BUDGET_S,
+                start_rows: int = PROGRESSIVE_START_ROWS, max_fraction: float = PROGRESSIVE_MAX_FRACTION,
+                seed: int = 0) -> Tuple[Union[ModelResult, Dict[str, str]], Dict[str, Any]]:
+    """
+    Ajuste preliminar em subamostra estratificada, dentro de 'budget_s' segundos.
+
+    Começa com 'start_rows' árvores e quadruplica a amostra enquanto o tempo
+    medido do último ajuste indica que o próximo cabe no orçamento (até
+    'max_fraction' do total). Devolve o maior ajuste concluído e um resumo
+    (linhas, estratos, tempo). O row_index aponta para as linhas de df.
+    """
+    t0 = time.perf_counter()
+    with span("progressivo.previa", rows=len(df)) as sp:
+        stand, dap = strata_columns(df, alias_map)
+        sampler = StratifiedSampler(df, [stand] if stand else [], dap, seed=seed)
+        limit = max(start_rows, int(len(df) * max_fraction))
+        size, best, used = start_rows, {"error": "Prévia sem ajuste."}, None
+        while True:
+            t_fit = time.perf_counter()
+            pos = sampler.sample(size)
+            res = fit_regression_from_formula(df.iloc[pos], equation, alias_map)
+            dt = time.perf_counter() - t_fit
+            if "error" not in res:
+                res['row_index'] = pos[res['row_index']]  # Posição na amostra -> posição em df
+                best, used = res, len(pos)
+            elapsed = time.perf_counter() - t0
+            # Custo do ajuste ~ linear em n: o próximo (4x) leva ~4*dt
+            if size * 4 > limit or elapsed + 4 * dt > budget_s or len(pos) >= len(df):
+                break
+            size *= 4
+        sp.rows = used or 0
+
+    info = {"linhas": used, "total": len(df), "estratos": sampler.n_strata,
+            "estratificacao": " x ".join(filter(None, [stand, f"classe de {dap}" if dap else None])) or "aleatória",
+            "tempo_s": time.perf_counter() - t0}
+    return best, info
+
+
+def coefficient_deltas(preview: ModelResult, final: ModelResult) -> pd.DataFrame:
+    """Distância da prévia ao ajuste final: coeficientes e métricas principais."""
+    rows: List[Dict[str, Any]] = []
+    items = [(term, preview['coefs'].get(term), value) for term, value in final['coefs'].items()]
+    items += [(label, preview.get(key), final.get(key)) for key, label in
+              (("r2_adj", "R² Aj."), ("syx_pct", "Syx %"), ("rmse", "RMSE"), ("fc_meyer", "Fator Meyer"))]
+    for name, prev, fin in items:
+        if prev is None or fin is None:
+            continue
+        diff = float(prev) - float(fin)
+        rows.append({"item": name, "previa": float(prev), "final": float(fin), "diferenca": diff,
+                     "diferenca_pct": diff / abs(fin) * 100 if fin else np.nan})
+    return pd.DataFrame(rows, columns=["item", "previa", "final", "diferenca", "diferenca_pct"])
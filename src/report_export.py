@@ -2,10 +2,18 @@
 from fpdf import FPDF
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from PIL import Image
 import tempfile
+import io
 import os
 from datetime import datetime
+from src.profiling import span
+from src.cache import cached_render
+from src.influence import top_influential
+from src.volume_table import volume_table_cached
+from src.aggregation import ALL_SPECIES, aggregation_cached
+from src.config import VOLUME_TABLE_PDF_COLS
 
 class PDFReport(FPDF):
     def header(self):
@@ -49,46 +57,173 @@ class PDFReport(FPDF):
         self.set_text_color(0, 0, 0) # PRETO NO VALOR
         self.cell(0, 8, str(value), 1, 1, 'L', False)
 
+def gerar_pngs_estaticos(results):
+    """PNGs (bytes) dos gráficos de diagnóstico, memorizados por resultado (downloads repetidos não redesenham)."""
+    return cached_render(results, "png_pdf", (), lambda: _renderizar_pngs_estaticos(results))
+
 def gerar_plots_estaticos_para_pdf(results):
+    """Grava os PNGs em arquivos temporários (o FPDF só aceita caminhos de imagem)."""
     temp_files = []
-    y_real = np.array(results['data_points']['y_real'])
-    y_pred = np.array(results['data_points']['y_pred'])
-    
-    plt.style.use('default')
-    
-    # Plot 1: Aderência
-    fig1, ax1 = plt.subplots(figsize=(6, 4))
-    ax1.scatter(y_real, y_pred, alpha=0.5, color='#2E8B57', edgecolors='grey')
-    min_v, max_v = min(y_real.min(), y_pred.min()), max(y_real.max(), y_pred.max())
-    ax1.plot([min_v, max_v], [min_v, max_v], 'r--', label='1:1 Ideal')
-    ax1.set_title("Aderência (Real vs Estimado)", fontweight='bold', color='black') # Título Preto
-    ax1.set_xlabel("Observado"); ax1.set_ylabel("Estimado")
-    ax1.grid(True, linestyle=':', alpha=0.5)
-    
-    f1 = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-    fig1.savefig(f1.name, dpi=150, bbox_inches='tight')
-    temp_files.append(f1.name)
-    plt.close(fig1)
-
-    # Plot 2: Resíduos
-    fig2, ax2 = plt.subplots(figsize=(6, 4))
-    resid = ((y_pred - y_real) / y_real) * 100
-    ax2.scatter(y_pred, resid, alpha=0.5, color='#E67E22', edgecolors='grey')
-    # LINHA ZERO VERMELHA NO PDF TAMBÉM
-    ax2.axhline(0, color='red', linestyle='-', linewidth=1.5)
-    ax2.set_title("Distribuição de Resíduos (%)", fontweight='bold', color='black') # Título Preto
-    ax2.set_xlabel("Estimado"); ax2.set_ylabel("Erro %")
-    ax2.set_ylim(-50, 50)
-    ax2.grid(True, linestyle=':', alpha=0.5)
-
-    f2 = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-    fig2.savefig(f2.name, dpi=150, bbox_inches='tight')
-    temp_files.append(f2.name)
-    plt.close(fig2)
-
+    for png in gerar_pngs_estaticos(results):
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as f:
+            f.write(png)
+        temp_files.append(f.name)
     return temp_files
 
-def gerar_pdf_relatorio(results, plot_paths=[]):
+def _fig_to_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
+    # PNG RGB (sem canal alfa): o FPDF separa o alfa pixel a pixel em Python puro (~1 s por imagem)
+    buffer.seek(0)
+    rgb = io.BytesIO()
+    Image.open(buffer).convert('RGB').save(rgb, format='PNG')
+    return rgb.getvalue()
+
+def _renderizar_pngs_estaticos(results):
+    with span("relatorio.graficos_estaticos", rows=len(results['y_real'])):
+        y_real = np.asarray(results['y_real'], dtype=float)
+        y_pred = np.asarray(results['y_pred'], dtype=float)
+
+        # Figure direto (sem pyplot): estado global do pyplot não é seguro entre threads dos jobs
+        # Plot 1: Aderência
+        fig1 = Figure(figsize=(6, 4)); ax1 = fig1.subplots()
+        ax1.scatter(y_real, y_pred, alpha=0.5, color='#2E8B57', edgecolors='grey')
+        min_v, max_v = min(y_real.min(), y_pred.min()), max(y_real.max(), y_pred.max())
+        ax1.plot([min_v, max_v], [min_v, max_v], 'r--', label='1:1 Ideal')
+        ax1.set_title("Aderência (Real vs Estimado)", fontweight='bold', color='black') # Título Preto
+        ax1.set_xlabel("Observado"); ax1.set_ylabel("Estimado")
+        ax1.grid(True, linestyle=':', alpha=0.5)
+        png1 = _fig_to_png(fig1)
+
+        # Plot 2: Resíduos
+        fig2 = Figure(figsize=(6, 4)); ax2 = fig2.subplots()
+        resid = ((y_pred - y_real) / y_real) * 100
+        ax2.scatter(y_pred, resid, alpha=0.5, color='#E67E22', edgecolors='grey')
+        # LINHA ZERO VERMELHA NO PDF TAMBÉM
+        ax2.axhline(0, color='red', linestyle='-', linewidth=1.5)
+        ax2.set_title("Distribuição de Resíduos (%)", fontweight='bold', color='black') # Título Preto
+        ax2.set_xlabel("Estimado"); ax2.set_ylabel("Erro %")
+        ax2.set_ylim(-50, 50)
+        ax2.grid(True, linestyle=':', alpha=0.5)
+        png2 = _fig_to_png(fig2)
+
+    return (png1, png2)
+
+def _secao_tabela_volume(pdf, table):
+    """Tabela DAP x HT em blocos de VOLUME_TABLE_PDF_COLS classes de HT; o cabeçalho se repete a cada página."""
+    ht = table.attrs.get("ht")
+    y = table.attrs.get("y", "Y")
+    pdf.add_page()
+    pdf.section_title(f"Tabela de {'Volume' if ht else 'Altura'} ({y})")
+    pdf.set_font('Arial', 'I', 8)
+    pdf.set_text_color(0, 0, 0)
+    pdf.multi_cell(0, 5, f"Linhas: centro da classe de {table.attrs['dap']} (amplitude {table.attrs['dap_step']:g})"
+                         + (f"; colunas: centro da classe de {ht} (amplitude {table.attrs['ht_step']:g})." if ht else ".")
+                         + " '-' = fora da faixa dos dados ajustados (sem extrapolação).")
+    pdf.ln(2)
+
+    values = table.to_numpy()
+    dap_w = 22
+    for start in range(0, table.shape[1], VOLUME_TABLE_PDF_COLS):
+        cols = list(range(start, min(start + VOLUME_TABLE_PDF_COLS, table.shape[1])))
+        w = min(25, (190 - dap_w) / len(cols))
+
+        def cabecalho():
+            pdf.set_font('Arial', 'B', 8)
+            pdf.set_fill_color(220, 220, 220)
+            pdf.cell(dap_w, 6, f"{table.attrs['dap']} \\ {ht}" if ht else table.attrs['dap'], 1, 0, 'C', True)
+            for j in cols:
+                pdf.cell(w, 6, f"{table.columns[j]:g}" if ht else str(y), 1, 0, 'C', True)
+            pdf.ln()
+            pdf.set_font('Arial', '', 8)
+
+        cabecalho()
+        for i, d in enumerate(table.index):
+            if pdf.get_y() > 270:
+                pdf.add_page()
+                cabecalho()
+            pdf.set_fill_color(240, 240, 240)
+            pdf.cell(dap_w, 6, f"{d:g}", 1, 0, 'C', True)
+            for j in cols:
+                v = values[i, j]
+                pdf.cell(w, 6, f"{v:.4f}" if np.isfinite(v) else "-", 1, 0, 'C')
+            pdf.ln()
+        pdf.ln(4)
+
+def _tabela_pdf(pdf, table, columns):
+    """Tabela simples: columns = [(coluna, título, largura, formato)]; o cabeçalho se repete a cada página."""
+    def cabecalho():
+        pdf.set_font('Arial', 'B', 8)
+        pdf.set_fill_color(220, 220, 220)
+        for _, title, w, _ in columns:
+            pdf.cell(w, 6, title, 1, 0, 'C', True)
+        pdf.ln()
+        pdf.set_font('Arial', '', 8)
+
+    cabecalho()
+    for row in table.itertuples(index=False):
+        if pdf.get_y() > 270:
+            pdf.add_page()
+            cabecalho()
+        values = row._asdict()
+        for col, _, w, fmt in columns:
+            v = values[col]
+            pdf.cell(w, 6, fmt.format(v) if not (isinstance(v, float) and not np.isfinite(v)) else "-", 1, 0, 'C')
+        pdf.ln()
+    pdf.ln(4)
+
+def _secao_agregacao(pdf, aggregated):
+    """Estimativas por talhão (todas as espécies) e por fazenda/espécie, com erro de amostragem."""
+    stands, farms = aggregated['talhoes'], aggregated['fazendas']
+    meta = stands.attrs
+    y = meta.get('variavel', 'Y')
+    species = meta.get('especie')
+    pdf.add_page()
+    pdf.section_title(f"Estimativas por Talhão ({y}/ha)")
+    pdf.set_font('Arial', 'I', 8)
+    pdf.set_text_color(0, 0, 0)
+    pdf.multi_cell(0, 5, f"{meta.get('arvores', 0):,} árvores. Parcelas como unidades amostrais (amostragem casual simples por "
+                         f"talhão; estratificada por talhão na fazenda). IC com t de Student, alfa = {meta['alpha']:g}; "
+                         f"erro admissível {meta['erro_max']:g}%." + (" Total = média/ha x área do talhão." if meta.get('area_talhao') else ""))
+    pdf.ln(2)
+
+    # Nomes das colunas viram atributos de namedtuple: colunas de chave com nomes arbitrários são renomeadas
+    keys = [c for c in (meta.get('fazenda'), meta.get('talhao')) if c]
+    table = stands if not species else stands[stands[species] == ALL_SPECIES]
+    table = table.rename(columns={c: f"chave{i}" for i, c in enumerate(keys)})
+    columns = [(f"chave{i}", c[:12], 22, "{}") for i, c in enumerate(keys)]
+    columns += [("parcelas", "Parc.", 12, "{:d}"), ("n_ha", "N/ha", 18, "{:.0f}"), ("media_ha", f"{y}/ha", 22, "{:.3f}"),
+                ("cv_pct", "CV %", 14, "{:.1f}"), ("erro_pct", "Erro %", 16, "{:.2f}"),
+                ("ic_inf", "IC inf.", 20, "{:.3f}"), ("ic_sup", "IC sup.", 20, "{:.3f}")]
+    if meta.get('area_talhao'):
+        columns.append(("total", "Total", 24, "{:.2f}"))
+    _tabela_pdf(pdf, table, columns)
+
+    pdf.section_title("Estimativas por Fazenda" + (" e Espécie" if species else ""))
+    farm_key = meta.get('fazenda') or "fazenda"
+    table = farms.rename(columns={farm_key: "chave0", **({species: "chave1"} if species else {})})
+    columns = [("chave0", farm_key[:12], 22, "{}")] + ([("chave1", species[:12], 22, "{}")] if species else [])
+    columns += [("talhoes", "Talh.", 12, "{:d}"), ("parcelas", "Parc.", 12, "{:d}"), ("media_ha", f"{y}/ha", 22, "{:.3f}"),
+                ("erro_pct", "Erro %", 16, "{:.2f}"), ("ic_inf", "IC inf.", 20, "{:.3f}"), ("ic_sup", "IC sup.", 20, "{:.3f}")]
+    if meta.get('area_talhao'):
+        columns.append(("total", "Total", 26, "{:.2f}"))
+    _tabela_pdf(pdf, table, columns)
+
+def nome_relatorio(results):
+    return f"Relatorio_{results.get('name', 'Sem Nome').replace(' ', '_')}.pdf"
+
+def gerar_pdf_relatorio(results, plot_paths=[], df_original=None):
+    with span("relatorio.gerar_pdf_relatorio", rows=len(results['y_real'])):
+        filename = nome_relatorio(results)
+        _montar_pdf(results, df_original).output(filename)
+        return filename
+
+def gerar_pdf_bytes(results, df_original=None):
+    """PDF em memória: nada é gravado no diretório corrente (sessões e jobs simultâneos não colidem)."""
+    with span("relatorio.gerar_pdf_relatorio", rows=len(results['y_real'])):
+        return _montar_pdf(results, df_original).output(dest='S').encode('latin-1')
+
+def _montar_pdf(results, df_original=None):
     pdf = PDFReport()
     pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=15)
@@ -97,7 +232,10 @@ def gerar_pdf_relatorio(results, plot_paths=[]):
     pdf.section_title("Resumo do Modelo")
     pdf.data_row("Nome do Modelo:", results.get('name', 'Sem Nome'), True)
     pdf.data_row("Variável Alvo (Y):", results.get('y_col_real', 'Y'), True)
-    pdf.data_row("Total de Árvores:", f"{len(results['data_points']['y_real'])} obs", True)
+    pdf.data_row("Total de Árvores:", f"{len(results['y_real'])} obs", True)
+    if results.get('weights'):
+        w = results['weights']
+        pdf.data_row("Pesos (WLS):", f"1/{w['variavel']}^{w['k']:g} (k escolhido por {w['criterio'].upper()})", True)
     pdf.ln(5)
 
     # 2. Equação
@@ -151,11 +289,42 @@ def gerar_pdf_relatorio(results, plot_paths=[]):
     
     pdf.ln(65) # Espaço das imagens
 
+    # 5. Influência (top 10 pela distância de Cook)
+    top = top_influential(results, k=10)
+    if not top.empty:
+        pdf.ln(5)
+        pdf.section_title("Diagnóstico de Influência (10 árvores mais influentes)")
+        headers = [("Linha", 20), ("Observado", 28), ("Previsto", 28), ("Alavanc. (h)", 28), ("Res. Student.", 30), ("Cook", 28), ("DFFITS", 28)]
+        pdf.set_font('Arial', 'B', 9)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_fill_color(220, 220, 220)
+        for label, w in headers:
+            pdf.cell(w, 7, label, 1, 0, 'C', True)
+        pdf.ln()
+        pdf.set_font('Arial', '', 9)
+        for _, row in top.iterrows():
+            values = [f"{int(row['linha'])}", f"{row['observado']:.4f}", f"{row['previsto']:.4f}", f"{row['leverage']:.4f}",
+                      f"{row['student_resid']:.2f}", f"{row['cooks_d']:.4f}", f"{row['dffits']:.3f}"]
+            for (_, w), v in zip(headers, values):
+                pdf.cell(w, 7, v, 1, 0, 'C')
+            pdf.ln()
+        pdf.set_font('Arial', 'I', 8)
+        pdf.multi_cell(0, 5, "Limites de alerta: h > 2p/n, |t| > 3, Cook > 4/n, |DFFITS| > 2*raiz(p/n). "
+                             "Linha = posição da árvore no conjunto ajustado (escala do ajuste).")
+
+    # 6. Tabela de volume/altura (precisa dos dados do ajuste para a faixa das classes)
+    table = volume_table_cached(results, df_original)
+    if isinstance(table, pd.DataFrame):
+        _secao_tabela_volume(pdf, table)
+
+    # 7. Agregação por talhão/fazenda (quando calculada para este resultado)
+    aggregated = aggregation_cached(results, df_original)
+    if aggregated is not None and "error" not in aggregated:
+        _secao_agregacao(pdf, aggregated)
+
     # Limpeza
     for f in img_files:
         try: os.remove(f)
         except: pass
 
-    filename = f"Relatorio_{results['name'].replace(' ', '_')}.pdf"
-    pdf.output(filename)
-    return filename
\ No newline at end of file
+    return pdf
\ No newline at end of file
@@ -0,0 +1,185 @@
+# src/residual_cleaning.py
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import solve_triangular
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from src.config import CLEANING_T_THRESHOLD, CLEANING_MAX_ROUNDS, CLEANING_MAX_FRACTION
+from src.external_model import _parse_equation, _shield_columns, _build_design, _ols_result, physical_filter
+from src.results import ModelResult
+from src.profiling import span
+from src.jobs import checkpoint
+
+
+def cholesky_downdate(L: np.ndarray, x: np.ndarray) -> bool:
+    """
+    Downdate de posto um, no lugar: L·Lᵀ <- L·Lᵀ - x·xᵀ (L triangular inferior).
+    O(p²) por linha removida. False se o resultado deixaria de ser positivo-definido
+    (L fica inconsistente e o chamador refatora do zero).
+    """
+    x = np.array(x, dtype=float)
+    p = len(x)
+    for k in range(p):
+        r2 = L[k, k] ** 2 - x[k] ** 2
+        if r2 <= L[k, k] ** 2 * 1e-12:
+            return False
+        r = np.sqrt(r2)
+        c, s = r / L[k, k], x[k] / L[k, k]
+        L[k, k] = r
+        if k + 1 < p:
+            L[k + 1:, k] = (L[k + 1:, k] - s * x[k + 1:]) / c
+            x[k + 1:] = c * x[k + 1:] - s * L[k + 1:, k]
+    return True
+
+
+def clean_by_residuals(X: np.ndarray, y: np.ndarray, threshold: float = CLEANING_T_THRESHOLD,
+                       max_rounds: int = CLEANING_MAX_ROUNDS, max_fraction: float = CLEANING_MAX_FRACTION
+                       ) -> Tuple[np.ndarray, List[Dict[str, Any]], str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Remoção iterativa por resíduo studentizado externo, sem refazer o OLS a cada rodada.
+
+    X'X é fatorada uma vez (Cholesky, com colunas escaladas). Em cada rodada, as
+    observações com |t| > threshold (as piores primeiro, respeitando o teto de
+    max_fraction·n removidas no total) saem da solução por downdates de posto um
+    do fator e de X'y; a nova solução custa duas substituições triangulares.
+    Retorna (máscara das linhas mantidas, rodadas, motivo da parada, (β, alavancagem das mantidas)).
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n, p = X.shape
+    scale = np.sqrt(np.einsum("ij,ij->j", X, X))
+    scale[scale == 0] = 1.0
+    Xs = X / scale
+    L = np.linalg.cholesky(Xs.T @ Xs)
+    Xty = Xs.T @ y
+
+    keep = np.ones(n, dtype=bool)
+    budget = int(np.floor(max_fraction * n))
+    rounds: List[Dict[str, Any]] = []
+    reason = "limite_rodadas"
+
+    def solve():
+        z = solve_triangular(L, Xty, lower=True)
+        return solve_triangular(L.T, z, lower=False)
+
+    for r in range(1, max_rounds + 1):
+        checkpoint(f"Limpeza: rodada {r} de {max_rounds}...", 0.2 + 0.6 * (r - 1) / max_rounds)
+        idx = np.flatnonzero(keep)
+        beta = solve()
+        with span("limpeza.rodada", rows=len(idx)):
+            Z = solve_triangular(L, Xs[idx].T, lower=True)
+            h = np.einsum("ij,ij->j", Z, Z)
+            del Z
+            e = y[idx] - Xs[idx] @ beta
+            m = len(idx)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                one_minus_h = np.clip(1.0 - h, 1e-12, None)
+                s2 = float(e @ e) / (m - p)
+                ri = e / np.sqrt(s2 * one_minus_h)
+                t = ri * np.sqrt((m - p - 1) / np.clip(m - p - ri ** 2, 1e-12, None))
+
+        flagged = np.flatnonzero(np.abs(t) > threshold)
+        if not len(flagged):
+            reason = "sem_outliers"
+            break
+        allowed = budget - (n - m)
+        if allowed <= 0:
+            reason = "limite_fracao"
+            break
+        flagged = flagged[np.argsort(-np.abs(t[flagged]), kind="stable")][:allowed]
+        drop = idx[flagged]
+
+        with span("limpeza.downdate", rows=len(drop)):
+            refactor = False
+            for i in drop:
+                if not refactor:
+                    refactor = not cholesky_downdate(L, Xs[i])
+                Xty -= Xs[i] * y[i]
+            keep[drop] = False
+            if refactor:
+                # Downdate numericamente instável (ex: linha de alta alavancagem): refatora só esta vez
+                kept = Xs[keep]
+                L = np.linalg.cholesky(kept.T @ kept)
+
+        rounds.append({"rodada": r, "linhas": drop.tolist(), "t": t[flagged].tolist(),
+                       "n_antes": int(m), "limiar": float(threshold)})
+        if len(drop) == allowed:
+            reason = "limite_fracao"
+            break
+        if m - len(drop) <= p + 1:
+            reason = "dados_insuficientes"
+            break
+
+    beta = solve()
+    idx = np.flatnonzero(keep)
+    Z = solve_triangular(L, Xs[idx].T, lower=True)
+    leverage = np.einsum("ij,ij->j", Z, Z)
+    return keep, rounds, reason, (beta / scale, leverage)
+
+
+def fit_cleaned(df: pd.DataFrame, result: ModelResult, threshold: float = CLEANING_T_THRESHOLD,
+                max_rounds: int = CLEANING_MAX_ROUNDS, max_fraction: float = CLEANING_MAX_FRACTION
+                ) -> Union[ModelResult, Dict[str, str]]:
+    """
+    Limpeza pós-ajuste de um resultado OLS: parte das linhas que passaram pelo
+    Shield (result['row_index'] em df) e remove, rodada a rodada, as árvores com
+    resíduo studentizado alto para o modelo (ex: DAP grande com HT pequena,
+    plausíveis em cada eixo). O relatório fica em result['cleaning'].
+    """
+    alias_map = result.get('alias_map_used') or {}
+    try:
+        y_var_sym, is_log_y, y_col_real, rhs_equation, x_vars_sym = _parse_equation(result['equation_original'], alias_map)
+    except (ValueError, TypeError) as e:
+        return {"error": f"Resultado sem equação/apelidos utilizáveis: {e}"}
+    if result.get('method') == "Manual" or result.get('source'):
+        return {"error": "A limpeza por resíduos vale para ajustes OLS em memória."}
+    row_index = result['row_index']
+    if len(row_index) and row_index.max() >= len(df):
+        return {"error": "O DataFrame não corresponde ao ajuste (linhas fora do intervalo)."}
+
+    checkpoint("Shield e matriz X...", 0.1)
+    with span("limpeza.fit_cleaned", rows=len(row_index)) as sp:
+        cols = _shield_columns(df, y_col_real, x_vars_sym, alias_map)
+        rows = physical_filter(df.iloc[row_index], cols)
+        try:
+            X_df = _build_design(rows, rhs_equation, x_vars_sym, alias_map)
+        except ValueError as e:
+            return {"error": str(e)}
+        positions = df.index.get_indexer(X_df.index)
+        y_real = rows.loc[X_df.index, y_col_real].to_numpy(dtype=float)
+        y = np.log(y_real) if is_log_y else y_real
+        X = X_df.to_numpy(dtype=float)
+        if len(y) <= X.shape[1] + 2:
+            return {"error": "Número insuficiente de dados válidos para a limpeza."}
+
+        try:
+            keep, rounds, reason, (beta, leverage) = clean_by_residuals(X, y, threshold, max_rounds, max_fraction)
+        except np.linalg.LinAlgError:
+            return {"error": "X'X singular: termos redundantes na equação."}
+
+        # Linhas do relatório: posição em df (mesma convenção de row_index)
+        for rd in rounds:
+            rd["linhas"] = positions[rd["linhas"]].tolist()
+        X_k = X[keep]
+        out = _ols_result(result['equation_original'], y_var_sym, is_log_y, y_col_real, alias_map, list(X_df.columns),
+                          X_k, y[keep], y_real[keep], beta, X_k @ beta, X.shape[1], leverage, positions[keep])
+        sp.rows = int(keep.sum())
+
+    out['cleaning'] = {
+        "limiar": float(threshold), "max_rodadas": int(max_rounds), "max_fracao": float(max_fraction),
+        "n_inicial": int(len(y)), "removidas": int((~keep).sum()), "parada": reason, "rodadas": rounds,
+    }
+    return out
+
+
+def cleaning_table(result: ModelResult, df_original: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Árvores removidas pela limpeza, uma por linha: rodada, posição (e IDs com df_original) e |t|."""
+    report = result.get('cleaning') or {}
+    rows = [{"rodada": rd["rodada"], "linha": i, "t": t}
+            for rd in report.get("rodadas", []) for i, t in zip(rd["linhas"], rd["t"])]
+    table = pd.DataFrame(rows, columns=["rodada", "linha", "t"])
+    if df_original is not None and len(table) and table["linha"].max() < len(df_original):
+        ids = df_original.iloc[table["linha"].to_numpy()][df_original.columns[:3]].reset_index(drop=True)
+        table = pd.concat([table[["rodada", "linha"]], ids, table[["t"]]], axis=1)
+    return table
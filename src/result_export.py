@@ -0,0 +1,253 @@
+# src/result_export.py
+
+import io
+import os
+import re
+import zipfile
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from src.config import EXPORT_BATCH_ROWS
+from src.profiling import span
+from src.volume_table import volume_table_cached, volume_table_long
+from src.aggregation import aggregation_cached
+from src.influence import influence_cached
+
+# Formato -> extensão. Parquet e Arrow IPC exigem pyarrow; CSV não.
+EXPORT_FORMATS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+# Colunas tratadas como identificação da árvore (nome normalizado, ver importer.normalize_header)
+ID_COLUMN_KEYS = ("fazenda", "talhao", "parcela", "arvore", "fuste", "id", "codigo", "sourcefile", "sourcesheet")
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise ImportError("Exportar em Parquet/Arrow requer o pacote 'pyarrow' (pip install pyarrow). CSV funciona sem ele.")
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", str(text or "modelo")).strip("_") or "modelo"
+
+
+# ==============================================================================
+# Tabelas pequenas: coeficientes e métricas (um ou vários modelos)
+# ==============================================================================
+def coefficients_table(results_list: Sequence[Any]) -> pd.DataFrame:
+    rows = []
+    for res in results_list:
+        for term, value in res.get('coefs', {}).items():
+            rows.append({"modelo": res.get('name', ''), "metodo": res.get('method', ''), "termo": term, "coeficiente": float(value)})
+    return pd.DataFrame(rows, columns=["modelo", "metodo", "termo", "coeficiente"])
+
+
+def metrics_table(results_list: Sequence[Any]) -> pd.DataFrame:
+    rows = []
+    for res in results_list:
+        rows.append({
+            "modelo": res.get('name', ''), "metodo": res.get('method', ''),
+            "equacao": res.get('equation_original', ''), "equacao_ajustada": res.get('equation_fitted', ''),
+            "y": res.get('y_col_real', ''), "escala_log": bool(res.get('is_log', False)),
+            "n_obs": res.get('n_obs'), "r2_adj": res.get('r2_adj'), "syx_pct": res.get('syx_pct'),
+            "rmse": res.get('rmse'), "fc_meyer": res.get('fc_meyer'), "aic": res.get('aic'),
+            "bic": res.get('bic'), "durbin_watson": res.get('durbin_watson'),
+        })
+    return pd.DataFrame(rows)
+
+
+# ==============================================================================
+# Tabela por árvore, em lotes
+# ==============================================================================
+def default_id_columns(df: pd.DataFrame, exclude: Sequence[str] = ()) -> List[str]:
+    """Colunas de identificação (talhão, parcela, árvore, arquivo de origem...) presentes no df."""
+    from src.importer import normalize_header
+    ids = [c for c in df.columns if c not in exclude and normalize_header(c) in ID_COLUMN_KEYS]
+    return ids or [c for c in df.columns if c not in exclude][:3]
+
+
+def iter_row_batches(result: Any, df_original: Optional[pd.DataFrame] = None, id_cols: Optional[Sequence[str]] = None,
+                     include_removed: bool = True, batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Tabela por árvore em lotes de colunas NumPy: linha, IDs, observado, previsto,
+    resíduo (escala real), valores na escala do ajuste, influência e as marcas
+    'removido_shield' e, se o resultado passou pela limpeza por resíduos,
+    'removido_residuo'.
+
+    Com df_original (o DataFrame do ajuste) e include_removed, inclui as linhas
+    descartadas pela blindagem (previsto vazio). Sem ele, só as linhas ajustadas,
+    e as colunas vêm de fatias dos arrays do resultado (sem cópia).
+    """
+    # OLS guarda observado/previsto na escala do ajuste (ln Y); o Manual, na escala real
+    log_arrays = bool(result.get('is_log')) and result.get('method') != "Manual"
+    fc = result.get('fc_meyer') or 1.0
+    row_index = result['row_index']
+    diagnostics = influence_cached(result) or {}  # Calculados aqui só se o painel/PDF ainda não pediu
+
+    def to_real(obs, pred):
+        if not log_arrays:
+            return obs, pred
+        return np.exp(obs), np.exp(pred) * fc
+
+    if df_original is None or not include_removed:
+        ids = None
+        if df_original is not None:
+            id_cols = list(id_cols) if id_cols is not None else default_id_columns(df_original)
+            ids = df_original[id_cols]
+        for start in range(0, len(row_index), batch_rows):
+            sl = slice(start, start + batch_rows)
+            obs_fit, pred_fit = result['y_real'][sl], result['y_pred'][sl]  # Visões, sem cópia
+            obs, pred = to_real(obs_fit, pred_fit)
+            batch = {"linha": row_index[sl]}
+            if ids is not None:
+                batch.update({c: ids[c].to_numpy()[row_index[sl]] for c in id_cols})
+            batch.update({"observado": obs, "previsto": pred, "residuo": obs - pred})
+            if log_arrays:
+                batch.update({"observado_ajuste": obs_fit, "previsto_ajuste": pred_fit, "residuo_ajuste": obs_fit - pred_fit})
+            batch.update({f: v[sl] for f, v in diagnostics.items()})
+            batch["removido_shield"] = np.zeros(len(obs), dtype=bool)
+            yield batch
+        return
+
+    # Todas as linhas do df do ajuste: posição -> índice no resultado (-1 = removida pelo Shield)
+    n = len(df_original)
+    id_cols = list(id_cols) if id_cols is not None else default_id_columns(df_original, exclude=[result.get('y_col_real')])
+    slot = np.full(n, -1, dtype=np.int64)
+    valid = row_index < n
+    slot[row_index[valid]] = np.flatnonzero(valid)
+    cleaned = np.zeros(n, dtype=bool)
+    for rd in (result.get('cleaning') or {}).get('rodadas', []):
+        cleaned[[i for i in rd['linhas'] if i < n]] = True
+    y_col = result.get('y_col_real')
+    y_values = pd.to_numeric(df_original[y_col], errors='coerce').to_numpy(dtype=float) if y_col in df_original.columns else None
+
+    for start in range(0, n, batch_rows):
+        stop = min(start + batch_rows, n)
+        idx = slot[start:stop]
+        fitted = idx >= 0
+        take = idx[fitted]
+        m = stop - start
+
+        pred_fit = np.full(m, np.nan); pred_fit[fitted] = result['y_pred'][take]
+        obs_fit = np.full(m, np.nan); obs_fit[fitted] = result['y_real'][take]
+        obs_real, pred = to_real(obs_fit, pred_fit)
+        if y_values is not None:
+            obs_real = y_values[start:stop]  # Valor bruto da planilha, inclusive nas linhas removidas
+
+        batch = {"linha": np.arange(start, stop, dtype=np.int64)}
+        batch.update({c: df_original[c].iloc[start:stop].to_numpy() for c in id_cols})
+        batch.update({"observado": obs_real, "previsto": pred, "residuo": obs_real - pred})
+        if log_arrays:
+            batch.update({"observado_ajuste": obs_fit, "previsto_ajuste": pred_fit, "residuo_ajuste": obs_fit - pred_fit})
+        for f, values in diagnostics.items():
+            col = np.full(m, np.nan); col[fitted] = values[take]
+            batch[f] = col
+        batch["removido_shield"] = ~fitted & ~cleaned[start:stop]
+        if result.get('cleaning'):
+            batch["removido_residuo"] = cleaned[start:stop]
+        yield batch
+
+
+def write_row_table(result: Any, path: str, fmt: str = "parquet", df_original: Optional[pd.DataFrame] = None,
+                    id_cols: Optional[Sequence[str]] = None, include_removed: bool = True,
+                    batch_rows: int = EXPORT_BATCH_ROWS) -> int:
+    """Grava a tabela por árvore em 'path', lote a lote (memória limitada a um lote). Retorna o nº de linhas."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato inválido: {fmt}. Use {', '.join(EXPORT_FORMATS)}.")
+    batches = iter_row_batches(result, df_original, id_cols, include_removed, batch_rows)
+    total = 0
+    with span(f"exportacao.linhas_{fmt}") as sp:
+        if fmt == "csv":
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                for i, batch in enumerate(batches):
+                    pd.DataFrame(batch).to_csv(f, header=(i == 0), index=False)
+                    total += len(batch["linha"])
+        else:
+            pa = _require_pyarrow()
+            import pyarrow.parquet as pq
+            writer = None
+            try:
+                for batch in batches:
+                    # pa.array sobre arrays NumPy numéricos contíguos não copia os dados
+                    record = pa.RecordBatch.from_pydict({k: pa.array(v) for k, v in batch.items()})
+                    if writer is None:
+                        writer = pq.ParquetWriter(path, record.schema) if fmt == "parquet" else pa.ipc.new_file(path, record.schema)
+                    writer.write_batch(record)
+                    total += record.num_rows
+            finally:
+                if writer is not None:
+                    writer.close()
+        sp.rows = total
+    return total
+
+
+def _write_small(df: pd.DataFrame, path: str, fmt: str) -> None:
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "parquet":
+        _require_pyarrow()
+        df.to_parquet(path, index=False)
+    else:
+        pa = _require_pyarrow()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+
+def export_results(results_list: Sequence[Any], fmt: str = "parquet", dest: Optional[str] = None,
+                   resolve_df: Optional[Callable[[Any], Optional[pd.DataFrame]]] = None,
+                   include_removed: bool = True, batch_rows: int = EXPORT_BATCH_ROWS,
+                   progress: Optional[Callable[[float, str], None]] = None) -> Any:
+    """
+    Exporta um ou vários resultados num .zip: 'coeficientes', 'metricas', uma
+    tabela 'linhas_<modelo>' por resultado e, quando o modelo permite, a tabela de
+    volume/altura 'tabela_<modelo>' (formato longo), além de 'agregado_<nível>_<modelo>'
+    (parcelas, talhões, fazendas) quando o resultado tem agregação. 'resolve_df(result)' devolve
+    o DataFrame do ajuste (IDs, linhas removidas e faixa das classes) ou None.
+    Com 'dest' grava o .zip no caminho e o retorna; sem ele, devolve os bytes.
+    As tabelas por árvore passam por arquivos temporários, lote a lote.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato inválido: {fmt}. Use {', '.join(EXPORT_FORMATS)}.")
+    ext = EXPORT_FORMATS[fmt]
+    target = dest if dest is not None else io.BytesIO()
+
+    with span("exportacao.export_results", rows=sum(len(r['y_real']) for r in results_list)), \
+            tempfile.TemporaryDirectory() as tmp:
+        # Parquet/Arrow já são comprimidos: zip só empacota (sem recomprimir)
+        compression = zipfile.ZIP_DEFLATED if fmt == "csv" else zipfile.ZIP_STORED
+        with zipfile.ZipFile(target, "w", compression=compression) as zf:
+            for name, table in (("coeficientes", coefficients_table(results_list)), ("metricas", metrics_table(results_list))):
+                path = os.path.join(tmp, name + ext)
+                _write_small(table, path, fmt)
+                zf.write(path, name + ext)
+
+            used = set()
+            for i, res in enumerate(results_list, start=1):
+                slug = _slug(res.get('name'))
+                if slug in used: slug = f"{slug}_{i}"
+                used.add(slug)
+                if progress: progress((i - 1) / len(results_list), f"Exportando {res.get('name')}...")
+                df_original = resolve_df(res) if resolve_df else None
+                path = os.path.join(tmp, f"linhas_{slug}{ext}")
+                write_row_table(res, path, fmt, df_original=df_original, include_removed=include_removed, batch_rows=batch_rows)
+                zf.write(path, f"linhas_{slug}{ext}")
+                os.remove(path)
+
+                table = volume_table_cached(res, df_original)
+                if isinstance(table, pd.DataFrame):
+                    path = os.path.join(tmp, f"tabela_{slug}{ext}")
+                    _write_small(volume_table_long(table), path, fmt)
+                    zf.write(path, f"tabela_{slug}{ext}")
+
+                aggregated = aggregation_cached(res, df_original)
+                if aggregated is not None and "error" not in aggregated:
+                    for level, table in aggregated.items():
+                        path = os.path.join(tmp, f"agregado_{level}_{slug}{ext}")
+                        _write_small(table, path, fmt)
+                        zf.write(path, f"agregado_{level}_{slug}{ext}")
+
+    return dest if dest is not None else target.getvalue()
@@ -0,0 +1,162 @@
+# src/results.py
+
+import io
+import json
+import uuid
+import numpy as np
+from typing import Any, Dict
+
+
+class ModelResult:
+    """
+    Resultado de um ajuste (OLS ou Manual) com armazenamento compacto.
+    Observado/Previsto e índices das linhas usadas ficam em arrays NumPy
+    (float64/int64), sem listas Python de floats.
+
+    Mantém acesso estilo dicionário (res['r2_adj'], res.get('aic')) para
+    que o app, os gráficos e o PDF continuem lendo os mesmos campos.
+    """
+
+    # Campos escalares/metadados (tudo menos os arrays)
+    _META_FIELDS = (
+        "result_id", "name", "method", "equation_original", "equation_fitted",
+        "coefs", "r2_adj", "rmse", "fc_meyer", "syx_pct",
+        "aic", "bic", "durbin_watson", "n_obs",
+        "is_log", "y_col_real", "y_col_name", "alias_map_used",
+        "source",  # Arquivo/colunas de origem dos ajustes out-of-core (arrays = amostra)
+        "dataset_ref",  # Chave no DATASET_STORE do DataFrame ajustado (IDs na exportação)
+        "cleaning",  # Relatório da limpeza por resíduos (rodadas e árvores removidas), se aplicada
+        "weights",  # WLS: variável e expoente k dos pesos 1/X^k e a tabela da busca por k
+        "aggregation",  # Especificação da agregação por parcela/talhão/fazenda (colunas, área, fonte)
+    )
+    # Alavancagem (da fatoração do ajuste) e, no WLS, √w; None quando não há. Os diagnósticos
+    # de influência saem daí sob demanda (influence.influence_cached), fora do resultado
+    _OPTIONAL_ARRAY_FIELDS = ("leverage", "resid_weight")
+    _ARRAY_FIELDS = ("row_index", "y_real", "y_pred") + _OPTIONAL_ARRAY_FIELDS
+    _FIELDS = _META_FIELDS + _ARRAY_FIELDS
+
+    # __weakref__ permite liberar caches derivados (gráficos) quando o resultado é descartado
+    __slots__ = _FIELDS + ("__weakref__",)
+
+    def __init__(self, y_real, y_pred, row_index=None, **fields):
+        self.y_real = np.ascontiguousarray(y_real, dtype=np.float64)
+        self.y_pred = np.ascontiguousarray(y_pred, dtype=np.float64)
+        if row_index is None:
+            row_index = np.arange(len(self.y_real))
+        self.row_index = np.ascontiguousarray(row_index, dtype=np.int64)
+        for f in self._OPTIONAL_ARRAY_FIELDS:
+            value = fields.pop(f, None)
+            setattr(self, f, None if value is None else np.ascontiguousarray(value, dtype=np.float64))
+
+        for f in self._META_FIELDS:
+            setattr(self, f, fields.pop(f, None))
+        if fields:
+            raise TypeError(f"Campos desconhecidos: {sorted(fields)}")
+
+        # Identidade estável (sobrevive a copy()/serialização): chave dos caches de renderização
+        if self.result_id is None: self.result_id = uuid.uuid4().hex
+        if self.coefs is None: self.coefs = {}
+        if self.n_obs is None: self.n_obs = int(len(self.y_real))
+        if self.is_log is None: self.is_log = False
+
+    # --- Compatibilidade com o formato dict antigo ---
+    @property
+    def success(self) -> bool:
+        return True
+
+    @property
+    def data_points(self) -> Dict[str, np.ndarray]:
+        """Visão dos arrays (sem cópia) no formato antigo {'y_real', 'y_pred'}."""
+        return {"y_real": self.y_real, "y_pred": self.y_pred}
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELDS or key in ("success", "data_points"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self._FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        # 'error' nunca está presente: erros continuam sendo {"error": msg}
+        return key in self._FIELDS or key in ("success", "data_points")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    # --- Serialização barata ---
+    def to_dict(self) -> Dict[str, Any]:
+        """Metadados + arrays (sem converter os arrays para listas)."""
+        out = {f: getattr(self, f) for f in self._META_FIELDS}
+        for f in self._ARRAY_FIELDS:
+            out[f] = getattr(self, f)
+        return out
+
+    def to_bytes(self) -> bytes:
+        """Serializa em .npz: arrays binários + metadados em JSON."""
+        meta = {f: _to_builtin(getattr(self, f)) for f in self._META_FIELDS}
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+            **{f: getattr(self, f) for f in self._ARRAY_FIELDS if getattr(self, f) is not None},
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> "ModelResult":
+        with np.load(io.BytesIO(payload), allow_pickle=False) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            arrays = {f: data[f] for f in cls._ARRAY_FIELDS if f in data.files}
+        return cls(**arrays, **meta)
+
+    def __getstate__(self):
+        return {f: getattr(self, f) for f in self._FIELDS}
+
+    def __setstate__(self, state):
+        for f in self._FIELDS:
+            setattr(self, f, state.get(f))
+
+    def copy(self) -> "ModelResult":
+        """Cópia rasa: metadados independentes, arrays compartilhados (sem copiar dados)."""
+        clone = ModelResult.__new__(ModelResult)
+        for f in self._FIELDS:
+            value = getattr(self, f)
+            setattr(clone, f, dict(value) if isinstance(value, dict) else value)
+        return clone
+
+    def freeze(self) -> "ModelResult":
+        """Torna os arrays somente-leitura (resultados compartilhados em cache)."""
+        for f in self._ARRAY_FIELDS:
+            arr = getattr(self, f)
+            if arr is None:
+                continue
+            if arr.base is not None:
+                # Visão de dados de terceiros (ex: coluna de um DataFrame): copia antes de travar
+                arr = arr.copy()
+                setattr(self, f, arr)
+            arr.flags.writeable = False
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        """Memória ocupada pelos arrays do resultado."""
+        return int(sum(getattr(self, f).nbytes for f in self._ARRAY_FIELDS if getattr(self, f) is not None))
+
+    def __repr__(self) -> str:
+        return f"ModelResult(name={self.name!r}, method={self.method!r}, n_obs={self.n_obs})"
+
+
+def _to_builtin(value: Any) -> Any:
+    """Converte escalares/dicts NumPy para tipos nativos (JSON)."""
+    if isinstance(value, dict):
+        return {str(k): _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
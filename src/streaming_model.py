@@ -0,0 +1,362 @@
+# src/streaming_model.py
+
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+from src.config import STREAM_CHUNK_ROWS, STREAM_SKETCH_K, STREAM_SAMPLE_POINTS, SERVER_DATA_ROOT
+from src.parser import clean_and_convert_data
+from src.external_model import _parse_equation, _build_design, _format_fitted_equation, physical_filter
+from src.results import ModelResult
+from src.profiling import span
+
+# Mesmos parâmetros do filtro IQR de apply_shield
+IQR_FACTOR = 3.0
+IQR_MIN_ROWS = 5
+
+
+class StreamingQuantiles:
+    """
+    Quantis aproximados em fluxo (sketch de compactadores, estilo KLL).
+    Cada nível guarda até k valores; ao estourar, o nível é ordenado e metade
+    dos valores (posições pares ou ímpares, ao acaso) sobe com peso dobrado.
+    Memória O(k log(n/k)); enquanto nada foi compactado o resultado é exato.
+    """
+
+    def __init__(self, k: int = STREAM_SKETCH_K, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self._levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        self.n += len(values)
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        h = 0
+        while h < len(self._levels):
+            buf = self._levels[h]
+            if len(buf) > self.k:
+                buf = np.sort(buf)
+                # Número par vai para a compactação; a sobra fica no nível
+                keep = buf[len(buf) - len(buf) % 2:]
+                promoted = buf[:len(buf) - len(buf) % 2][self._rng.integers(2)::2]
+                self._levels[h] = keep
+                if h + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+                self._levels[h + 1] = np.concatenate([self._levels[h + 1], promoted])
+            h += 1
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return np.nan
+        if len(self._levels) == 1:
+            return float(np.quantile(self._levels[0], q))  # Exato (interpolação linear, como o pandas)
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(b), 2.0 ** h) for h, b in enumerate(self._levels)])
+        order = np.argsort(values, kind="stable")
+        values, weights = values[order], weights[order]
+        positions = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return float(np.interp(q, positions, values))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(b.nbytes for b in self._levels)
+
+
+# ==============================================================================
+# Fontes em blocos: arquivo (CSV/Parquet), pasta de .npy (memmap), colunas ou DataFrame
+# ==============================================================================
+def resolve_server_path(path: str, root: Union[str, Path] = SERVER_DATA_ROOT) -> Union[Path, Dict[str, str]]:
+    """
+    Caminho digitado pelo usuário -> arquivo/pasta dentro de 'root' (relativo a ele ou absoluto).
+    Links e '..' são resolvidos antes da checagem; fora da raiz ou inexistente vira {"error": ...}.
+    """
+    root = Path(root).resolve()
+    target = (root / Path(path).expanduser()).resolve()
+    if not target.is_relative_to(root):
+        return {"error": f"Caminho fora da pasta de dados do servidor ({root})."}
+    if not target.exists():
+        return {"error": f"Arquivo não encontrado: {path}"}
+    return target
+
+
+def source_columns(source: Any, read_csv_kwargs: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Colunas disponíveis na fonte, sem ler os dados."""
+    if isinstance(source, pd.DataFrame):
+        return source.columns.tolist()
+    if isinstance(source, dict):
+        return list(source.keys())
+    path = Path(source)
+    if path.is_dir():
+        return sorted(p.stem for p in path.glob("*.npy"))
+    if path.suffix.lower() == ".parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).schema_arrow.names
+    return pd.read_csv(path, nrows=0, **(read_csv_kwargs or {})).columns.tolist()
+
+
+def iter_chunks(source: Any, columns: List[str], chunk_rows: int = STREAM_CHUNK_ROWS,
+                read_csv_kwargs: Optional[Dict[str, Any]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Percorre a fonte em blocos de até 'chunk_rows' linhas, só com 'columns'.
+    Arquivos de texto passam pela mesma limpeza numérica do parser (vírgula decimal, textos).
+    O índice dos blocos é a posição da linha na fonte.
+    """
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunk_rows):
+            chunk = source.iloc[start:start + chunk_rows][columns]
+            yield chunk.set_axis(pd.RangeIndex(start, start + len(chunk)))
+        return
+
+    if isinstance(source, (str, os.PathLike)):
+        path = Path(source)
+        if path.is_dir():
+            # Uma coluna por arquivo .npy, aberta como memmap (nada é carregado inteiro)
+            source = {c: np.load(path / f"{c}.npy", mmap_mode="r") for c in columns}
+        elif path.suffix.lower() == ".parquet":
+            import pyarrow.parquet as pq
+            start = 0
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+                chunk = batch.to_pandas()
+                yield clean_and_convert_data(chunk.set_axis(pd.RangeIndex(start, start + len(chunk))))
+                start += len(chunk)
+            return
+        else:
+            reader = pd.read_csv(path, usecols=columns, chunksize=chunk_rows, **(read_csv_kwargs or {}))
+            for chunk in reader:
+                yield clean_and_convert_data(chunk)
+            return
+
+    # Colunas (arrays ou memmaps) do mesmo comprimento
+    n = len(source[columns[0]])
+    for start in range(0, n, chunk_rows):
+        yield pd.DataFrame({c: np.asarray(source[c][start:start + chunk_rows]) for c in columns},
+                           index=pd.RangeIndex(start, min(start + chunk_rows, n)))
+
+
+# ==============================================================================
+# Ajuste
+# ==============================================================================
+class _Accumulator:
+    """Somas suficientes do OLS (equações normais) combináveis bloco a bloco."""
+
+    def __init__(self, p: int):
+        self.XtX = np.zeros((p, p))
+        self.Xty = np.zeros(p)
+        self.n = 0
+        self.y_mean = 0.0     # Média e soma de quadrados centrada de y (escala do ajuste), por Chan et al.
+        self.y_m2 = 0.0
+        self.yty = 0.0
+        self.y_real_sum = 0.0
+
+    def add(self, X: np.ndarray, y: np.ndarray, y_real: np.ndarray) -> None:
+        m = len(y)
+        if not m:
+            return
+        self.XtX += X.T @ X
+        self.Xty += X.T @ y
+        self.yty += float(y @ y)
+        self.y_real_sum += float(y_real.sum())
+        mean_b = float(y.mean())
+        m2_b = float(((y - mean_b) ** 2).sum())
+        delta = mean_b - self.y_mean
+        total = self.n + m
+        self.y_mean += delta * m / total
+        self.y_m2 += m2_b + delta ** 2 * self.n * m / total
+        self.n = total
+
+    def solve(self) -> np.ndarray:
+        """Resolve (X'X) b = X'y com escala das colunas; cai para a pseudo-inversa se singular."""
+        scale = np.sqrt(np.diag(self.XtX))
+        scale[scale == 0] = 1.0
+        A = self.XtX / np.outer(scale, scale)
+        try:
+            L = np.linalg.cholesky(A)
+            z = np.linalg.solve(L, self.Xty / scale)
+            return np.linalg.solve(L.T, z) / scale
+        except np.linalg.LinAlgError:
+            return np.linalg.pinv(A) @ (self.Xty / scale) / scale
+
+
+def fit_regression_streaming(source: Any, equation: str, alias_map: Dict[str, str],
+                             chunk_rows: int = STREAM_CHUNK_ROWS, read_csv_kwargs: Optional[Dict[str, Any]] = None,
+                             progress: Optional[Callable[[float, str], None]] = None,
+                             sample_points: int = STREAM_SAMPLE_POINTS) -> Union[ModelResult, Dict[str, Any]]:
+    """
+    Ajuste OLS Blindado fora da memória (out-of-core).
+
+    A fonte (caminho de CSV/Parquet, pasta de .npy, dict de colunas/memmaps ou
+    DataFrame) é lida em blocos, três vezes:
+      1. filtro físico + sketch de quantis por coluna crítica -> limites IQR (3x);
+      2. acumulação de X'X, X'y e das somas de y -> coeficientes;
+      3. resíduos: Durbin-Watson (levando o último resíduo de cada bloco ao
+         próximo), SQ dos resíduos e Syx% na escala real (com Meyer).
+    A memória depende do tamanho do bloco, não de n. Os quantis do IQR são
+    aproximados e calculados sobre as linhas que passam no filtro físico de
+    todas as colunas de uma vez (apply_shield filtra coluna a coluna).
+    Os arrays do resultado (gráficos) são uma amostra de até 'sample_points' linhas.
+    """
+    with span("streaming.fit_regression_streaming"):
+        return _fit_regression_streaming(source, equation, alias_map, chunk_rows, read_csv_kwargs,
+                                         progress or (lambda frac, msg: None), sample_points)
+
+
+def _fit_regression_streaming(source, equation, alias_map, chunk_rows, read_csv_kwargs, progress, sample_points):
+    try:
+        y_var_sym, is_log_y, y_col_real, rhs_equation, x_vars_sym = _parse_equation(equation, alias_map)
+    except ValueError as e: return {"error": str(e)}
+
+    try:
+        available = source_columns(source, read_csv_kwargs)
+    except Exception as e:
+        return {"error": f"Não foi possível abrir a fonte: {e}"}
+    if y_col_real not in available: return {"error": f"Coluna '{y_col_real}' inexistente."}
+    cols = [y_col_real] + [alias_map[s] for s in x_vars_sym if alias_map.get(s) in available]
+    cols = list(dict.fromkeys(cols))
+
+    def chunks():
+        return iter_chunks(source, cols, chunk_rows, read_csv_kwargs)
+
+    # progress() fica fora dos try: o cancelamento do job (levantado por ele) não vira erro
+    # --- Passe 1: limites IQR por quantis em fluxo ---
+    progress(0.0, "Passe 1/3: quantis do filtro IQR")
+    with span("streaming.quantis") as sp:
+        sketches = {c: StreamingQuantiles() for c in cols}
+        n_total = n_valid = 0
+        reader = chunks()
+        while True:
+            try:
+                chunk = next(reader, None)
+                if chunk is None:
+                    break
+                valid = physical_filter(chunk, cols)
+                for c in cols:
+                    sketches[c].update(valid[c].to_numpy(dtype=float))
+            except Exception as e:
+                return {"error": f"Erro crítico no processamento: {str(e)}"}
+            n_total += len(chunk)
+            n_valid += len(valid)
+            progress(0.0, f"Passe 1/3: {n_total:,} linhas lidas")
+        sp.rows = n_total
+
+        bounds = {}
+        if n_valid >= IQR_MIN_ROWS:
+            for c in cols:
+                q1, q3 = sketches[c].quantile(0.25), sketches[c].quantile(0.75)
+                iqr = q3 - q1
+                if iqr > 0:
+                    bounds[c] = (q1 - IQR_FACTOR * iqr, q3 + IQR_FACTOR * iqr)
+
+    def shielded(chunk):
+        df_ok = physical_filter(chunk, cols)
+        for c, (lo, hi) in bounds.items():
+            df_ok = df_ok[(df_ok[c] >= lo) & (df_ok[c] <= hi)]
+        return df_ok
+
+    def design(df_ok):
+        X_df = _build_design(df_ok, rhs_equation, x_vars_sym, alias_map)
+        y_real = df_ok.loc[X_df.index, y_col_real].to_numpy(dtype=float)
+        y = np.log(y_real) if is_log_y else y_real
+        return X_df, y, y_real
+
+    # --- Passe 2: equações normais ---
+    progress(1 / 3, "Passe 2/3: acumulando X'X e X'y")
+    with span("streaming.acumulacao", rows=n_total):
+        acc, names = None, None
+        reader = chunks()
+        while True:
+            try:
+                chunk = next(reader, None)
+                if chunk is None:
+                    break
+                X_df, y, y_real = design(shielded(chunk))
+                if names is None and len(X_df.columns):
+                    names = X_df.columns.tolist()
+                    acc = _Accumulator(len(names))
+                if acc is None or not len(y):
+                    continue
+                acc.add(X_df[names].to_numpy(dtype=float), y, y_real)
+            except ValueError as e:
+                return {"error": str(e)}
+            except Exception as e:
+                return {"error": f"Erro crítico no processamento: {str(e)}"}
+            progress(1 / 3, f"Passe 2/3: {acc.n:,} árvores aceitas")
+
+    if acc is None or acc.n < 3:
+        return {"error": "Número insuficiente de dados válidos (< 3) para regressão."}
+    n, k = acc.n, len(names)
+    beta = acc.solve()
+
+    # --- Passe 3: resíduos (DW com o resíduo da fronteira entre blocos) ---
+    progress(2 / 3, "Passe 3/3: resíduos e métricas")
+    with span("streaming.residuos", rows=n):
+        rss = dw_num = 0.0
+        last_resid = None
+        s_yy = s_ye = s_ee = 0.0  # Somas para o Syx% na escala real (modelos em log)
+        rng = np.random.default_rng(0)
+        sample_keys = np.empty(0)
+        sample = np.empty((0, 3))
+        seen = 0
+        for chunk in chunks():
+            X_df, y, y_real = design(shielded(chunk))
+            if not len(y):
+                continue
+            pred = X_df[names].to_numpy(dtype=float) @ beta
+            e = y - pred
+            rss += float(e @ e)
+            dw_num += float((np.diff(e) ** 2).sum())
+            if last_resid is not None:
+                dw_num += (e[0] - last_resid) ** 2
+            last_resid = e[-1]
+            if is_log_y:
+                ep = np.exp(pred)
+                s_yy += float(y_real @ y_real); s_ye += float(y_real @ ep); s_ee += float(ep @ ep)
+
+            # Amostra uniforme para os gráficos (chaves aleatórias: reservatório vetorizado)
+            keys = rng.random(len(y))
+            rows = np.column_stack([X_df.index.to_numpy(dtype=float), y, pred])
+            sample_keys = np.concatenate([sample_keys, keys])
+            sample = np.vstack([sample, rows])
+            if len(sample_keys) > sample_points:
+                top = np.argpartition(sample_keys, sample_points)[:sample_points]
+                sample_keys, sample = sample_keys[top], sample[top]
+            seen += len(y)
+            progress(2 / 3 + seen / n / 3, f"Passe 3/3: {seen:,} de {n:,} árvores")
+
+    mse_resid = rss / (n - k) if n > k else np.nan
+    rmse = np.sqrt(mse_resid)
+    has_const = "const" in names
+    tss = acc.y_m2 if has_const else acc.yty
+    r2 = 1 - rss / tss if tss > 0 else np.nan
+    r2_adj = 1 - (n - has_const) / (n - k) * (1 - r2) if n > k else np.nan
+    llf = -n / 2.0 * (np.log(2 * np.pi) + np.log(rss / n) + 1)
+    aic = -2 * llf + 2 * k
+    bic = -2 * llf + np.log(n) * k
+    dw_stat = dw_num / rss if rss > 0 else np.nan
+
+    y_mean_real = acc.y_real_sum / n
+    fc = float(np.exp(mse_resid / 2.0)) if is_log_y else None
+    if is_log_y:
+        rmse_real = np.sqrt(max(s_yy - 2 * fc * s_ye + fc ** 2 * s_ee, 0.0) / n)
+        syx_pct = (rmse_real / y_mean_real) * 100 if y_mean_real != 0 else 0
+    else:
+        syx_pct = (rmse / y_mean_real) * 100 if y_mean_real != 0 else 0
+
+    sample = sample[np.argsort(sample[:, 0], kind="stable")]
+    params = dict(zip(names, beta.tolist()))
+    return ModelResult(
+        equation_original=equation,
+        equation_fitted=_format_fitted_equation(params, y_var_sym, is_log_y),
+        r2_adj=r2_adj, rmse=rmse, fc_meyer=fc, syx_pct=syx_pct,
+        aic=aic, bic=bic, durbin_watson=dw_stat, n_obs=int(n),
+        coefs=params, is_log=is_log_y, y_col_real=y_col_real,
+        source=str(source) if isinstance(source, (str, os.PathLike)) else type(source).__name__,
+        # Amostra: posições na fonte, observado e previsto (escala do ajuste)
+        row_index=sample[:, 0].astype(np.int64), y_real=sample[:, 1], y_pred=sample[:, 2],
+    )
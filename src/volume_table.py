@@ -0,0 +1,155 @@
+# src/volume_table.py
+
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Optional, Tuple, Union
+
+from src.config import VOLUME_TABLE_DAP_STEP, VOLUME_TABLE_HT_STEP
+from src.cache import cached_render, dataset_fingerprint
+from src.importer import normalize_header
+from src.manual_model import SAFE_MATH, compile_manual_equation
+from src.profiling import span
+
+
+def _predictor(results) -> Tuple[Any, bool, float, Dict[str, float]]:
+    """
+    Equação ajustada compilada uma vez: (código, exp no fim?, fator, coeficientes no ambiente).
+    OLS: soma coef*termo na escala do ajuste, com Meyer na volta do log.
+    Manual: o lado direito informado pelo usuário (sem fator de Meyer).
+    """
+    coefs = {k: float(v) for k, v in results.get('coefs', {}).items()}
+    if results.get('method') == "Manual":
+        code, is_log, _ = compile_manual_equation(results['equation_original'])
+        return code, is_log, 1.0, coefs
+    parts = [f"({v!r})" if k == "const" else f"({v!r})*({k})" for k, v in coefs.items()]
+    code = compile(" + ".join(parts) or "0.0", "<equacao_ajustada>", "eval")
+    return code, bool(results.get('is_log')), float(results.get('fc_meyer') or 1.0), {}
+
+
+def _dimension_aliases(results, names) -> Tuple[Optional[str], Optional[str], list]:
+    """Apelidos de DAP e HT usados na equação (pelo nome da coluna ou do apelido); o resto não tem eixo."""
+    dap = ht = None
+    others = []
+    for alias, col in results.get('alias_map_used', {}).items():
+        if alias not in names or col == results.get('y_col_real'):
+            continue
+        kind = normalize_header(col) if normalize_header(col) in ("dap", "ht") else normalize_header(alias)
+        if kind == "dap" and dap is None: dap = alias
+        elif kind == "ht" and ht is None: ht = alias
+        else: others.append(alias)
+    return dap, ht, others
+
+
+def _classes(lo: float, hi: float, step: float) -> np.ndarray:
+    """Centros de classe cobrindo [lo, hi] (limites múltiplos de 'step')."""
+    start = np.floor(lo / step) * step
+    stop = np.ceil(hi / step) * step
+    if stop <= start: stop = start + step
+    return np.arange(start + step / 2, stop, step)
+
+
+def volume_table(results, df_original: Optional[pd.DataFrame] = None, dap_step: float = VOLUME_TABLE_DAP_STEP,
+                 ht_step: float = VOLUME_TABLE_HT_STEP) -> Union[pd.DataFrame, Dict[str, str]]:
+    """
+    Tabela de volume (classes de DAP x classes de HT) ou de altura (só DAP) do modelo.
+
+    A equação compilada é avaliada uma vez sobre a grade: DAP como coluna (nd, 1)
+    e HT como linha (1, nh), e o broadcast do NumPy produz a matriz inteira.
+    Modelos em ln(Y) voltam à escala real com o fator de Meyer.
+
+    Células fora da faixa ajustada ficam NaN: para cada classe de DAP, vale a
+    faixa de HT das árvores daquela classe e das vizinhas (meia classe de folga),
+    o que evita extrapolar combinações que não existem nos dados (DAP fino com HT alta).
+    df_original é o DataFrame do ajuste; as linhas usadas saem de results['row_index'].
+    """
+    try:
+        code, back_log, fc, env_coefs = _predictor(results)
+    except (ValueError, SyntaxError) as e:
+        return {"error": f"Equação inválida: {e}"}
+
+    names = set(code.co_names)
+    dap, ht, others = _dimension_aliases(results, names)
+    if dap is None: return {"error": "A equação não usa uma coluna de DAP: não há eixo para a tabela."}
+    if others: return {"error": f"A equação usa variáveis além de DAP e HT ({', '.join(others)}): não há tabela 2D."}
+    if df_original is None: return {"error": "Dados do ajuste indisponíveis: sem eles não há faixa para as classes."}
+
+    alias_map = results['alias_map_used']
+    row_index = results['row_index']
+    if len(row_index) and row_index.max() >= len(df_original):
+        return {"error": "O DataFrame não corresponde ao ajuste (linhas fora do intervalo)."}
+
+    with span("tabela_volume.grade", rows=len(row_index)) as sp:
+        d_obs = pd.to_numeric(df_original[alias_map[dap]].iloc[row_index], errors='coerce').to_numpy(dtype=float)
+        d_classes = _classes(np.nanmin(d_obs), np.nanmax(d_obs), dap_step)
+        nd = len(d_classes)
+
+        env = dict(SAFE_MATH)
+        env.update(env_coefs)
+        env[dap] = d_classes[:, np.newaxis]
+        if ht is not None:
+            h_obs = pd.to_numeric(df_original[alias_map[ht]].iloc[row_index], errors='coerce').to_numpy(dtype=float)
+            h_classes = _classes(np.nanmin(h_obs), np.nanmax(h_obs), ht_step)
+            env[ht] = h_classes[np.newaxis, :]
+        else:
+            h_classes = np.array([np.nan])
+
+        with np.errstate(all='ignore'):
+            try:
+                values = eval(code, {"__builtins__": {}}, env)
+            except Exception as e:
+                return {"error": f"Erro matemático na equação: {e}"}
+            values = np.array(np.broadcast_to(np.asarray(values, dtype=float), (nd, len(h_classes))))
+            if back_log:
+                values = np.exp(values) * fc
+
+        # Faixa ajustada: envelope de HT por classe de DAP (com as classes vizinhas)
+        d_idx = np.clip(((d_obs - (d_classes[0] - dap_step / 2)) // dap_step).astype(int), 0, nd - 1)
+        inside = np.zeros(nd, dtype=bool)
+        inside[d_idx] = True
+        inside = inside | np.r_[inside[1:], False] | np.r_[False, inside[:-1]]
+        valid = np.broadcast_to(inside[:, np.newaxis], values.shape).copy()
+        if ht is not None:
+            h_lo = np.full(nd, np.inf); h_hi = np.full(nd, -np.inf)
+            np.minimum.at(h_lo, d_idx, h_obs)
+            np.maximum.at(h_hi, d_idx, h_obs)
+            h_lo = np.minimum.reduce([h_lo, np.r_[h_lo[1:], np.inf], np.r_[np.inf, h_lo[:-1]]])
+            h_hi = np.maximum.reduce([h_hi, np.r_[h_hi[1:], -np.inf], np.r_[-np.inf, h_hi[:-1]]])
+            H = h_classes[np.newaxis, :]
+            valid &= (H >= h_lo[:, np.newaxis] - ht_step / 2) & (H <= h_hi[:, np.newaxis] + ht_step / 2)
+        valid &= np.isfinite(values)
+        values[~valid] = np.nan
+        sp.rows = values.size
+
+    y_label = results.get('y_col_real') or "Y"
+    table = pd.DataFrame(values, index=pd.Index(d_classes, name=alias_map[dap]),
+                         columns=pd.Index(h_classes, name=alias_map[ht]) if ht is not None else [y_label])
+    table.attrs.update({
+        "y": y_label, "dap": alias_map[dap], "ht": alias_map[ht] if ht is not None else None,
+        "dap_step": dap_step, "ht_step": ht_step if ht is not None else None,
+        "celulas_mascaradas": int((~valid).sum()),
+    })
+    return table
+
+
+def volume_table_cached(results, df_original: Optional[pd.DataFrame] = None, scope=None, **kwargs):
+    """
+    volume_table memorizada por resultado. 'scope' identifica o DataFrame; por padrão
+    é o dataset_ref do resultado (chave no armazenamento) ou, sem ele, o hash do df.
+    """
+    if df_original is None:
+        scope = ("sem_dados",)
+    elif scope is None:
+        scope = (results.get('dataset_ref') or dataset_fingerprint(df_original),)
+    scope = tuple(scope) + tuple(sorted(kwargs.items()))
+    return cached_render(results, "tabela_volume", scope, lambda: volume_table(results, df_original, **kwargs))
+
+
+def volume_table_long(table: pd.DataFrame) -> pd.DataFrame:
+    """Formato longo (uma célula por linha) para a exportação colunar; células mascaradas ficam de fora."""
+    values = table.to_numpy()
+    d, j = np.nonzero(np.isfinite(values))
+    long = pd.DataFrame({"dap": table.index.to_numpy(dtype=float)[d]})
+    if table.attrs.get("ht"):
+        long["ht"] = table.columns.to_numpy(dtype=float)[j]
+    long[table.attrs.get("y", "valor")] = values[d, j]
+    return long
@@ -0,0 +1,194 @@
+# src/weighted_model.py
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+from statsmodels.stats.stattools import durbin_watson
+from typing import Any, Dict, Optional, Sequence, Union
+
+from src.config import WLS_K_GRID, WLS_BLOCK_ELEMENTS
+from src.external_model import _parse_equation, _shield_columns, _build_design, _format_fitted_equation, apply_shield
+from src.importer import normalize_header
+from src.influence import leverage_from_pinv
+from src.results import ModelResult
+from src.profiling import span
+from src.jobs import checkpoint
+
+# Critérios para escolher k: AIC da verossimilhança ponderada (comparável entre k),
+# Syx% na escala real, ou a correlação |resíduo ponderado| x previsto (funil).
+WLS_CRITERIA = {"aic": "AIC (verossimilhança)", "syx": "Syx % (escala real)", "hetero": "Heterocedasticidade residual"}
+
+
+def default_k_values() -> np.ndarray:
+    start, stop, step = WLS_K_GRID
+    return np.round(np.arange(start, stop + step / 2, step), 10)
+
+
+def weight_search(X: np.ndarray, y: np.ndarray, d: np.ndarray, k_values: Sequence[float], y_real: Optional[np.ndarray] = None,
+                  is_log: bool = False, block_elements: int = WLS_BLOCK_ELEMENTS) -> pd.DataFrame:
+    """
+    Avalia WLS com pesos w = 1/d^k para todos os k de uma vez.
+
+    1ª passada: X'WX e X'Wy de todos os k (einsum sobre blocos de linhas, matriz de
+    pesos n_bloco x K) e uma resolução em lote (K sistemas p x p).
+    2ª passada: somas dos resíduos de todos os k, das quais saem o AIC ponderado
+    (com o termo ½·Σ ln w, comparável entre k), o Syx% real e a correlação entre
+    |resíduo ponderado| e o previsto. Memória limitada a ~block_elements valores por bloco.
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    k = np.asarray(k_values, dtype=float)
+    n, p = X.shape
+    K = len(k)
+    log_d = np.log(np.asarray(d, dtype=float))
+    y_real = y if y_real is None else np.asarray(y_real, dtype=float)
+    block = max(1, int(block_elements // max(K * p, 1)))
+
+    with span("wls.normais_em_lote", rows=n * K):
+        G = np.zeros((K, p, p))
+        b = np.zeros((K, p))
+        for s in range(0, n, block):
+            checkpoint(f"Busca de k ({K} valores): normais, {s:,} de {n:,} linhas", 0.1 + 0.3 * s / n)
+            Xb, yb = X[s:s + block], y[s:s + block]
+            W = np.exp(-np.outer(log_d[s:s + block], k))
+            G += np.einsum("ik,ip,iq->kpq", W, Xb, Xb, optimize=True)
+            b += np.einsum("ik,ip->kp", W, Xb * yb[:, np.newaxis], optimize=True)
+        beta = np.linalg.solve(G, b[..., np.newaxis])[..., 0]  # (K, p)
+
+    with span("wls.residuos_em_lote", rows=n * K):
+        acc = {name: np.zeros(K) for name in ("ssr_w", "ssr", "a", "a2", "f", "f2", "af", "yef", "e2f")}
+        for s in range(0, n, block):
+            checkpoint(f"Busca de k ({K} valores): resíduos, {s:,} de {n:,} linhas", 0.4 + 0.3 * s / n)
+            Xb, yb, yrb = X[s:s + block], y[s:s + block], y_real[s:s + block]
+            W = np.exp(-np.outer(log_d[s:s + block], k))
+            F = Xb @ beta.T
+            E = yb[:, np.newaxis] - F
+            A = np.abs(E) * np.sqrt(W)
+            acc["ssr_w"] += np.einsum("ik,ik->k", W * E, E)
+            acc["ssr"] += np.einsum("ik,ik->k", E, E)
+            acc["a"] += A.sum(axis=0); acc["a2"] += (A * A).sum(axis=0)
+            acc["f"] += F.sum(axis=0); acc["f2"] += (F * F).sum(axis=0); acc["af"] += (A * F).sum(axis=0)
+            if is_log:
+                with np.errstate(over="ignore"):
+                    eF = np.exp(F)
+                acc["yef"] += (yrb[:, np.newaxis] * eF).sum(axis=0)
+                acc["e2f"] += (eF * eF).sum(axis=0)
+
+    sum_log_w = -k * log_d.sum()
+    llf = -n / 2.0 * (np.log(2 * np.pi) + np.log(acc["ssr_w"] / n) + 1) + 0.5 * sum_log_w
+    mse = acc["ssr"] / (n - p)
+    y_mean_real = y_real.mean()
+    if is_log:
+        fc = np.exp(mse / 2.0)
+        ss_real = (y_real @ y_real) - 2 * fc * acc["yef"] + fc ** 2 * acc["e2f"]
+        syx = np.sqrt(np.clip(ss_real, 0, None) / n) / y_mean_real * 100
+    else:
+        syx = np.sqrt(mse) / y_mean_real * 100
+    cov = acc["af"] / n - (acc["a"] / n) * (acc["f"] / n)
+    var_a = acc["a2"] / n - (acc["a"] / n) ** 2
+    var_f = acc["f2"] / n - (acc["f"] / n) ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hetero = np.abs(cov / np.sqrt(var_a * var_f))
+
+    table = pd.DataFrame({"k": k, "aic": -2 * llf + 2 * p, "syx": syx, "hetero": hetero})
+    table.attrs["beta"] = beta
+    return table
+
+
+def fit_wls_weight_search(df: pd.DataFrame, equation: str, alias_map: Dict[str, str], weight_alias: Optional[str] = None,
+                          k_values: Optional[Sequence[float]] = None, criterion: str = "aic") -> Union[ModelResult, Dict[str, Any]]:
+    """
+    WLS com pesos 1/X^k (X = DAP por padrão) e k escolhido numa busca em lote.
+
+    Blindagem e matriz X são feitas uma vez; todos os k são avaliados por
+    weight_search e só o k vencedor vira um ajuste completo (sm.WLS), com as
+    mesmas métricas do OLS para relatório e gráficos. O Fator de Meyer usa a
+    variância residual não ponderada na escala log. A busca fica em result['weights'].
+    """
+    with span("modelo.fit_wls_weight_search", rows=len(df)):
+        return _fit_wls_weight_search(df, equation, alias_map, weight_alias, k_values, criterion)
+
+
+def _fit_wls_weight_search(df, equation, alias_map, weight_alias, k_values, criterion):
+    if criterion not in WLS_CRITERIA: return {"error": f"Critério inválido: {criterion}."}
+    try:
+        y_var_sym, is_log_y, y_col_real, rhs_equation, x_vars_sym = _parse_equation(equation, alias_map)
+    except ValueError as e: return {"error": str(e)}
+    if y_col_real not in df.columns: return {"error": f"Coluna '{y_col_real}' inexistente."}
+
+    if weight_alias is None:
+        weight_alias = next((a for a in x_vars_sym if normalize_header(alias_map.get(a, "")) == "dap"), None)
+    weight_col = alias_map.get(weight_alias) if weight_alias else None
+    if not weight_col or weight_col not in df.columns:
+        return {"error": "Informe a variável dos pesos (ex: DAP)."}
+    k_values = default_k_values() if k_values is None else np.asarray(k_values, dtype=float)
+    if not len(k_values): return {"error": "Nenhum valor de k para testar."}
+
+    checkpoint("Shield: filtros físico e IQR...", 0.05)
+    try:
+        cols = _shield_columns(df, y_col_real, x_vars_sym, alias_map)
+        df_filtered = apply_shield(df, list(dict.fromkeys(cols + [weight_col])))
+        if len(df_filtered) < 3:
+            return {"error": "Dados insuficientes após remoção de erros e outliers."}
+        with span("modelo.matriz_x", rows=len(df_filtered)):
+            X_df = _build_design(df_filtered, rhs_equation, x_vars_sym, alias_map)
+        idx = X_df.index
+        y_real = df_filtered.loc[idx, y_col_real].to_numpy(dtype=float)
+        y = np.log(y_real) if is_log_y else y_real
+        d = df_filtered.loc[idx, weight_col].to_numpy(dtype=float)
+        X = X_df.to_numpy(dtype=float)
+        if len(y) <= X.shape[1] + 1:
+            return {"error": "Número insuficiente de dados válidos (< 3) para regressão."}
+
+        search = weight_search(X, y, d, k_values, y_real=y_real, is_log=is_log_y)
+        best = int(np.nanargmin(search[criterion].to_numpy()))
+        k_best = float(search["k"].iloc[best])
+
+        # Ajuste final só do k escolhido: métricas idênticas às do statsmodels
+        w = d ** -k_best
+        checkpoint(f"Ajuste final com k = {k_best:g}...", 0.75)
+        with span("modelo.wls", rows=len(y)):
+            results = sm.WLS(y, X_df, weights=w).fit()
+    except np.linalg.LinAlgError:
+        return {"error": "X'WX singular: termos redundantes na equação."}
+    except Exception as e:
+        return {"error": f"Erro crítico no processamento: {str(e)}"}
+
+    checkpoint("Métricas e diagnósticos...", 0.85)
+    with span("modelo.metricas", rows=len(y)):
+        fitted = results.fittedvalues.to_numpy(dtype=float)
+        resid = y - fitted
+        rank = int(results.df_model + results.k_constant)
+        fc = float(np.exp(float(resid @ resid) / (len(y) - rank) / 2.0)) if is_log_y else None
+        y_mean_real = y_real.mean()
+        if is_log_y:
+            rmse_real = np.sqrt(((y_real - np.exp(fitted) * fc) ** 2).mean())
+            syx_pct = (rmse_real / y_mean_real) * 100 if y_mean_real != 0 else 0
+        else:
+            syx_pct = (np.sqrt(float(resid @ resid) / (len(y) - rank)) / y_mean_real) * 100 if y_mean_real != 0 else 0
+        # Influência no espaço ponderado (√w·X, √w·e): alavancagem da pseudo-inversa do ajuste
+        leverage = leverage_from_pinv(results.model.wexog, results.model.pinv_wexog)
+
+    eq_final = _format_fitted_equation(results.params.to_dict(), y_var_sym, is_log_y) + f"  [pesos 1/{weight_alias}^{k_best:g}]"
+    return ModelResult(
+        equation_original=equation,
+        equation_fitted=eq_final,
+        r2_adj=results.rsquared_adj,
+        rmse=np.sqrt(results.mse_resid),
+        fc_meyer=fc,
+        syx_pct=syx_pct,
+        aic=results.aic,
+        bic=results.bic,
+        durbin_watson=durbin_watson(resid),
+        n_obs=int(results.nobs),
+        coefs=results.params.to_dict(),
+        is_log=is_log_y,
+        y_col_real=y_col_real,
+        weights={"variavel": weight_alias, "coluna": weight_col, "k": k_best, "criterio": criterion,
+                 "busca": search.to_dict(orient="records")},
+        row_index=df.index.get_indexer(idx),
+        y_real=y,
+        y_pred=fitted,
+        leverage=leverage,
+        resid_weight=np.sqrt(w)
+    )